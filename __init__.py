@@ -1,14 +1,48 @@
+import os
 from pathlib import Path
 from flask import Flask
 
 from .db import db
+from .cache import LRUCache
+from .storage import configure_engine_options, init_storage
+from .routing import replica_binds, init_routing
+from .passwords import init_passwords
+from .sessions import init_sessions
+from .profiling import init_profiling
+from .metrics import init_metrics
+from .assets import init_assets
+from .httpcache import init_http_cache
+from .images import init_images
+from .fragments import init_fragments
+from .utils import init_cart
 from .main import bp as main_bp
 from .auth import bp as auth_bp
 from .admin import bp as admin_bp
-from .cli import init_db_command, seed_command
+from .cli import (
+    init_db_command,
+    seed_command,
+    bench_search_command,
+    sweep_reservations_command,
+    stress_stock_command,
+    bench_storage_command,
+    sync_replicas_command,
+    rebuild_stats_command,
+    gc_sessions_command,
+    import_products_command,
+    export_products_command,
+    generate_data_command,
+    bench_app_command,
+    serve_command,
+    bench_serve_command,
+    worker_command,
+    ingest_images_command,
+    build_assets_command,
+    bench_render_command,
+    check_http_cache_command,
+)
 
 
-def create_app():
+def create_app(test_config=None):
     base_dir = Path(__file__).resolve().parent.parent  # папка проекта (где run.py)
     templates_dir = base_dir / "templates"
     static_dir = base_dir / "static"
@@ -27,11 +61,93 @@ def create_app():
 
     app.config.update(
         SECRET_KEY="dev-secret-change-me",
-        SQLALCHEMY_DATABASE_URI=f"sqlite:///{db_path.as_posix()}",
+        # DATABASE_URL — другая основная БД (например postgresql://...), иначе SQLite в instance/
+        SQLALCHEMY_DATABASE_URI=os.environ.get("DATABASE_URL") or f"sqlite:///{db_path.as_posix()}",
         SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        CATALOG_PAGE_SIZE=24,
+        ADMIN_PAGE_SIZE=50,
+        ACCOUNT_ORDERS_PAGE_SIZE=20,
+        PRODUCT_CACHE_SIZE=2048,
+        PRODUCT_CACHE_TTL=300,
+        CART_API_MAX_OPS=100,         # операций в одном пакете POST /api/cart
+        STOCK_RESERVE_ON_ADD=False,   # резервировать остаток при добавлении в корзину
+        STOCK_RESERVATION_TTL=900,    # сек, после — резерв возвращается на склад
+        SQLITE_PROFILE="production",  # см. storage.py: production (WAL и т.д.) / legacy
+        SQLITE_PRAGMAS={},            # точечные переопределения PRAGMA профиля
+        # реплики только для чтения (через запятую в DATABASE_REPLICA_URLS)
+        READ_REPLICA_URIS=[u for u in os.environ.get("DATABASE_REPLICA_URLS", "").split(",") if u],
+        READ_YOUR_WRITES_SECONDS=5,   # после записи клиент столько читает только из основной БД
+        PASSWORD_HASH_METHOD="scrypt:32768:8:1",  # смена параметров -> перехэш при входе
+        PASSWORD_HASH_WORKERS=2,      # процессов для хэширования (0 — в потоке запроса)
+        PASSWORD_HASH_QUEUE=32,       # сколько хэширований одновременно в работе/очереди
+        PASSWORD_HASH_TIMEOUT=5,      # сек ждать место в очереди, потом «перегружен»
+        LOGIN_MAX_FAILURES=5,         # неудачных входов на логин ...
+        LOGIN_FAILURE_WINDOW=300,     # ... за столько секунд, потом пауза
+        SESSION_BACKEND="db",         # см. sessions.py: db / memory / redis / cookie
+        SESSION_REDIS_URL=None,       # для redis; без него — LocalRedis в процессе
+        SESSION_GC_PROBABILITY=0.01,  # доля записей сессии, после которых чистим просроченные
+        PROFILE_REQUESTS=False,       # см. profiling.py: SQL и шаблоны на каждый запрос
+        PROFILE_SLOW_MS=500,          # запрос дольше — в лог с отпечатками SQL
+        PROFILE_MAX_QUERIES=30,       # ... или больше стольких SQL-выражений
+        PROFILE_SERVER_TIMING=False,  # заголовок Server-Timing в ответах
+        QUERY_BUDGETS={},             # {"main.cart": 5} — при TESTING превышение = AssertionError
+        METRICS_ENABLED=True,         # см. metrics.py: GET /metrics в формате Prometheus
+        METRICS_TOKEN=os.environ.get("METRICS_TOKEN"),  # если задан — Authorization: Bearer <token>
+        METRICS_DIR=os.environ.get("METRICS_DIR"),      # общая папка снимков для нескольких процессов
+        METRICS_FLUSH_INTERVAL=5,     # сек между записями снимка процесса в METRICS_DIR
+        HTTP_CACHE_SHARED_MAX_AGE=30,  # сек: s-maxage гостевых страниц витрины для обратного прокси
+        FRAGMENT_CACHE="memory",      # см. fragments.py: {% cache %} в шаблонах — memory / redis / none
+        FRAGMENT_CACHE_SIZE=20_000,   # фрагментов в памяти процесса (карточки, шапка)
+        FRAGMENT_CACHE_TTL=3600,      # сек жизни фрагмента (ключи с версией товара — это не срок свежести)
+        FRAGMENT_CACHE_REDIS_URL=os.environ.get("FRAGMENT_CACHE_REDIS_URL"),  # для redis; без него — LocalRedis
+        ASSETS_DIR="dist",            # см. assets.py: папка сборки статики внутри static/
+        ASSETS_FINGERPRINT=True,      # url_for('static') -> файл с отпечатком (если сборка есть)
+        JOBS_BATCH_SIZE=20,           # см. jobs.py: сколько задач воркер забирает за раз
+        JOBS_POLL_INTERVAL=1.0,       # сек ждать, когда очередь пуста
+        JOBS_LEASE_SECONDS=60,        # сек аренды задачи; не завершил — её заберёт другой воркер
+        JOBS_MAX_ATTEMPTS=5,          # попыток по умолчанию, потом статус failed
+        JOBS_BACKOFF_BASE=5,          # сек до 2-й попытки, дальше вдвое больше ...
+        JOBS_BACKOFF_MAX=3600,        # ... но не больше
+        JOBS_KEEP_DONE_DAYS=7,        # столько дней хранить выполненные задачи (и их ключи)
+        # картинки товаров (см. images.py); IMAGE_DIR — общая папка для всех процессов
+        IMAGE_DIR=os.environ.get("IMAGE_DIR") or str(Path(app.instance_path) / "images"),
+        IMAGE_MAX_BYTES=10 * 1024 * 1024,  # больше — не качаем и не принимаем
+        IMAGE_MAX_PIXELS=40_000_000,  # защита от «бомб» распаковки
+        IMAGE_FETCH_TIMEOUT=10,       # сек на скачивание исходника
+        IMAGE_WEBP_QUALITY=80,
+        IMAGE_JPEG_QUALITY=82,
+        # продакшн-сервер (см. serve.py, `python run.py serve`)
+        SERVER_BIND=os.environ.get("BIND", "0.0.0.0:5000"),
+        SERVER_WORKERS=int(os.environ.get("WEB_CONCURRENCY", 0)) or (os.cpu_count() or 1) * 2 + 1,
+        SERVER_THREADS=4,             # потоков в каждом воркере
+        SERVER_TIMEOUT=30,            # сек: зависший дольше воркер перезапускается
+        SERVER_GRACEFUL_TIMEOUT=30,   # сек на завершение текущих запросов при остановке/HUP
+        SERVER_KEEPALIVE=5,           # сек держать простаивающее keep-alive соединение
+        SERVER_MAX_REQUESTS=10_000,   # перезапуск воркера после стольких запросов (0 — никогда)
     )
+    if test_config:
+        app.config.update(test_config)
+    app.config["SQLALCHEMY_BINDS"] = {
+        **(app.config.get("SQLALCHEMY_BINDS") or {}),
+        **replica_binds(app.config["READ_REPLICA_URIS"]),
+    }
 
+    configure_engine_options(app)
     db.init_app(app)
+    init_storage(app, db)
+    init_routing(app)
+    init_passwords(app)
+    init_sessions(app)
+    init_profiling(app)
+    app.extensions["product_cache"] = LRUCache(
+        maxsize=app.config["PRODUCT_CACHE_SIZE"], ttl=app.config["PRODUCT_CACHE_TTL"]
+    )
+    init_metrics(app)
+    init_assets(app)
+    init_http_cache(app)  # после init_assets: ETag страниц зависит от сборки статики
+    init_cart(app)  # после init_http_cache: буфер корзины пишется раньше cookie cart_count
+    init_images(app)
+    init_fragments(app)  # после init_http_cache: ключи фрагментов с build_id
 
     app.register_blueprint(main_bp)
     app.register_blueprint(auth_bp)
@@ -39,6 +155,24 @@ def create_app():
 
     app.cli.add_command(init_db_command)
     app.cli.add_command(seed_command)
+    app.cli.add_command(bench_search_command)
+    app.cli.add_command(sweep_reservations_command)
+    app.cli.add_command(stress_stock_command)
+    app.cli.add_command(bench_storage_command)
+    app.cli.add_command(sync_replicas_command)
+    app.cli.add_command(rebuild_stats_command)
+    app.cli.add_command(gc_sessions_command)
+    app.cli.add_command(import_products_command)
+    app.cli.add_command(export_products_command)
+    app.cli.add_command(generate_data_command)
+    app.cli.add_command(bench_app_command)
+    app.cli.add_command(serve_command)
+    app.cli.add_command(bench_serve_command)
+    app.cli.add_command(worker_command)
+    app.cli.add_command(ingest_images_command)
+    app.cli.add_command(build_assets_command)
+    app.cli.add_command(bench_render_command)
+    app.cli.add_command(check_http_cache_command)
 
     from .utils import current_user, cart_count
     app.jinja_env.globals.update(current_user=current_user, cart_count=cart_count)
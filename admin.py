@@ -1,29 +1,65 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
-from werkzeug.security import generate_password_hash
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app
 from .db import db
 from .models import Product, Order, User
 from .utils import admin_required, current_user
+from .catalog import invalidate_product
+from .orders import ORDER_STATUSES, orders_page, orders_summary, parse_date
+from .stats import dashboard_stats, daily_stats
+from .routing import replica_ok
+from .passwords import HashingBusy, hash_password
+from .images import ImageError, ingest_bytes
+from .jobs import enqueue
 
 bp = Blueprint("admin", __name__, url_prefix="/admin")
 
 
 @bp.get("/")
+@replica_ok
 @admin_required
 def dashboard():
-    stats = {
-        "users": User.query.count(),
-        "products": Product.query.count(),
-        "orders": Order.query.count(),
-    }
+    stats = dashboard_stats()  # материализованные счётчики, без COUNT(*) по таблицам
     latest_orders = Order.query.order_by(Order.id.desc()).limit(10).all()
-    return render_template("admin/dashboard.html", stats=stats, latest_orders=latest_orders)
+    return render_template(
+        "admin/dashboard.html", stats=stats, latest_orders=latest_orders, daily=daily_stats(14)
+    )
 
 
 # -------------------------
 # Товары
 # -------------------------
 
+def _parse_stock(value):
+    """Поле «Остаток»: пусто — не учитывать количество, иначе целое >= 0.
+    Что-то другое — ValueError: опечатка не должна молча снимать учёт остатка.
+    """
+    value = (value or "").strip()
+    if not value:
+        return None
+    stock = int(value)
+    if stock < 0:
+        raise ValueError(f"negative stock: {stock}")
+    return stock
+
+
+def _apply_image(p, old_url):
+    """Картинка из формы (p уже в сессии, с id): загруженный файл обрабатывается сразу,
+    новая ссылка — в фоне задачей image.ingest. Не картинка — flash, товар сохраняется без неё.
+    """
+    upload = request.files.get("image_file")
+    if upload and upload.filename:
+        try:
+            p.image_key = ingest_bytes(upload.read(current_app.config["IMAGE_MAX_BYTES"] + 1))
+        except (ImageError, RuntimeError) as e:
+            flash(f"Картинка не сохранена: {e}", "warning")
+        return
+    if p.image_url != old_url:
+        p.image_key = None  # до обработки витрина покажет саму ссылку
+        if p.image_url:
+            enqueue("image.ingest", {"product_id": p.id, "url": p.image_url})
+
+
 @bp.get("/products")
+@replica_ok
 @admin_required
 def products():
     products = Product.query.order_by(Product.id.desc()).all()
@@ -49,6 +85,11 @@ def product_new_post():
     if not title:
         flash("Название обязательно.", "warning")
         return redirect(url_for("admin.product_new"))
+    try:
+        stock = _parse_stock(request.form.get("stock"))
+    except ValueError:
+        flash("Остаток — целое число от 0; оставьте поле пустым, чтобы не учитывать количество.", "warning")
+        return redirect(url_for("admin.product_new"))
 
     p = Product(
         title=title,
@@ -57,9 +98,13 @@ def product_new_post():
         category=category,
         image_url=image_url,
         is_active=is_active,
+        stock=stock,
     )
     db.session.add(p)
+    db.session.flush()
+    _apply_image(p, None)
     db.session.commit()
+    invalidate_product(p.id)
     flash("Товар добавлен.", "success")
     return redirect(url_for("admin.products"))
 
@@ -81,15 +126,24 @@ def product_edit_post(pid: int):
     if not p:
         flash("Товар не найден.", "warning")
         return redirect(url_for("admin.products"))
+    try:
+        stock = _parse_stock(request.form.get("stock"))
+    except ValueError:
+        flash("Остаток — целое число от 0; оставьте поле пустым, чтобы не учитывать количество.", "warning")
+        return redirect(url_for("admin.product_edit", pid=pid))
 
     p.title = request.form.get("title", "").strip()
     p.description = request.form.get("description", "").strip()
     p.price = int(request.form.get("price", 0) or 0)
     p.category = request.form.get("category", "Другое").strip() or "Другое"
+    old_url = p.image_url
     p.image_url = request.form.get("image_url", "").strip()
     p.is_active = True if request.form.get("is_active") == "on" else False
+    p.stock = stock
+    _apply_image(p, old_url)
 
     db.session.commit()
+    invalidate_product(pid)
     flash("Изменения сохранены.", "success")
     return redirect(url_for("admin.products"))
 
@@ -101,19 +155,52 @@ def product_delete(pid: int):
     if p:
         db.session.delete(p)
         db.session.commit()
+        invalidate_product(pid)
         flash("Товар удалён.", "info")
     return redirect(url_for("admin.products"))
 
 
+@bp.get("/cache")
+@admin_required
+def cache_stats():
+    """Счётчики кэша каталога (hits/misses/evictions) и кэша фрагментов шаблонов."""
+    fragments = current_app.extensions.get("fragment_cache")
+    return jsonify(
+        **current_app.extensions["product_cache"].stats(),
+        fragments=fragments.stats() if fragments is not None else None,
+    )
+
+
 # -------------------------
 # Заказы
 # -------------------------
 
 @bp.get("/orders")
+@replica_ok
 @admin_required
 def orders():
-    orders = Order.query.order_by(Order.id.desc()).all()
-    return render_template("admin/orders.html", orders=orders)
+    status = request.args.get("status", "").strip()
+    if status not in ORDER_STATUSES:
+        status = ""
+    date_from = parse_date(request.args.get("date_from"))
+    date_to = parse_date(request.args.get("date_to"))
+    filters = dict(status=status or None, date_from=date_from, date_to=date_to)
+
+    orders, next_cursor = orders_page(
+        cursor=request.args.get("cursor"), limit=current_app.config["ADMIN_PAGE_SIZE"], **filters
+    )
+    # итоги считаем только для суженной выборки: по всей таблице это полный скан
+    summary = orders_summary(**filters) if any(filters.values()) else None
+    return render_template(
+        "admin/orders.html",
+        orders=orders,
+        next_cursor=next_cursor,
+        summary=summary,
+        statuses=ORDER_STATUSES,
+        status=status,
+        date_from=request.args.get("date_from", ""),
+        date_to=request.args.get("date_to", ""),
+    )
 
 
 # -------------------------
@@ -121,6 +208,7 @@ def orders():
 # -------------------------
 
 @bp.get("/users")
+@replica_ok
 @admin_required
 def users():
     q = request.args.get("q", "").strip()
@@ -182,7 +270,12 @@ def user_edit_post(uid: int):
         if len(new_password) < 6:
             flash("Пароль должен быть минимум 6 символов.", "warning")
             return redirect(url_for("admin.user_edit", uid=uid))
-        u.password_hash = generate_password_hash(new_password)
+        try:
+            u.password_hash = hash_password(new_password)
+        except HashingBusy:
+            db.session.rollback()
+            flash("Сервис перегружен, попробуйте ещё раз.", "warning")
+            return redirect(url_for("admin.user_edit", uid=uid))
 
     db.session.commit()
     flash("Пользователь обновлён.", "success")
@@ -221,6 +314,7 @@ def user_delete(uid: int):
 
 
 @bp.get("/users/<int:uid>/orders")
+@replica_ok
 @admin_required
 def user_orders(uid: int):
     u = db.session.get(User, uid)
@@ -228,5 +322,10 @@ def user_orders(uid: int):
         flash("Пользователь не найден.", "warning")
         return redirect(url_for("admin.users"))
 
-    orders = Order.query.filter_by(user_id=u.id).order_by(Order.id.desc()).all()
-    return render_template("admin/user_orders.html", u=u, orders=orders)
\ No newline at end of file
+    orders, next_cursor = orders_page(
+        user_id=u.id, cursor=request.args.get("cursor"), limit=current_app.config["ADMIN_PAGE_SIZE"]
+    )
+    summary = orders_summary(user_id=u.id)
+    return render_template(
+        "admin/user_orders.html", u=u, orders=orders, next_cursor=next_cursor, summary=summary
+    )
\ No newline at end of file
@@ -5,6 +5,13 @@
     menuBtn.addEventListener("click", () => menu.classList.toggle("open"));
   }
 
+  // Cart badge: for guests the page is cached without it, the count comes from a cookie
+  const badgeCookie = document.cookie.split("; ").find(c => c.startsWith("cart_count="));
+  const count = badgeCookie ? badgeCookie.split("=")[1] : "0";
+  document.querySelectorAll("[data-cart-badge]").forEach(el => {
+    if (!el.textContent.trim()) el.textContent = count;
+  });
+
   // Tabs on home mobile auth
   const tabs = document.querySelectorAll(".auth-tabs .tab");
   if (tabs.length) {
@@ -0,0 +1,182 @@
+"""Статика с отпечатками: styles.css -> dist/css/styles.<хэш>.css, рядом .gz и .br.
+
+`flask build-assets` (и `python run.py serve` перед запуском) копирует файлы static/
+в static/<ASSETS_DIR>/ с хэшем содержимого в имени и пишет manifest.json:
+{"files": {"css/styles.css": "dist/css/styles.1a2b3c4d5e.css"}, "encodings": {...}}.
+В CSS ссылки url(...) на другие файлы static/ переписываются на их версии с отпечатком.
+Текстовые файлы дополнительно сжимаются заранее: .gz (gzip -9) и .br (brotli, если
+установлен пакет brotli) — без сжатия на каждый запрос.
+
+url_for('static', filename='css/styles.css') подставляет путь из манифеста (url_defaults),
+маршрут static отдаёт .br/.gz по Accept-Encoding, а файлы с отпечатком — с
+Cache-Control: immutable на год (новое содержимое = новое имя). Нет манифеста или
+ASSETS_FINGERPRINT = False (dev-сервер) — статика отдаётся как раньше.
+Прошлая сборка при пересборке не удаляется: страницы, уже открытые в браузерах, её догрузят.
+"""
+import os
+import re
+import gzip
+import json
+import hashlib
+import mimetypes
+import posixpath
+import tempfile
+from pathlib import Path
+
+from flask import request, current_app, send_from_directory
+
+YEAR = 365 * 24 * 3600
+COMPRESSIBLE = {".css", ".js", ".mjs", ".svg", ".json", ".txt", ".map", ".xml", ".html", ".ico"}
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))  # в порядке предпочтения
+MANIFEST = "manifest.json"
+
+_CSS_URL_RE = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+
+
+def _write_atomic(path: Path, data: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def _fingerprinted(name: str, data: bytes) -> str:
+    stem, ext = posixpath.splitext(name)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:10]}{ext}"
+
+
+def _rewrite_css(name: str, text: str, files: dict, dist: str) -> str:
+    """url(...) в CSS: пути относительно исходного файла -> относительно его копии в dist/."""
+    source_dir = posixpath.dirname(name)
+    target_dir = posixpath.dirname(posixpath.join(dist, name))
+
+    def replace(m):
+        quote, url = m.group(1), m.group(2).strip()
+        if url.startswith(("data:", "http:", "https:", "//", "/", "#")):
+            return m.group(0)
+        path, sep, suffix = url, "", ""
+        tail = re.search(r"[?#]", url)  # url(font.woff2?v=2#iefix)
+        if tail:
+            path, sep, suffix = url[:tail.start()], url[tail.start()], url[tail.start() + 1:]
+        logical = posixpath.normpath(posixpath.join(source_dir, path))
+        target = files.get(logical, logical)  # нет в сборке (шрифт не положили) — исходный путь
+        new = posixpath.relpath(target, target_dir or ".")
+        return f"url({quote}{new}{sep}{suffix}{quote})"
+
+    return _CSS_URL_RE.sub(replace, text)
+
+
+def _compress(data: bytes) -> dict:
+    """{".gz": bytes, ".br": bytes} — только если сжатие реально меньше оригинала."""
+    out = {".gz": gzip.compress(data, compresslevel=9, mtime=0)}
+    try:
+        import brotli  # опциональная зависимость: pip install brotli
+    except ImportError:
+        brotli = None
+    if brotli is not None:
+        out[".br"] = brotli.compress(data, quality=11, mode=brotli.MODE_TEXT)
+    return {suffix: blob for suffix, blob in out.items() if len(blob) < len(data)}
+
+
+def build_assets(static_dir, dist: str = "dist", prune: bool = True) -> dict:
+    """Собрать статику с отпечатками и манифест. Возвращает манифест + "report":
+    [(исходный путь, путь в сборке, размер, {".gz": размер, ".br": размер})].
+    """
+    static_dir = Path(static_dir)
+    out_dir = static_dir / dist
+    sources = sorted(
+        p for p in static_dir.rglob("*")
+        if p.is_file() and out_dir not in p.parents and p.suffix not in (".gz", ".br", ".tmp")
+    )
+    # CSS — последними: им нужны уже посчитанные имена картинок и шрифтов
+    sources.sort(key=lambda p: p.suffix == ".css")
+
+    files, encodings, report = {}, {}, []
+    for path in sources:
+        name = path.relative_to(static_dir).as_posix()
+        data = path.read_bytes()
+        if path.suffix == ".css":
+            data = _rewrite_css(name, data.decode("utf-8"), files, dist).encode("utf-8")
+        target = posixpath.join(dist, _fingerprinted(name, data))
+        target_path = static_dir / target
+        if not target_path.exists():
+            _write_atomic(target_path, data)
+        compressed = _compress(data) if path.suffix in COMPRESSIBLE else {}
+        for suffix, blob in compressed.items():
+            if not Path(str(target_path) + suffix).exists():
+                _write_atomic(Path(str(target_path) + suffix), blob)
+        files[name] = target
+        if compressed:
+            encodings[target] = [encoding for encoding, suffix in ENCODINGS if suffix in compressed]
+        report.append((name, target, len(data), {s: len(b) for s, b in compressed.items()}))
+
+    manifest_path = out_dir / MANIFEST
+    previous = load_manifest(manifest_path)
+    manifest = {"files": files, "encodings": encodings}
+    _write_atomic(manifest_path, json.dumps(manifest, ensure_ascii=False, indent=1).encode("utf-8"))
+
+    if prune:
+        # оставляем текущую и предыдущую сборку, остальное — мусор прошлых выкладок
+        keep = {manifest_path}
+        for m in (manifest, previous):
+            for target in m.get("files", {}).values():
+                keep.update(static_dir / (target + s) for s in ("", ".gz", ".br"))
+        for path in out_dir.rglob("*"):
+            if path.is_file() and path not in keep:
+                path.unlink()
+    return {**manifest, "report": report}
+
+
+def load_manifest(path) -> dict:
+    try:
+        return json.loads(Path(path).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+# -------------------------
+# Flask: url_for и раздача
+# -------------------------
+
+class _Assets:
+    def __init__(self, app):
+        self.static_dir = app.static_folder
+        manifest = load_manifest(Path(self.static_dir) / app.config["ASSETS_DIR"] / MANIFEST)
+        self.files = manifest.get("files", {})
+        self.encodings = {target: set(found) for target, found in manifest.get("encodings", {}).items()}
+        self.immutable = set(self.files.values())
+
+    def url_defaults(self, endpoint, values):
+        if endpoint == "static" and "filename" in values and current_app.config["ASSETS_FINGERPRINT"]:
+            values["filename"] = self.files.get(values["filename"], values["filename"])
+
+    def static_view(self, filename):
+        # содержимое файла с отпечатком по этому адресу не меняется никогда
+        max_age = YEAR if filename in self.immutable else current_app.get_send_file_max_age(filename)
+        available = self.encodings.get(filename, ())
+        for encoding, suffix in ENCODINGS:
+            if encoding in available and request.accept_encodings[encoding]:
+                mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+                response = send_from_directory(self.static_dir, filename + suffix, mimetype=mimetype, max_age=max_age)
+                response.headers["Content-Encoding"] = encoding
+                break
+        else:
+            response = send_from_directory(self.static_dir, filename, max_age=max_age)
+        if available:
+            response.vary.add("Accept-Encoding")
+        if filename in self.immutable:
+            response.cache_control.immutable = True
+        return response
+
+
+def init_assets(app):
+    assets = _Assets(app)
+    app.extensions["assets"] = assets
+    app.url_defaults(assets.url_defaults)
+    if app.static_folder:
+        app.view_functions["static"] = assets.static_view
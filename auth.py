@@ -1,8 +1,10 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session
-from werkzeug.security import generate_password_hash, check_password_hash
 from .db import db
 from .models import User
 from .utils import merge_session_cart_into_db
+from .passwords import HashingBusy, hasher, login_throttle
+from .metrics import record_login
+from .sessions import regenerate_session
 
 bp = Blueprint("auth", __name__, url_prefix="/auth")
 
@@ -17,11 +19,34 @@ def login_post():
     username = request.form.get("username", "").strip()
     password = request.form.get("password", "")
 
+    throttle = login_throttle()
+    wait = throttle.retry_after(username)
+    if wait:
+        record_login("throttled")
+        flash(f"Слишком много попыток входа. Попробуйте через {wait} с.", "danger")
+        return redirect(url_for("auth.login"))
+
     user = User.query.filter_by(username=username).first()
-    if not user or not check_password_hash(user.password_hash, password):
+    try:
+        ok = bool(user) and hasher().check(user.password_hash, password)
+        if ok and hasher().needs_rehash(user.password_hash):
+            # параметры хэширования поменялись — тихо перехэшируем при входе
+            user.password_hash = hasher().hash(password)
+            db.session.commit()
+    except HashingBusy:
+        record_login("busy")
+        flash("Сервис перегружен, попробуйте войти ещё раз через несколько секунд.", "warning")
+        return redirect(url_for("auth.login"))
+
+    if not ok:
+        record_login("failure")
+        throttle.failure(username)
         flash("Неверный логин или пароль.", "danger")
         return redirect(url_for("auth.login"))
 
+    throttle.success(username)
+    record_login("success")
+    regenerate_session()  # новый id: id гостевой сессии не должен стать id вошедшего
     session["user_id"] = user.id
     # ✅ корзина гостя -> в БД пользователю
     merge_session_cart_into_db(user.id)
@@ -51,10 +76,17 @@ def register_post():
         flash("Такой логин уже занят.", "danger")
         return redirect(url_for("auth.register"))
 
-    user = User(username=username, password_hash=generate_password_hash(password), role="user")
+    try:
+        password_hash = hasher().hash(password)
+    except HashingBusy:
+        flash("Сервис перегружен, попробуйте ещё раз через несколько секунд.", "warning")
+        return redirect(url_for("auth.register"))
+
+    user = User(username=username, password_hash=password_hash, role="user")
     db.session.add(user)
     db.session.commit()
 
+    regenerate_session()  # новый id: id гостевой сессии не должен стать id вошедшего
     session["user_id"] = user.id
     # ✅ корзина гостя -> в БД пользователю
     merge_session_cart_into_db(user.id)
@@ -65,6 +97,6 @@ def register_post():
 
 @bp.post("/logout")
 def logout():
-    session.pop("user_id", None)
+    regenerate_session(clear=True)  # старая запись и её id больше не действуют
     flash("Вы вышли из системы.", "info")
     return redirect(url_for("main.home"))
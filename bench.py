@@ -0,0 +1,373 @@
+"""Синтетические данные и воспроизводимый бенчмарк страниц.
+
+generate_data() заполняет БД пользователями, товарами по категориям, корзинами и
+историей заказов: фиксированный seed — одни и те же данные от запуска к запуску,
+вставка пачками через executemany.
+
+run_benchmark() поднимает приложение на временной SQLite, генерирует данные и гоняет
+реальные вью через test client. Для каждого сценария — p50/p95/p99 (мс) и число
+SQL-запросов на запрос; результат — dict, который CLI печатает как JSON, чтобы
+сравнивать коммиты между собой.
+"""
+import sys
+import time
+import random
+import sqlite3
+import tempfile
+from pathlib import Path
+from datetime import datetime, timedelta
+
+from werkzeug.security import generate_password_hash
+
+from .db import db
+from .models import User, Product, CartItem, Order, OrderItem
+from .orders import ORDER_STATUSES
+from .search import ensure_fts, _NOUNS, _CATEGORIES, _vocabulary
+from .stats import rebuild_stats
+from .profiling import count_queries
+
+BENCH_PASSWORD = "bench123"
+BENCH_ADMIN = "bench_admin"
+
+
+# -------------------------
+# Генератор данных
+# -------------------------
+
+def _next_id(model) -> int:
+    return (db.session.query(db.func.max(model.id)).scalar() or 0) + 1
+
+
+def _insert(model, rows, batch: int):
+    """executemany пачками по batch строк (rows — генератор, в памяти одна пачка)."""
+    table = model.__table__
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= batch:
+            db.session.execute(db.insert(table), chunk)
+            chunk = []
+    if chunk:
+        db.session.execute(db.insert(table), chunk)
+
+
+def generate_data(users: int = 1000, products: int = 10_000, orders: int = 20_000, cart_items: int = 3,
+                  days: int = 365, seed: int = 42, batch: int = 5000, password_method=None) -> dict:
+    """Добавить в текущую БД синтетический магазин. У всех пользователей пароль BENCH_PASSWORD,
+    администратор — BENCH_ADMIN. Возвращает сводку и слова для поисковых запросов.
+    """
+    rnd = random.Random(seed)
+    vocab = _vocabulary(rnd)
+    # один хэш на всех: scrypt для каждого из тысяч пользователей занял бы минуты
+    pwhash = generate_password_hash(BENCH_PASSWORD, password_method) if password_method else generate_password_hash(BENCH_PASSWORD)
+    now = datetime.utcnow()
+
+    try:
+        first_user = _next_id(User)
+        tag = f"{seed}_{first_user}"  # уникальные логины при повторном запуске
+        user_ids = list(range(first_user, first_user + users))
+        _insert(User, (
+            {"id": uid, "username": f"bench{tag}_{i}", "password_hash": pwhash, "role": "user",
+             "created_at": now - timedelta(days=rnd.randint(0, days))}
+            for i, uid in enumerate(user_ids)
+        ), batch)
+        admin_id = first_user + users
+        if not User.query.filter_by(username=BENCH_ADMIN).first():
+            db.session.execute(db.insert(User.__table__), [
+                {"id": admin_id, "username": BENCH_ADMIN, "password_hash": pwhash, "role": "admin", "created_at": now}
+            ])
+
+        first_product = _next_id(Product)
+        product_ids = list(range(first_product, first_product + products))
+        prices = {}
+
+        def product_rows():
+            for pid in product_ids:
+                price = rnd.randint(100, 50_000)
+                prices[pid] = price
+                yield {
+                    "id": pid,
+                    "title": f"{rnd.choice(_NOUNS).capitalize()} {rnd.choice(vocab)} {rnd.choice(vocab)}",
+                    "description": " ".join(rnd.choices(vocab, k=12)),
+                    "price": price,
+                    "category": rnd.choice(_CATEGORIES),
+                    "image_url": None,
+                    "is_active": rnd.random() > 0.05,
+                    "stock": None,
+                    "sku": f"BENCH-{tag}-{pid}",
+                }
+
+        _insert(Product, product_rows(), batch)
+
+        def cart_rows():
+            for uid in user_ids:
+                for pid in rnd.sample(product_ids, min(cart_items, len(product_ids))):
+                    yield {"user_id": uid, "product_id": pid, "qty": rnd.randint(1, 3)}
+
+        _insert(CartItem, cart_rows(), batch)
+
+        first_order = _next_id(Order)
+        first_item = _next_id(OrderItem)
+        items = []  # позиции копятся вместе с заказами: total считается по ним
+
+        def order_rows():
+            item_id = first_item
+            for oid in range(first_order, first_order + orders):
+                total = 0
+                for pid in rnd.sample(product_ids, min(rnd.randint(1, 5), len(product_ids))):
+                    qty = rnd.randint(1, 3)
+                    total += prices[pid] * qty
+                    items.append({"id": item_id, "order_id": oid, "product_id": pid,
+                                  "title": f"Товар {pid}", "price": prices[pid], "qty": qty})
+                    item_id += 1
+                yield {
+                    "id": oid,
+                    "user_id": rnd.choice(user_ids),
+                    "created_at": now - timedelta(days=rnd.random() * days),
+                    "status": rnd.choice(ORDER_STATUSES),
+                    "total": total,
+                }
+
+        # заказы раньше позиций (FK), поэтому позиции пишем после каждой пачки заказов
+        chunk = []
+        for row in order_rows():
+            chunk.append(row)
+            if len(chunk) >= batch:
+                db.session.execute(db.insert(Order.__table__), chunk)
+                chunk = []
+                _insert(OrderItem, items, batch)
+                items.clear()
+        if chunk:
+            db.session.execute(db.insert(Order.__table__), chunk)
+        _insert(OrderItem, items, batch)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    rebuild_stats()
+    return {
+        "users": users, "products": products, "orders": orders, "cart_items": users * cart_items,
+        "user_ids": user_ids, "product_ids": product_ids, "words": vocab[:200],
+        "categories": list(_CATEGORIES),
+    }
+
+
+# -------------------------
+# Бенчмарк страниц
+# -------------------------
+
+def _percentile(sorted_values, p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, round(p / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[k]
+
+
+def _summary(times_ms, queries, errors) -> dict:
+    times_ms = sorted(times_ms)
+    return {
+        "requests": len(times_ms),
+        "errors": errors,
+        "p50_ms": round(_percentile(times_ms, 50), 3),
+        "p95_ms": round(_percentile(times_ms, 95), 3),
+        "p99_ms": round(_percentile(times_ms, 99), 3),
+        "mean_ms": round(sum(times_ms) / len(times_ms), 3) if times_ms else 0.0,
+        "queries_avg": round(sum(queries) / len(queries), 2) if queries else 0.0,
+        "queries_max": max(queries) if queries else 0,
+    }
+
+
+def _login(client, username):
+    r = client.post("/auth/login", data={"username": username, "password": BENCH_PASSWORD})
+    if r.status_code != 302 or "/auth/login" in r.headers.get("Location", ""):
+        raise RuntimeError(f"Не удалось войти как {username}: {r.status_code}")
+
+
+SCENARIOS = (
+    "catalog", "catalog_category", "catalog_search", "cart", "checkout", "login",
+    "admin_dashboard", "admin_products", "admin_orders", "admin_users",
+)
+
+
+def run_benchmark(users: int = 500, products: int = 5000, orders: int = 5000, requests: int = 200,
+                  warmup: int = 10, seed: int = 42, scenarios=None, config=None) -> dict:
+    """Прогнать сценарии на временной БД с синтетическими данными.
+    config — переопределения конфига приложения (например {"PRODUCT_CACHE_SIZE": 0}).
+    """
+    from . import create_app
+
+    scenarios = list(scenarios or SCENARIOS)
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise ValueError(f"Неизвестные сценарии: {', '.join(sorted(unknown))}")
+    rnd = random.Random(seed)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app({
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{Path(tmp, 'bench.sqlite3').as_posix()}",
+            "READ_REPLICA_URIS": [],
+            **(config or {}),
+        })
+        app.logger.disabled = True
+        t0 = time.perf_counter()
+        with app.app_context():
+            db.create_all()
+            ensure_fts()
+            data = generate_data(users=users, products=products, orders=orders, seed=seed,
+                                 password_method=app.config["PASSWORD_HASH_METHOD"])
+            usernames = dict(db.session.query(User.id, User.username).filter(User.id.in_(data["user_ids"][:50])).all())
+            engines = list(db.engines.values())
+        generate_seconds = time.perf_counter() - t0
+
+        user_client = app.test_client()
+        _login(user_client, usernames[data["user_ids"][0]])
+        admin_client = app.test_client()
+        _login(admin_client, BENCH_ADMIN)
+        guest = app.test_client()
+        buyer = app.test_client()
+        _login(buyer, usernames[data["user_ids"][1]])
+
+        def make_request(name):
+            """(client, method, url, kwargs) для одного запроса сценария; подготовка — не в замере."""
+            if name == "catalog":
+                return guest, "GET", "/catalog", {}
+            if name == "catalog_category":
+                return guest, "GET", "/catalog", {"query_string": {"category": rnd.choice(data["categories"])}}
+            if name == "catalog_search":
+                return guest, "GET", "/catalog", {"query_string": {"q": rnd.choice(data["words"])}}
+            if name == "cart":
+                return user_client, "GET", "/cart", {}
+            if name == "checkout":
+                for pid in rnd.sample(data["product_ids"], 2):
+                    buyer.post(f"/cart/add/{pid}")
+                return buyer, "POST", "/checkout", {}
+            if name == "login":
+                uid = rnd.choice(list(usernames))
+                return app.test_client(), "POST", "/auth/login", {
+                    "data": {"username": usernames[uid], "password": BENCH_PASSWORD}
+                }
+            url = {
+                "admin_dashboard": "/admin/",
+                "admin_products": "/admin/products",
+                "admin_orders": "/admin/orders",
+                "admin_users": "/admin/users",
+            }[name]
+            return admin_client, "GET", url, {}
+
+        results = {}
+        try:
+            for name in scenarios:
+                times, queries, errors = [], [], 0
+                for i in range(warmup + requests):
+                    client, method, url, kwargs = make_request(name)
+                    with count_queries(engines) as log:
+                        started = time.perf_counter()
+                        r = client.open(url, method=method, **kwargs)
+                        elapsed = (time.perf_counter() - started) * 1000
+                    if i < warmup:
+                        continue
+                    if r.status_code >= 400:
+                        errors += 1
+                    times.append(elapsed)
+                    queries.append(log.count)
+                results[name] = _summary(times, queries, errors)
+        finally:
+            app.extensions["password_hasher"].shutdown()
+            with app.app_context():
+                db.engine.dispose()
+
+    return {
+        "meta": {
+            "users": users, "products": products, "orders": orders, "requests": requests, "warmup": warmup,
+            "seed": seed, "config": config or {}, "generate_seconds": round(generate_seconds, 2),
+            "python": sys.version.split()[0], "sqlite": sqlite3.sqlite_version,
+            "at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        },
+        "scenarios": results,
+    }
+
+
+# -------------------------
+# Бенчмарк рендера (кэш фрагментов)
+# -------------------------
+
+RENDER_STORES = ("none", "memory", "redis")
+
+
+def run_render_benchmark(cards: int = 500, rounds: int = 30, stores=None, seed: int = 42) -> dict:
+    """Время рендера страницы каталога из cards карточек (только шаблон, без БД и HTTP).
+    Для каждого хранилища FRAGMENT_CACHE: "cold" — пустой кэш перед каждым рендером
+    (первый запрос после выкладки), "warm" — всё уже в кэше. "none" — без кэша фрагментов.
+    Проверяет, что HTML из кэша совпадает с HTML без него.
+    """
+    from flask import render_template
+    from . import create_app
+    from .catalog import catalog_page, catalog_categories
+    from .fragments import FragmentCache, make_fragment_store
+
+    stores = list(stores or RENDER_STORES)
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app({
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{Path(tmp, 'bench.sqlite3').as_posix()}",
+            "READ_REPLICA_URIS": [],
+        })
+        app.logger.disabled = True
+        results = {}
+        try:
+            with app.app_context():
+                db.create_all()
+                ensure_fts()
+                generate_data(users=1, products=cards * 2, orders=0, seed=seed,
+                              password_method=app.config["PASSWORD_HASH_METHOD"])
+                products, _ = catalog_page(limit=cards)
+                categories = catalog_categories()
+
+            def render():
+                with app.test_request_context("/catalog"):
+                    started = time.perf_counter()
+                    html = render_template("catalog.html", products=products, categories=categories,
+                                           q="", category="", next_cursor=None)
+                    return html, (time.perf_counter() - started) * 1000
+
+            def measure(make_cache, fresh: bool):
+                cache = make_cache()
+                app.jinja_env.fragment_cache = cache
+                render()  # компиляция шаблонов и прогрев — не в замере
+                times, html = [], None
+                for _ in range(rounds):
+                    if fresh:
+                        app.jinja_env.fragment_cache = make_cache()
+                    html, elapsed = render()
+                    times.append(elapsed)
+                times.sort()
+                return html, {
+                    "p50_ms": round(_percentile(times, 50), 3),
+                    "p95_ms": round(_percentile(times, 95), 3),
+                    "mean_ms": round(sum(times) / len(times), 3),
+                }
+
+            reference = None
+            for name in stores:
+                if name == "none":
+                    reference, results["none"] = measure(lambda: None, fresh=False)
+                    continue
+                config = {**app.config, "FRAGMENT_CACHE": name}
+
+                def make_cache(config=config):
+                    return FragmentCache(make_fragment_store(config), prefix="bench:")
+
+                _, cold = measure(make_cache, fresh=True)
+                html, warm = measure(make_cache, fresh=False)
+                results[name] = {"cold": cold, "warm": warm, "same_html": reference is None or html == reference}
+        finally:
+            app.extensions["password_hasher"].shutdown()
+            with app.app_context():
+                db.engine.dispose()
+
+    return {
+        "meta": {
+            "cards": len(products), "rounds": rounds, "python": sys.version.split()[0],
+            "at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        },
+        "stores": results,
+    }
@@ -0,0 +1,103 @@
+"""Простой потокобезопасный LRU-кэш с TTL для данных каталога.
+
+Кэш живёт в процессе (app.extensions["product_cache"]). Списки товаров
+ключуются версией каталога: любое изменение товара в админке увеличивает
+версию, и старые ключи просто перестают находиться (и вытесняются по LRU).
+Изменения из других процессов ловит sync_source() по catalog_version (см. httpcache.py).
+"""
+import time
+import threading
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache:
+    def __init__(self, maxsize: int = 2048, ttl: float = 300.0):
+        self.maxsize = int(maxsize)
+        self.ttl = float(ttl)
+        self.version = 0
+        self.source_version = None  # версия данных в общем источнике, см. sync_source()
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING or item[0] < now:
+                if item is not _MISSING:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, version=None):
+        """Положить значение. Если передан version и он уже устарел (пока значение
+        грузилось из БД, каталог поменяли) — не кладём, чтобы не закэшировать старые данные.
+        """
+        if self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_set(self, key, factory):
+        version = self.version
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = factory()
+            self.set(key, value, version=version)
+        return value
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def bump_version(self):
+        """Инвалидировать все ключи, зависящие от версии."""
+        with self._lock:
+            self.version += 1
+            return self.version
+
+    def sync_source(self, source_version) -> bool:
+        """Сверить кэш с версией данных, общей для всех процессов (catalog_version в БД).
+        Сменилась — товар поменял другой процесс (воркер, соседний gunicorn-воркер):
+        сбрасываем всё и поднимаем версию. True — кэш был сброшен.
+        """
+        with self._lock:
+            if source_version == self.source_version:
+                return False
+            self.source_version = source_version
+            self.version += 1
+            self._data.clear()
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "version": self.version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            }
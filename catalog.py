@@ -0,0 +1,231 @@
+from datetime import datetime
+from dataclasses import dataclass
+
+from flask import current_app
+from sqlalchemy import and_, or_
+
+from .db import db
+from .models import Product
+from .search import fts_available, match_expression, fts_subquery
+from .images import image_urls
+
+
+# -------------------------
+# Снимки товаров и кэш
+# -------------------------
+
+@dataclass(frozen=True)
+class ProductSnapshot:
+    """Неизменяемая копия товара для кэша (ORM-объекты между запросами не живут)."""
+    id: int
+    title: str
+    description: str
+    price: int
+    category: str
+    image_url: str
+    is_active: bool
+    updated_at: datetime = None
+    image_key: str = None
+
+    @classmethod
+    def from_model(cls, p) -> "ProductSnapshot":
+        """Из ORM-объекта Product или строки запроса с колонками SNAPSHOT_COLUMNS."""
+        return cls(
+            id=p.id,
+            title=p.title,
+            description=p.description or "",
+            price=int(p.price),
+            category=p.category,
+            image_url=p.image_url,
+            is_active=bool(p.is_active),
+            updated_at=p.updated_at,
+            image_key=p.image_key,
+        )
+
+
+SNAPSHOT_COLUMNS = (
+    Product.id,
+    Product.title,
+    Product.description,
+    Product.price,
+    Product.category,
+    Product.image_url,
+    Product.is_active,
+    Product.updated_at,
+    Product.image_key,
+)
+
+
+def product_cache():
+    return current_app.extensions["product_cache"]
+
+
+def get_product(pid: int):
+    """Товар по id (снимок из кэша или из БД). None — если товара нет."""
+    cache = product_cache()
+    key = ("product", pid)
+    snap = cache.get(key)
+    if snap is None:
+        version = cache.version
+        p = db.session.get(Product, pid)
+        if not p:
+            return None
+        snap = ProductSnapshot.from_model(p)
+        cache.set(key, snap, version=version)
+    return snap
+
+
+def get_products(pids) -> dict:
+    """Несколько товаров сразу: {id: snapshot}. Промахи кэша добираются одним IN-запросом."""
+    cache = product_cache()
+    found = {}
+    missing = []
+    for pid in set(pids):
+        snap = cache.get(("product", pid))
+        if snap is None:
+            missing.append(pid)
+        else:
+            found[pid] = snap
+    if missing:
+        version = cache.version
+        for p in Product.query.filter(Product.id.in_(missing)).all():
+            snap = ProductSnapshot.from_model(p)
+            cache.set(("product", p.id), snap, version=version)
+            found[p.id] = snap
+    return found
+
+
+def invalidate_product(pid=None):
+    """Вызывать после изменения товара: сбрасывает его запись и версию списков каталога."""
+    cache = product_cache()
+    if pid is not None:
+        cache.delete(("product", pid))
+    cache.bump_version()
+
+
+def showcase(limit: int = 6):
+    """Товары для витрины на главной."""
+    cache = product_cache()
+    key = ("showcase", cache.version, limit)
+    return cache.get_or_set(
+        key,
+        lambda: tuple(
+            ProductSnapshot.from_model(p)
+            for p in Product.query.filter_by(is_active=True).limit(limit).all()
+        ),
+    )
+
+
+def parse_cursor(value):
+    """Курсор страницы — id последнего показанного товара (или None)."""
+    try:
+        cursor = int(value)
+    except (TypeError, ValueError):
+        return None
+    return cursor if cursor > 0 else None
+
+
+def parse_search_cursor(value):
+    """Курсор поисковой выдачи — "rank:id" последнего показанного товара (или None)."""
+    try:
+        rank, pid = str(value).rsplit(":", 1)
+        return float(rank), int(pid)
+    except (TypeError, ValueError):
+        return None
+
+
+def catalog_query(q: str = "", category: str = ""):
+    """Базовый запрос каталога с фильтрами поиска/категории (поиск через ilike)."""
+    query = Product.query.filter_by(is_active=True)
+    if q:
+        query = query.filter(Product.title.ilike(f"%{q}%"))
+    if category:
+        query = query.filter_by(category=category)
+    return query
+
+
+def _cut_page(rows, limit):
+    # берём на одну запись больше, чтобы понять, есть ли следующая страница
+    has_next = len(rows) > limit
+    return rows[:limit], has_next
+
+
+def catalog_page(q: str = "", category: str = "", cursor=None, limit: int = 24):
+    """Страница каталога из кэша: (products, next_cursor), products — снимки товаров."""
+    cache = product_cache()
+    key = ("page", cache.version, category, q, cursor or "", limit)
+
+    def load():
+        products, next_cursor = _load_catalog_page(q, category, cursor, limit)
+        return tuple(ProductSnapshot.from_model(p) for p in products), next_cursor
+
+    return cache.get_or_set(key, load)
+
+
+def _load_catalog_page(q: str = "", category: str = "", cursor=None, limit: int = 24):
+    """Одна страница каталога из БД (keyset, без OFFSET и COUNT(*)).
+    Без поиска — по id desc; с поиском — по релевантности (bm25), затем id desc.
+    Возвращает (products, next_cursor); next_cursor=None — страниц больше нет.
+    """
+    if q and fts_available():
+        match = match_expression(q)
+        if match:
+            return _search_page(match, category, cursor, limit)
+
+    query = catalog_query(q, category)
+    cursor = parse_cursor(cursor)
+    if cursor:
+        query = query.filter(Product.id < cursor)
+
+    rows, has_next = _cut_page(query.order_by(Product.id.desc()).limit(limit + 1).all(), limit)
+    next_cursor = rows[-1].id if has_next else None
+    return rows, next_cursor
+
+
+def _search_page(match: str, category: str, cursor, limit: int):
+    fts = fts_subquery(match)
+    query = (
+        db.session.query(Product, fts.c.rank)
+        .join(fts, fts.c.id == Product.id)
+        .filter(Product.is_active.is_(True))
+    )
+    if category:
+        query = query.filter(Product.category == category)
+
+    after = parse_search_cursor(cursor)
+    if after:
+        rank, pid = after
+        query = query.filter(or_(fts.c.rank > rank, and_(fts.c.rank == rank, Product.id < pid)))
+
+    rows = query.order_by(fts.c.rank, Product.id.desc()).limit(limit + 1).all()
+    rows, has_next = _cut_page(rows, limit)
+    next_cursor = f"{rows[-1][1]!r}:{rows[-1][0].id}" if has_next else None
+    return [p for p, _ in rows], next_cursor
+
+
+def catalog_categories():
+    """Список категорий активных товаров (покрывается индексом is_active+category)."""
+    cache = product_cache()
+
+    def load():
+        rows = (
+            db.session.query(Product.category)
+            .filter(Product.is_active.is_(True))
+            .distinct()
+            .order_by(Product.category)
+            .all()
+        )
+        return tuple(c[0] for c in rows)
+
+    return cache.get_or_set(("categories", cache.version), load)
+
+
+def product_to_dict(p) -> dict:
+    return {
+        "id": p.id,
+        "title": p.title,
+        "price": p.price,
+        "category": p.category,
+        "image_url": p.image_url,
+        "images": image_urls(p, "card"),  # {"webp", "jpg"} — локальные превью для карточки
+    }
@@ -0,0 +1,348 @@
+"""Массовый импорт и экспорт товаров (CSV / JSONL).
+
+Файл читается потоково: строки собираются в пачки по batch_size, ключ товара —
+артикул поставщика sku. Новые sku пишутся executemany INSERT ... ON CONFLICT(sku),
+существующие — executemany UPDATE ... WHERE sku = ?.
+Каждая пачка — своя транзакция; после её коммита число обработанных строк
+сохраняется в <файл>.progress, и повторный запуск того же файла продолжает с этого места.
+
+Колонки, которых нет в строке, у существующих товаров не меняются: файл только
+с sku и stock обновляет остатки, не трогая названия и цены.
+"""
+import os
+import csv
+import sys
+import json
+import time
+
+from .db import db, dialect_insert
+from .models import Product
+from .stats import add_counters
+from .catalog import invalidate_product
+
+FIELDS = ("sku", "title", "description", "price", "category", "image_url", "is_active", "stock")
+REQUIRED_FOR_NEW = ("title", "price")
+FORMATS = ("csv", "jsonl")
+MAX_REPORTED_ERRORS = 20
+
+_TRUE = {"1", "true", "yes", "y", "да", "on"}
+_FALSE = {"0", "false", "no", "n", "нет", "off", ""}
+
+
+class InvalidRow(ValueError):
+    """Строка файла не проходит проверку — пропускается с сообщением."""
+
+
+def detect_format(path: str, fmt=None) -> str:
+    if fmt:
+        return fmt
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        return "csv"
+    if ext in (".jsonl", ".ndjson"):
+        return "jsonl"
+    raise ValueError(f"Не понять формат по имени {path!r} — укажите --format ({', '.join(FORMATS)})")
+
+
+# -------------------------
+# Разбор строк
+# -------------------------
+
+def _int(value, name: str):
+    if isinstance(value, bool):
+        raise InvalidRow(f"{name}: ожидалось число")
+    if isinstance(value, int):
+        n = value
+    else:
+        try:
+            n = int(str(value).strip())
+        except ValueError:
+            raise InvalidRow(f"{name}: ожидалось целое число, получено {value!r}") from None
+    if n < 0:
+        raise InvalidRow(f"{name}: не может быть отрицательным")
+    return n
+
+
+def _bool(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    s = str(value).strip().lower()
+    if s in _TRUE:
+        return True
+    if s in _FALSE:
+        return False
+    raise InvalidRow(f"is_active: непонятное значение {value!r}")
+
+
+def clean_row(raw: dict) -> dict:
+    """Строка файла -> значения колонок product (только те, что в строке есть)."""
+    row = {}
+    sku = str(raw.get("sku") or "").strip()
+    if not sku:
+        raise InvalidRow("нет sku")
+    if len(sku) > 64:
+        raise InvalidRow("sku длиннее 64 символов")
+    row["sku"] = sku
+
+    if "title" in raw:
+        title = str(raw["title"] or "").strip()
+        if not title:
+            raise InvalidRow("пустой title")
+        row["title"] = title[:140]
+    if "description" in raw:
+        row["description"] = str(raw["description"] or "")
+    if "price" in raw:
+        row["price"] = _int(raw["price"], "price")
+    if "category" in raw:
+        row["category"] = str(raw["category"] or "").strip()[:60] or "Другое"
+    if "image_url" in raw:
+        row["image_url"] = str(raw["image_url"] or "").strip()[:300] or None
+    if "is_active" in raw:
+        row["is_active"] = _bool(raw["is_active"])
+    if "stock" in raw:
+        stock = raw["stock"]
+        row["stock"] = None if stock is None or str(stock).strip() == "" else _int(stock, "stock")
+    return row
+
+
+def read_rows(f, fmt: str):
+    """Поток (номер строки, dict) из открытого файла."""
+    if fmt == "csv":
+        reader = csv.DictReader(f)
+        for raw in reader:
+            yield reader.line_num, raw
+        return
+    for lineno, line in enumerate(f, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            raw = json.loads(line)
+        except ValueError as e:
+            yield lineno, InvalidRow(f"битый JSON: {e}")
+            continue
+        yield lineno, raw if isinstance(raw, dict) else InvalidRow("ожидался JSON-объект")
+
+
+# -------------------------
+# Запись пачки
+# -------------------------
+
+def _image_key_after(new_url):
+    """Сменилась ссылка на картинку — обработанная картинка больше не её (см. ingest-images)."""
+    table = Product.__table__
+    return db.case((table.c.image_url.is_distinct_from(new_url), None), else_=table.c.image_key)
+
+
+def upsert_batch(rows):
+    """Записать пачку [(lineno, row)] одной транзакцией. Возвращает (inserted, updated, errors)."""
+    table = Product.__table__
+    by_sku = {}
+    for lineno, row in rows:
+        # повтор sku внутри пачки: поля складываем, последнее значение побеждает
+        prev = by_sku.get(row["sku"])
+        by_sku[row["sku"]] = (lineno, {**prev[1], **row} if prev else row)
+
+    existing = set(
+        db.session.execute(db.select(table.c.sku).where(table.c.sku.in_(list(by_sku)))).scalars()
+    )
+    errors = []
+    # executemany требует одинаковый набор колонок — группируем по нему
+    inserts, updates = {}, {}
+    for sku, (lineno, row) in by_sku.items():
+        if sku in existing:
+            if len(row) > 1:
+                updates.setdefault(tuple(sorted(row)), []).append({**row, "_sku": sku})
+            continue
+        missing = [name for name in REQUIRED_FOR_NEW if name not in row]
+        if missing:
+            errors.append((lineno, f"новый товар {sku}: нет {', '.join(missing)}"))
+            continue
+        inserts.setdefault(tuple(sorted(row)), []).append(row)
+
+    try:
+        # существующие — UPDATE: INSERT ... ON CONFLICT проверил бы NOT NULL у колонок,
+        # которых в строке нет (файл только с остатками), ещё до разрешения конфликта
+        for columns, group in updates.items():
+            values = {name: db.bindparam(name) for name in columns if name != "sku"}
+            if "image_url" in columns:
+                values["image_key"] = _image_key_after(db.bindparam("image_url"))
+            stmt = db.update(table).where(table.c.sku == db.bindparam("_sku")).values(values)
+            db.session.execute(stmt, group)
+        for columns, group in inserts.items():
+            # ON CONFLICT — на случай, если sku успел вставить параллельный импорт
+            stmt = dialect_insert(table)
+            set_ = {name: stmt.excluded[name] for name in columns if name != "sku"}
+            if "image_url" in columns:
+                set_["image_key"] = _image_key_after(stmt.excluded.image_url)
+            stmt = stmt.on_conflict_do_update(index_elements=[table.c.sku], set_=set_)
+            db.session.execute(stmt, group)
+        inserted = sum(len(g) for g in inserts.values())
+        # остаток на витрине не показывается — версию каталога (ETag) меняют только прочие поля
+        shown = inserted or any(set(columns) - {"sku", "stock"} for columns in updates)
+        add_counters(products=inserted, catalog_version=1 if shown else 0)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return inserted, len(by_sku) - inserted - len(errors), errors
+
+
+# -------------------------
+# Импорт / экспорт
+# -------------------------
+
+def _progress_path(path: str) -> str:
+    return path + ".progress"
+
+
+def _file_signature(path: str) -> dict:
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def saved_progress(path: str) -> int:
+    """Сколько строк файла уже импортировано прошлым запуском (0 — начать сначала)."""
+    try:
+        with open(_progress_path(path), encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return 0
+    if {k: state.get(k) for k in ("size", "mtime_ns")} != _file_signature(path):
+        return 0  # файл с тех пор поменялся
+    return int(state.get("rows", 0))
+
+
+def _save_progress(path: str, rows: int):
+    tmp = _progress_path(path) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({**_file_signature(path), "rows": rows}, f)
+    os.replace(tmp, _progress_path(path))
+
+
+def import_products(path: str, fmt=None, batch_size: int = 1000, resume: bool = True, on_batch=None) -> dict:
+    """Импортировать товары из CSV/JSONL ("-" — stdin, без продолжения).
+
+    on_batch(stats) вызывается после каждой записанной пачки.
+    Возвращает {"rows", "skipped", "inserted", "updated", "invalid", "errors", "seconds", "rows_per_sec"}.
+    """
+    fmt = detect_format(path, fmt)
+    from_stdin = path == "-"
+    skip = saved_progress(path) if resume and not from_stdin else 0
+    if not from_stdin and not resume:
+        try:
+            os.remove(_progress_path(path))
+        except FileNotFoundError:
+            pass
+
+    stats = {"rows": 0, "skipped": skip, "inserted": 0, "updated": 0, "invalid": 0, "errors": []}
+    started = time.perf_counter()
+
+    def error(lineno, message):
+        stats["invalid"] += 1
+        if len(stats["errors"]) < MAX_REPORTED_ERRORS:
+            stats["errors"].append(f"строка {lineno}: {message}")
+
+    def flush(batch, done):
+        inserted, updated, errors = upsert_batch(batch)
+        stats["inserted"] += inserted
+        stats["updated"] += updated
+        for lineno, message in errors:
+            error(lineno, message)
+        if not from_stdin:
+            _save_progress(path, done)
+        if on_batch:
+            on_batch(_with_rate(stats, started))
+
+    f = sys.stdin if from_stdin else open(path, encoding="utf-8-sig", newline="")
+    try:
+        batch = []
+        done = 0  # строк файла пройдено (включая пропущенные при продолжении)
+        for lineno, raw in read_rows(f, fmt):
+            done += 1
+            if done <= skip:
+                continue
+            stats["rows"] += 1
+            try:
+                if isinstance(raw, InvalidRow):
+                    raise raw
+                batch.append((lineno, clean_row(raw)))
+            except InvalidRow as e:
+                error(lineno, str(e))
+            if len(batch) >= batch_size:
+                flush(batch, done)
+                batch = []
+        if batch:
+            flush(batch, done)
+    finally:
+        if not from_stdin:
+            f.close()
+
+    if not from_stdin:
+        try:
+            os.remove(_progress_path(path))  # файл пройден целиком
+        except FileNotFoundError:
+            pass
+    invalidate_product()
+    return _with_rate(stats, started)
+
+
+def _with_rate(stats: dict, started: float) -> dict:
+    seconds = time.perf_counter() - started
+    return {**stats, "seconds": round(seconds, 2), "rows_per_sec": round(stats["rows"] / seconds, 1) if seconds else 0.0}
+
+
+def _export_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return int(value)
+    return value
+
+
+def export_products(path: str, fmt=None, batch_size: int = 1000, on_batch=None) -> dict:
+    """Выгрузить все товары в CSV/JSONL ("-" — stdout) пачками по id: память не растёт
+    с размером каталога. Файл пишется во временный и подменяется в конце.
+    Возвращает {"rows", "seconds", "rows_per_sec"}.
+    """
+    fmt = detect_format(path, fmt)
+    table = Product.__table__
+    columns = [table.c[name] for name in FIELDS]
+    to_stdout = path == "-"
+    tmp = path + ".tmp"
+    stats = {"rows": 0}
+    started = time.perf_counter()
+
+    f = sys.stdout if to_stdout else open(tmp, "w", encoding="utf-8", newline="")
+    try:
+        writer = None
+        if fmt == "csv":
+            writer = csv.writer(f)
+            writer.writerow(FIELDS)
+        last_id = 0
+        while True:
+            rows = db.session.execute(
+                db.select(table.c.id, *columns).where(table.c.id > last_id).order_by(table.c.id).limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            for row in rows:
+                values = row[1:]
+                if writer:
+                    writer.writerow([_export_value(v) for v in values])
+                else:
+                    f.write(json.dumps(dict(zip(FIELDS, values)), ensure_ascii=False) + "\n")
+            stats["rows"] += len(rows)
+            db.session.rollback()  # не держать транзакцию чтения между пачками
+            if on_batch:
+                on_batch(_with_rate(stats, started))
+    except Exception:
+        if not to_stdout:
+            f.close()
+            os.remove(tmp)
+        raise
+    if not to_stdout:
+        f.close()
+        os.replace(tmp, path)
+    return _with_rate(stats, started)
@@ -1,14 +1,40 @@
+import json
+import time
+import sqlite3
+import tempfile
+import threading
+from pathlib import Path
+
 import click
+from flask import session, current_app
 from flask.cli import with_appcontext
+from werkzeug.http import http_date
 from werkzeug.security import generate_password_hash
-from .db import db
-from .models import User, Product
+from .db import db, ensure_columns, ensure_indexes
+from .search import ensure_fts, benchmark_search
+from .storage import PROFILES, benchmark_storage
+from .routing import REPLICA_PREFIX
+from .stats import rebuild_stats
+from .bench import SCENARIOS, RENDER_STORES, BENCH_PASSWORD, BENCH_ADMIN, generate_data, run_benchmark, run_render_benchmark
+from .serve import serve, bench_servers
+from .catalog_io import FORMATS, import_products, export_products, saved_progress
+from .models import User, Product, OrderItem, StockReservation, StatCounter
+from .inventory import OutOfStock, release_expired_reservations
+from .utils import add_to_cart, clear_cart, place_order
+from .jobs import run_worker, work_off, job_counts
+from .images import backfill_images
+from .assets import build_assets
 
 @click.command("init-db")
 @with_appcontext
 def init_db_command():
     """Создать таблицы БД."""
     db.create_all()
+    ensure_columns()
+    ensure_indexes()
+    ensure_fts()
+    if not StatCounter.query.first():
+        rebuild_stats()  # статистика для уже существующих данных
     click.echo("DB initialized.")
 
 @click.command("seed")
@@ -37,3 +63,460 @@ def seed_command():
 
     db.session.commit()
     click.echo("Seed complete. Users: admin/admin123, user/user123")
+
+@click.command("bench-search")
+@click.option("--products", "n", default=100_000, show_default=True, help="Сколько товаров сгенерировать.")
+@click.option("--repeat", default=5, show_default=True, help="Повторов на запрос (берётся лучший).")
+def bench_search_command(n, repeat):
+    """Сравнить поиск ilike и FTS5 на синтетическом каталоге (in-memory SQLite)."""
+    click.echo(f"Каталог: {n} товаров")
+    for q, r in benchmark_search(n, repeat=repeat).items():
+        click.echo(
+            f"{q!r:24} ilike {r['like_ms']:9.3f} ms ({r['like_rows']} шт.)   "
+            f"fts5 {r['fts_ms']:9.3f} ms ({r['fts_rows']} шт.)"
+        )
+
+@click.command("sweep-reservations")
+@click.option("--interval", default=0, show_default=True, help="Повторять каждые N секунд (0 — один проход).")
+@with_appcontext
+def sweep_reservations_command(interval):
+    """Вернуть на склад просроченные резервы товаров."""
+    while True:
+        removed = release_expired_reservations()
+        click.echo(f"Снято просроченных резервов: {removed}")
+        if not interval:
+            return
+        time.sleep(interval)
+
+
+def _stress_stock_run(buyers, stock, qty, reserve, sweeper):
+    """Один прогон stress-stock на временной БД. Покупатель повторяет попытку
+    (корзина -> заказ), пока не купит или пока товар не кончится совсем —
+    и на складе, и в чужих резервах. sweeper — параллельно снимать просроченные
+    резервы; резерв тогда живёт 0 с, и чистка гоняется с каждым оформлением.
+    """
+    from . import create_app
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app({
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{Path(tmp, 'stress.sqlite3').as_posix()}",
+            "STOCK_RESERVE_ON_ADD": reserve,
+            **({"STOCK_RESERVATION_TTL": 0} if sweeper else {}),
+        })
+        with app.app_context():
+            db.create_all()
+            hot = Product(title="Горячий товар", price=100, category="Другое", stock=stock)
+            db.session.add(hot)
+            db.session.add_all(
+                User(username=f"buyer{i}", password_hash="-", role="user") for i in range(buyers)
+            )
+            db.session.commit()
+            pid = hot.id
+            user_ids = [u.id for u in User.query.order_by(User.id).all()]
+
+        barrier = threading.Barrier(buyers)
+        done = threading.Event()
+        results = {"ordered": 0, "out_of_stock": 0, "errors": 0, "swept": 0}
+        lock = threading.Lock()
+
+        def sold_out():
+            db.session.rollback()
+            left = db.session.get(Product, pid).stock
+            held = db.session.query(db.func.coalesce(db.func.sum(StockReservation.qty), 0)).scalar()
+            return left + held < qty
+
+        def buyer(uid):
+            with app.test_request_context():
+                session["user_id"] = uid
+                barrier.wait()
+                outcome = "out_of_stock"
+                for _ in range(500):
+                    try:
+                        clear_cart()  # каждая попытка — с пустой корзиной
+                        if add_to_cart(pid, qty):
+                            if sweeper:
+                                time.sleep(0.005)  # покупатель «думает» — чистка успевает снять резерв
+                            if place_order(uid):
+                                outcome = "ordered"
+                                break
+                    except OutOfStock:
+                        pass
+                    except Exception:
+                        db.session.rollback()
+                        with lock:
+                            results["errors"] += 1
+                    if sold_out():
+                        break
+                    time.sleep(0.002)
+                with lock:
+                    results[outcome] += 1
+
+        def sweep():
+            with app.app_context():
+                while not done.is_set():
+                    try:
+                        removed = release_expired_reservations()
+                    except Exception:
+                        removed = 0
+                        with lock:
+                            results["errors"] += 1
+                    with lock:
+                        results["swept"] += removed
+
+        t0 = time.perf_counter()
+        threads = [threading.Thread(target=buyer, args=(uid,)) for uid in user_ids]
+        sweeper_thread = threading.Thread(target=sweep) if sweeper else None
+        for t in threads + ([sweeper_thread] if sweeper_thread else []):
+            t.start()
+        for t in threads:
+            t.join()
+        done.set()
+        if sweeper_thread:
+            sweeper_thread.join()
+        results["elapsed"] = time.perf_counter() - t0
+
+        with app.app_context():
+            results["left"] = db.session.get(Product, pid).stock
+            results["sold"] = db.session.query(db.func.coalesce(db.func.sum(OrderItem.qty), 0)).scalar()
+            results["reserved"] = db.session.query(db.func.coalesce(db.func.sum(StockReservation.qty), 0)).scalar()
+            db.engine.dispose()
+    return results
+
+
+@click.command("stress-stock")
+@click.option("--buyers", default=50, show_default=True, help="Сколько покупателей одновременно берут товар.")
+@click.option("--stock", "stock", default=20, show_default=True, help="Остаток горячего товара.")
+@click.option("--qty", default=1, show_default=True, help="Сколько штук берёт каждый.")
+@click.option("--reserve/--no-reserve", default=True, show_default=True, help="Резервировать при добавлении в корзину.")
+@click.option("--sweeper/--no-sweeper", default=True, show_default=True,
+              help="Второй прогон: резерв живёт 0 с, чистка просроченных идёт во время оформления.")
+def stress_stock_command(buyers, stock, qty, reserve, sweeper):
+    """Нагрузочная проверка остатков: много покупателей одного товара, перепродаж быть не должно.
+    Заказов должно быть ровно min(buyers, stock // qty), остаток — ровно stock - заказы * qty.
+    Работает на временной БД, рабочую не трогает; при расхождении — код выхода 1.
+    """
+    expected = min(buyers, stock // qty)
+    runs = [("резерв" if reserve else "без резерва", reserve, False)]
+    if sweeper and reserve:
+        runs.append(("резерв + чистка", True, True))
+
+    failed = []
+    for name, run_reserve, run_sweeper in runs:
+        r = _stress_stock_run(buyers, stock, qty, run_reserve, run_sweeper)
+        click.echo(
+            f"[{name}] покупателей: {buyers}, остаток был: {stock}, заказов: {r['ordered']} "
+            f"(ожидалось {expected}), отказов: {r['out_of_stock']}, ошибок: {r['errors']}"
+            + (f", снято просроченных резервов: {r['swept']}" if run_sweeper else "")
+        )
+        click.echo(f"[{name}] продано: {r['sold']}, осталось: {r['left']}, в резерве: {r['reserved']}, "
+                   f"время: {r['elapsed']:.2f} с ({r['ordered'] / r['elapsed']:.1f} заказов/с)")
+        if (r["ordered"] != expected or r["sold"] != expected * qty
+                or r["left"] != stock - expected * qty or r["reserved"] != 0):
+            failed.append(name)
+    if failed:
+        raise click.ClickException(f"Остатки разошлись ({', '.join(failed)}) — перепродажа или потерянные единицы!")
+    click.echo("OK: перепродаж нет.")
+
+
+@click.command("bench-storage")
+@click.option("--threads", default=16, show_default=True)
+@click.option("--seconds", default=5.0, show_default=True)
+@click.option("--profile", "profiles", multiple=True, type=click.Choice(list(PROFILES)),
+              help="Какие профили сравнить (по умолчанию все).")
+def bench_storage_command(threads, seconds, profiles):
+    """Нагрузка на временную БД: чтение каталога + добавления в корзину, по профилям SQLite."""
+    for name in profiles or PROFILES:
+        r = benchmark_storage(name, threads=threads, seconds=seconds)
+        click.echo(
+            f"{r['profile']:11} чтений {r['reads']:6}  записей {r['writes']:6}  "
+            f"ошибок {r['errors']:5}  {r['rps']:8.1f} req/s"
+        )
+
+
+@click.command("sync-replicas")
+@with_appcontext
+def sync_replicas_command():
+    """Скопировать основную SQLite-БД в SQLite-реплики (локальная замена репликации)."""
+    primary = db.engine
+    if primary.dialect.name != "sqlite":
+        raise click.ClickException("Основная БД не SQLite — используйте штатную репликацию СУБД.")
+    replicas = {k: e for k, e in db.engines.items() if k and k.startswith(REPLICA_PREFIX)}
+    if not replicas:
+        click.echo("Реплики не настроены (READ_REPLICA_URIS).")
+        return
+    src = sqlite3.connect(primary.url.database)
+    try:
+        for key, engine in replicas.items():
+            if engine.dialect.name != "sqlite":
+                click.echo(f"{key}: пропущена (не SQLite)")
+                continue
+            engine.dispose()  # backup перезаписывает файл — старые соединения не нужны
+            dst = sqlite3.connect(engine.url.database)
+            try:
+                src.backup(dst)
+            finally:
+                dst.close()
+            click.echo(f"{key}: {engine.url.database} обновлена")
+    finally:
+        src.close()
+
+
+@click.command("rebuild-stats")
+@with_appcontext
+def rebuild_stats_command():
+    """Пересчитать статистику админ-панели (счётчики и итоги по дням) с нуля."""
+    counters = rebuild_stats()
+    click.echo("Stats rebuilt: " + ", ".join(f"{k}={v}" for k, v in counters.items()))
+
+
+@click.command("gc-sessions")
+@with_appcontext
+def gc_sessions_command():
+    """Удалить просроченные серверные сессии."""
+    store = getattr(current_app.session_interface, "store", None)
+    if store is None:
+        click.echo("Серверные сессии выключены (SESSION_BACKEND=cookie).")
+        return
+    click.echo(f"Удалено сессий: {store.gc()}")
+
+
+def _echo_rate(every: float = 2.0):
+    """on_batch для импорта/экспорта: печатать прогресс не чаще раза в every секунд."""
+    last = [0.0]
+
+    def report(stats):
+        now = time.perf_counter()
+        if now - last[0] >= every:
+            last[0] = now
+            click.echo(f"  ... {stats['rows']} строк, {stats['rows_per_sec']} строк/с", err=True)
+
+    return report
+
+
+@click.command("import-products")
+@click.argument("path")
+@click.option("--format", "fmt", type=click.Choice(FORMATS), help="По умолчанию — по расширению файла.")
+@click.option("--batch-size", default=1000, show_default=True, help="Строк в одной транзакции.")
+@click.option("--restart", is_flag=True, help="Не продолжать прерванный импорт, начать файл сначала.")
+@with_appcontext
+def import_products_command(path, fmt, batch_size, restart):
+    """Импорт товаров из CSV/JSONL с upsert по sku ("-" — stdin)."""
+    try:
+        if not restart and path != "-" and saved_progress(path):
+            click.echo(f"Продолжаем прерванный импорт со строки {saved_progress(path) + 1}.")
+        r = import_products(path, fmt=fmt, batch_size=batch_size, resume=not restart, on_batch=_echo_rate())
+    except (ValueError, OSError) as e:
+        raise click.ClickException(str(e))
+    for message in r["errors"]:
+        click.echo(f"  пропущена {message}", err=True)
+    click.echo(
+        f"Строк: {r['rows']} (пропущено как уже загруженные: {r['skipped']}), новых: {r['inserted']}, "
+        f"обновлено: {r['updated']}, с ошибками: {r['invalid']}; {r['seconds']} с, {r['rows_per_sec']} строк/с"
+    )
+
+
+@click.command("export-products")
+@click.argument("path")
+@click.option("--format", "fmt", type=click.Choice(FORMATS), help="По умолчанию — по расширению файла.")
+@click.option("--batch-size", default=1000, show_default=True, help="Строк за один запрос к БД.")
+@with_appcontext
+def export_products_command(path, fmt, batch_size):
+    """Выгрузка всех товаров в CSV/JSONL ("-" — stdout)."""
+    try:
+        r = export_products(path, fmt=fmt, batch_size=batch_size, on_batch=_echo_rate())
+    except (ValueError, OSError) as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Выгружено: {r['rows']}; {r['seconds']} с, {r['rows_per_sec']} строк/с", err=path == "-")
+
+
+@click.command("generate-data")
+@click.option("--users", default=1000, show_default=True)
+@click.option("--products", default=10_000, show_default=True)
+@click.option("--orders", default=20_000, show_default=True)
+@click.option("--cart-items", default=3, show_default=True, help="Товаров в корзине каждого пользователя.")
+@click.option("--seed", default=42, show_default=True)
+@with_appcontext
+def generate_data_command(users, products, orders, cart_items, seed):
+    """Добавить в БД синтетических пользователей, товары, корзины и историю заказов."""
+    started = time.perf_counter()
+    r = generate_data(users=users, products=products, orders=orders, cart_items=cart_items, seed=seed,
+                      password_method=current_app.config["PASSWORD_HASH_METHOD"])
+    click.echo(
+        f"Пользователей: {r['users']}, товаров: {r['products']}, заказов: {r['orders']}, "
+        f"позиций в корзинах: {r['cart_items']} за {time.perf_counter() - started:.1f} с. "
+        f"Пароль у всех: {BENCH_PASSWORD}, админ: {BENCH_ADMIN}"
+    )
+
+
+@click.command("bench-app")
+@click.option("--users", default=500, show_default=True)
+@click.option("--products", default=5000, show_default=True)
+@click.option("--orders", default=5000, show_default=True)
+@click.option("--requests", "n", default=200, show_default=True, help="Замеров на сценарий.")
+@click.option("--warmup", default=10, show_default=True, help="Прогревочных запросов (не в замере).")
+@click.option("--seed", default=42, show_default=True)
+@click.option("--scenario", "scenarios", multiple=True, type=click.Choice(SCENARIOS),
+              help="Какие сценарии гонять (по умолчанию все).")
+@click.option("--no-cache", is_flag=True, help="Выключить кэш товаров (мерить БД).")
+@click.option("--output", type=click.Path(dir_okay=False), help="Записать JSON в файл.")
+def bench_app_command(users, products, orders, n, warmup, seed, scenarios, no_cache, output):
+    """Бенчмарк страниц на временной БД: p50/p95/p99 и число SQL-запросов, JSON."""
+    config = {"PRODUCT_CACHE_SIZE": 0} if no_cache else {}
+    r = run_benchmark(users=users, products=products, orders=orders, requests=n, warmup=warmup,
+                      seed=seed, scenarios=scenarios, config=config)
+    text = json.dumps(r, ensure_ascii=False, indent=2)
+    if output:
+        Path(output).write_text(text + "\n", encoding="utf-8")
+        click.echo(f"Результат записан в {output}")
+    else:
+        click.echo(text)
+
+
+@click.command("serve")
+@click.option("--bind", help="HOST:PORT (по умолчанию SERVER_BIND).")
+@click.option("--workers", type=int, help="Процессов (по умолчанию SERVER_WORKERS).")
+@click.option("--threads", type=int, help="Потоков на процесс (по умолчанию SERVER_THREADS).")
+@with_appcontext
+def serve_command(bind, workers, threads):
+    """Продакшн-сервер: gunicorn (prefork) или waitress на Windows."""
+    from . import create_app
+
+    build_assets(current_app.static_folder, current_app.config["ASSETS_DIR"])
+    try:
+        serve(create_app, current_app.config, bind=bind, workers=workers, threads=threads)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+
+
+@click.command("bench-serve")
+@click.option("--concurrency", default=16, show_default=True, help="Одновременных клиентов.")
+@click.option("--seconds", default=10.0, show_default=True)
+@click.option("--workers", type=int, help="Процессов продакшн-режима (по умолчанию SERVER_WORKERS).")
+@click.option("--threads", type=int, help="Потоков на процесс продакшн-режима.")
+@click.option("--mode", "modes", multiple=True, type=click.Choice(["dev", "prod"]), help="По умолчанию оба.")
+def bench_serve_command(concurrency, seconds, workers, threads, modes):
+    """requests/sec dev-сервера (app.run) и продакшн-режима на временной БД."""
+    for r in bench_servers(modes=modes or ("dev", "prod"), concurrency=concurrency, seconds=seconds,
+                           workers=workers, threads=threads):
+        click.echo(
+            f"{r['mode']:5} {r['rps']:8.1f} req/s  p50 {r['p50_ms']:7.2f} мс  p99 {r['p99_ms']:7.2f} мс  "
+            f"ответов {r['ok']}, ошибок {r['errors']}"
+        )
+
+
+@click.command("worker")
+@click.option("--queue", "queues", multiple=True, help="Обрабатывать только эти очереди (по умолчанию все).")
+@click.option("--batch", type=int, help="Задач за раз (по умолчанию JOBS_BATCH_SIZE).")
+@click.option("--poll", type=float, help="Сек ждать при пустой очереди (по умолчанию JOBS_POLL_INTERVAL).")
+@click.option("--once", is_flag=True, help="Выполнить готовые задачи и выйти.")
+@with_appcontext
+def worker_command(queues, batch, poll, once):
+    """Воркер фоновых задач (очередь в БД, см. jobs.py). Останавливается по Ctrl+C / SIGTERM."""
+    if once:
+        click.echo(f"Выполнено задач: {work_off(queues=queues or None)}")
+    else:
+        run_worker(queues=queues or None, batch=batch, poll=poll)
+    counts = job_counts()
+    click.echo("Задачи: " + ", ".join(f"{k} {counts.get(k, 0)}" for k in ("queued", "running", "done", "failed")))
+
+
+@click.command("ingest-images")
+@click.option("--redo", is_flag=True, help="Заново обработать и товары, у которых картинка уже есть.")
+@click.option("--limit", type=int, help="Не больше стольких товаров.")
+@click.option("--workers", default=4, show_default=True, help="Одновременных загрузок.")
+@with_appcontext
+def ingest_images_command(redo, limit, workers):
+    """Скачать картинки товаров по image_url и нарезать локальные превью (см. images.py)."""
+    started = time.perf_counter()
+
+    def progress(result, total):
+        done = result["urls"] + result["failed"]
+        if done % 20 == 0:
+            click.echo(f"  {done}/{total} ссылок, ошибок {result['failed']}")
+
+    try:
+        result = backfill_images(redo=redo, limit=limit, workers=workers, on_progress=progress)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    for url, error in result["errors"][:20]:
+        click.echo(f"  ! {url}: {error}", err=True)
+    click.echo(
+        f"Картинок: {result['urls']} (товаров {result['products']}), ошибок {result['failed']}, "
+        f"{time.perf_counter() - started:.1f} с"
+    )
+
+
+@click.command("build-assets")
+@click.option("--no-prune", is_flag=True, help="Не удалять файлы сборок старше предыдущей.")
+@with_appcontext
+def build_assets_command(no_prune):
+    """Статика с отпечатками в именах, manifest.json и заранее сжатые .gz/.br (см. assets.py)."""
+    result = build_assets(current_app.static_folder, current_app.config["ASSETS_DIR"], prune=not no_prune)
+    for name, target, size, compressed in result["report"]:
+        sizes = "  ".join(f"{suffix} {n / 1024:.1f} КБ" for suffix, n in sorted(compressed.items()))
+        click.echo(f"{name:32} -> {target}  {size / 1024:.1f} КБ  {sizes}")
+    if not any(".br" in c for *_, c in result["report"]):
+        click.echo("Для .br установите пакет brotli: pip install brotli")
+
+
+@click.command("bench-render")
+@click.option("--cards", default=500, show_default=True, help="Карточек на странице каталога.")
+@click.option("--rounds", default=30, show_default=True, help="Рендеров на каждый вариант.")
+@click.option("--store", "stores", multiple=True, type=click.Choice(RENDER_STORES),
+              help="Какие хранилища кэша фрагментов сравнить (по умолчанию все).")
+def bench_render_command(cards, rounds, stores):
+    """Время рендера каталога без кэша фрагментов, с пустым и с прогретым кэшем (см. fragments.py)."""
+    r = run_render_benchmark(cards=cards, rounds=rounds, stores=stores)
+    click.echo(f"Карточек: {r['meta']['cards']}, рендеров на вариант: {rounds}")
+    for name, result in r["stores"].items():
+        for mode, t in ([("", result)] if name == "none" else [("cold", result["cold"]), ("warm", result["warm"])]):
+            click.echo(f"{name:7}{mode:5} p50 {t['p50_ms']:8.2f} мс  p95 {t['p95_ms']:8.2f} мс  среднее {t['mean_ms']:8.2f} мс")
+        if not result.get("same_html", True):
+            click.echo(f"  ! {name}: HTML из кэша отличается от HTML без кэша", err=True)
+
+
+@click.command("check-http-cache")
+def check_http_cache_command():
+    """Проверка валидаторов витрины (см. httpcache.py): после удаления товара и снятия
+    с продажи ни If-None-Match, ни If-Modified-Since не должны получать 304.
+    Работает на временной БД, рабочую не трогает.
+    """
+    from . import create_app
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{Path(tmp, 'http.sqlite3').as_posix()}"})
+        with app.app_context():
+            db.create_all()
+            db.session.add(User(username="admin", password_hash=generate_password_hash("admin123"), role="admin"))
+            db.session.add_all(Product(title=f"Товар {i}", price=100, category="Другое") for i in range(3))
+            db.session.commit()
+            pids = [p.id for p in Product.query.order_by(Product.id)]
+
+        guest = app.test_client()
+        admin = app.test_client()
+        admin.post("/auth/login", data={"username": "admin", "password": "admin123"})
+        changes = [
+            ("удаление товара", lambda: admin.post(f"/admin/products/{pids[0]}/delete")),
+            ("снятие с продажи", lambda: admin.post(f"/admin/products/{pids[1]}/edit",
+                                                    data={"title": "Товар 1", "price": "100"})),
+        ]
+        failed = []
+        for name, change in changes:
+            etag = guest.get("/catalog").headers["ETag"]
+            since = http_date(time.time() + 1)
+            if guest.get("/catalog", headers={"If-None-Match": etag}).status_code != 304:
+                raise click.ClickException("Неизменённая страница не отдаёт 304 по ETag.")
+            change()
+            codes = {
+                header: guest.get("/catalog", headers={header: value}).status_code
+                for header, value in (("If-None-Match", etag), ("If-Modified-Since", since))
+            }
+            click.echo(f"{name}: " + ", ".join(f"{h} -> {code}" for h, code in codes.items()))
+            if 304 in codes.values():
+                failed.append(name)
+        with app.app_context():
+            db.engine.dispose()
+
+    if failed:
+        raise click.ClickException(f"Устаревшая страница отдана как 304: {', '.join(failed)}")
+    click.echo("OK: изменения каталога сбрасывают валидаторы.")
@@ -1,3 +1,43 @@
 from flask_sqlalchemy import SQLAlchemy
 
-db = SQLAlchemy()
+from .routing import RoutingSession
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+
+def dialect_insert(table):
+    """INSERT с поддержкой ON CONFLICT (upsert) для текущей БД (SQLite/PostgreSQL)."""
+    if db.session.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+
+def ensure_columns():
+    """create_all() не добавляет новые колонки в существующие таблицы — досоздаём
+    недостающие (только nullable или с server_default, как допускает ALTER TABLE ADD COLUMN).
+    """
+    engine = db.engine
+    insp = db.inspect(engine)
+    with engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if not insp.has_table(table.name):
+                continue
+            existing = {c["name"] for c in insp.get_columns(table.name)}
+            for col in table.columns:
+                if col.name in existing:
+                    continue
+                if not col.nullable and col.server_default is None:
+                    raise RuntimeError(f"Нельзя добавить NOT NULL колонку {table.name}.{col.name} без server_default")
+                ddl = f'ALTER TABLE "{table.name}" ADD COLUMN "{col.name}" {col.type.compile(dialect=engine.dialect)}'
+                if col.server_default is not None:
+                    ddl += f" DEFAULT {col.server_default.arg}"
+                conn.exec_driver_sql(ddl)
+
+
+def ensure_indexes():
+    """create_all() не добавляет индексы в уже существующие таблицы — досоздаём их."""
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
@@ -0,0 +1,140 @@
+"""Кэш фрагментов шаблонов: {% cache "card", p.id, p.updated_at %} ... {% endcache %}.
+
+Ключ фрагмента — перечисленные значения (id и версия товара, роль пользователя и т.п.)
+плюс build_id (см. httpcache.py): после выкладки новых шаблонов старые фрагменты
+просто перестают находиться. Явной инвалидации нет — товар изменился, сменился и
+updated_at в ключе, старая запись уходит по LRU или TTL.
+
+Хранилище — FRAGMENT_CACHE:
+- "memory" — LRU в памяти процесса (FRAGMENT_CACHE_SIZE записей), по умолчанию;
+- "redis"  — общее для всех процессов: redis.Redis по FRAGMENT_CACHE_REDIS_URL
+             или LocalRedis (sessions.py) без него;
+- "none"   — выключено, блоки {% cache %} рендерятся каждый раз.
+Все записи живут не дольше FRAGMENT_CACHE_TTL секунд.
+
+В ключ должно входить всё, от чего зависит HTML блока: данные текущего запроса
+(строка поиска, flash-сообщения) внутрь {% cache %} не кладём.
+"""
+import threading
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from .cache import LRUCache
+from .sessions import LocalRedis
+
+
+class MemoryFragmentStore:
+    """Фрагменты в памяти процесса: у каждого воркера gunicorn свой набор."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._lru = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, key):
+        return self._lru.get(key)
+
+    def set(self, key, html: str):
+        self._lru.set(key, html)
+
+
+class RedisFragmentStore:
+    """Фрагменты в Redis (ключ fragment:<...>, TTL ключа): один прогрев на все процессы."""
+
+    def __init__(self, client, ttl: float, prefix: str = "fragment:"):
+        self.client = client
+        self.ttl = max(int(ttl), 1)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return value.decode("utf-8") if isinstance(value, bytes) else value
+
+    def set(self, key, html: str):
+        self.client.setex(self.prefix + key, self.ttl, html)
+
+
+class FragmentCache:
+    """Хранилище + префикс ключей + счётчики попаданий (для /metrics и /admin/cache)."""
+
+    def __init__(self, store, prefix: str = ""):
+        self.store = store
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def render(self, parts, render_body) -> Markup:
+        key = self.prefix + ":".join(str(p) for p in parts)
+        html = self.store.get(key)
+        with self._lock:
+            if html is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if html is None:
+            html = str(render_body())
+            self.store.set(key, html)
+        return Markup(html)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "store": type(self.store).__name__,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+class FragmentCacheExtension(Extension):
+    """Тег {% cache часть1, часть2, ... %}тело{% endcache %}."""
+
+    tags = {"cache"}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parts = [parser.parse_expression()]
+        while parser.stream.skip_if("comma"):
+            parts.append(parser.parse_expression())
+        body = parser.parse_statements(("name:endcache",), drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method("_render", [nodes.List(parts)]), [], [], body
+        ).set_lineno(lineno)
+
+    def _render(self, parts, caller):
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+        return cache.render(parts, caller)
+
+
+def make_fragment_store(config):
+    backend = config["FRAGMENT_CACHE"]
+    ttl = config["FRAGMENT_CACHE_TTL"]
+    if backend == "none":
+        return None
+    if backend == "memory":
+        return MemoryFragmentStore(config["FRAGMENT_CACHE_SIZE"], ttl)
+    if backend == "redis":
+        url = config.get("FRAGMENT_CACHE_REDIS_URL")
+        if url:
+            import redis  # опциональная зависимость: pip install redis
+
+            return RedisFragmentStore(redis.Redis.from_url(url), ttl)
+        return RedisFragmentStore(LocalRedis(), ttl)
+    raise ValueError(f"Неизвестный FRAGMENT_CACHE: {backend!r}")
+
+
+def init_fragments(app):
+    """Подключить тег {% cache %}; вызывать после init_http_cache (нужен build_id)."""
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    store = make_fragment_store(app.config)
+    cache = FragmentCache(store, prefix=f"{app.extensions['build_id']}:") if store is not None else None
+    app.jinja_env.fragment_cache = cache
+    app.extensions["fragment_cache"] = cache
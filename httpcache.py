@@ -0,0 +1,109 @@
+"""HTTP-кэширование страниц витрины: ETag и 304.
+
+ETag страницы = версия кода и шаблонов + catalog_version (см. stats.py) + персональная
+часть. Для гостя персональной части нет: счётчик корзины в шапке не рендерится,
+его подставляет app.js из cookie cart_count. Поэтому страница каталога у всех гостей
+одинаковая и кэшируется обратным прокси (Cache-Control: public, s-maxage=...).
+У вошедшего пользователя в ETag входят id и число товаров в корзине, кэш — только в браузере.
+
+@conditional_page проверяет If-None-Match ДО вызова вью: на совпадение — 304 без
+обращения к товарам и без шаблонов (одна выборка версии по первичному ключу).
+Страницы с одноразовым flash-сообщением не кэшируются.
+
+Last-Modified не отдаём: updated_at показанных товаров не меняется, когда товар
+удалили или сняли с продажи, при выкладке и при изменении корзины — по
+If-Modified-Since клиент получил бы 304 с устаревшей страницей. Валидатор один — ETag.
+"""
+import hashlib
+from pathlib import Path
+from functools import wraps
+
+from flask import request, session, current_app, make_response
+
+from .stats import catalog_version
+from .utils import current_user, cart_count, cart_changed
+
+CART_COOKIE = "cart_count"
+
+
+def build_id(app) -> str:
+    """Отпечаток кода и шаблонов: после выкладки старые ETag перестают совпадать."""
+    h = hashlib.sha1()
+    roots = {Path(__file__).resolve().parent, Path(app.template_folder).resolve()}
+    for root in sorted(roots):
+        for path in sorted(root.glob("*")):
+            if path.suffix in (".py", ".html") and path.is_file():
+                st = path.stat()
+                h.update(f"{path.name}:{st.st_size}:{st.st_mtime_ns}".encode())
+    assets = app.extensions.get("assets")
+    if assets is not None:  # пересобрали статику — в HTML другие ссылки на CSS/JS
+        h.update(repr(sorted(assets.files.items())).encode())
+    return h.hexdigest()[:12]
+
+
+def _personal() -> str:
+    u = current_user()
+    return f"u{u.id}:{cart_count()}" if u else "guest"
+
+
+def page_etag() -> str:
+    version = catalog_version()
+    # товар мог поменять другой процесс: тогда локальный кэш товаров устарел
+    current_app.extensions["product_cache"].sync_source(version)
+    raw = f"{current_app.extensions['build_id']}|{version}|{_personal()}"
+    return hashlib.sha1(raw.encode()).hexdigest()[:20]
+
+
+def _cache_headers(response, public: bool):
+    cc = response.cache_control
+    if public:
+        cc.public = True
+        cc.max_age = 0  # браузер каждый раз переспрашивает (дёшево: 304)
+        cc.s_maxage = current_app.config["HTTP_CACHE_SHARED_MAX_AGE"]
+    else:
+        cc.private = True
+        cc.no_cache = True
+    response.vary.add("Cookie")
+
+
+def conditional_page(view):
+    """ETag и 304 для страниц витрины."""
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if session.get("_flashes"):
+            response = make_response(view(*args, **kwargs))
+            response.cache_control.no_store = True
+            return response
+
+        public = current_user() is None
+        etag = page_etag()
+        if request.if_none_match.contains(etag):
+            response = current_app.response_class(status=304)
+            response.set_etag(etag)
+            _cache_headers(response, public)
+            return response
+
+        response = make_response(view(*args, **kwargs))
+        if response.status_code != 200:
+            return response
+        response.set_etag(etag)
+        _cache_headers(response, public)
+        return response
+
+    return wrapped
+
+
+def init_http_cache(app):
+    app.extensions["build_id"] = build_id(app)
+
+    @app.after_request
+    def _sync_cart_cookie(response):
+        # счётчик корзины гостя для шапки (страницы его не содержат — см. выше)
+        if response.mimetype != "text/html" and not cart_changed():
+            return response
+        count = str(cart_count())
+        # нет cookie = пустая корзина: первый визит гостя обходится без Set-Cookie
+        if request.cookies.get(CART_COOKIE, "0") != count:
+            response.set_cookie(CART_COOKIE, count, max_age=30 * 24 * 3600, samesite="Lax",
+                                secure=request.is_secure)
+        return response
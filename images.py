@@ -0,0 +1,262 @@
+"""Картинки товаров: загрузка один раз, локальные превью, раздача с вечным кэшем.
+
+Исходник (ссылка image_url или файл из админки) скачивается и проверяется один раз,
+из него нарезаются варианты VARIANTS в WebP и JPEG. Хранилище адресуется содержимым:
+image_key = sha256 исходника, файлы — IMAGE_DIR/<2 символа>/<key>/<вариант>.<webp|jpg>.
+Одинаковые картинки у разных товаров хранятся один раз, а файл по адресу никогда
+не меняется — /media/... отдаётся с Cache-Control: immutable на год.
+
+Шаблоны вызывают product_picture(p, "card"): <picture> с WebP и JPEG-запасным вариантом.
+Пока картинка не обработана — прямая ссылка image_url, нет картинки — встроенная заглушка.
+Ссылки из админки обрабатывает воркер (задача image.ingest), старые товары —
+`flask ingest-images`.
+"""
+import io
+import os
+import re
+import hashlib
+import tempfile
+import urllib.request
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+from flask import current_app, url_for, send_from_directory, abort
+from markupsafe import Markup, escape
+
+from .db import db
+from .models import Product
+from .jobs import task
+from .stats import add_counters
+
+# имя -> (ширина, высота, обрезать до пропорций); без обрезки — вписать в рамку
+VARIANTS = {
+    "thumb": (300, 300, True),   # строка каталога на телефоне
+    "card": (600, 450, True),    # карточка в сетке каталога и на главной
+    "hero": (1200, 800, False),  # страница товара
+}
+FORMATS = {"webp": "WEBP", "jpg": "JPEG"}
+
+_KEY_RE = re.compile(r"^[0-9a-f]{32}$")
+_PLACEHOLDER = (
+    "data:image/svg+xml;charset=utf-8,"
+    "%3Csvg xmlns='http://www.w3.org/2000/svg' viewBox='0 0 4 3'%3E"
+    "%3Crect width='4' height='3' fill='%23eceff3'/%3E%3C/svg%3E"
+)
+
+
+class ImageError(ValueError):
+    """Картинку не удалось скачать или это не картинка."""
+
+
+def image_dir() -> Path:
+    return Path(current_app.config["IMAGE_DIR"])
+
+
+def _variant_path(key: str, variant: str, fmt: str) -> Path:
+    return image_dir() / key[:2] / key / f"{variant}.{fmt}"
+
+
+def has_variants(key: str) -> bool:
+    return all(_variant_path(key, v, f).exists() for v in VARIANTS for f in FORMATS)
+
+
+# -------------------------
+# Загрузка и нарезка
+# -------------------------
+
+def fetch(url: str) -> bytes:
+    """Скачать исходник (http/https, не больше IMAGE_MAX_BYTES)."""
+    if urlparse(url).scheme not in ("http", "https"):
+        raise ImageError(f"Неподдерживаемая ссылка: {url}")
+    limit = current_app.config["IMAGE_MAX_BYTES"]
+    req = urllib.request.Request(url, headers={"User-Agent": "ShopLite image fetcher"})
+    try:
+        with urllib.request.urlopen(req, timeout=current_app.config["IMAGE_FETCH_TIMEOUT"]) as resp:
+            return resp.read(limit + 1)  # лишний байт — ingest_bytes поймёт, что файл больше
+    except OSError as e:
+        raise ImageError(f"Не удалось скачать {url}: {e}") from None
+
+
+def _write(path: Path, image, fmt: str):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    config = current_app.config
+    options = (
+        {"quality": config["IMAGE_WEBP_QUALITY"], "method": 4}
+        if fmt == "webp"
+        else {"quality": config["IMAGE_JPEG_QUALITY"], "optimize": True, "progressive": True}
+    )
+    # временный файл + os.replace: читатель не увидит недописанный файл
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            image.save(f, FORMATS[fmt], **options)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def ingest_bytes(data: bytes) -> str:
+    """Проверить картинку, нарезать варианты (если их ещё нет) и вернуть image_key."""
+    try:
+        from PIL import Image, ImageOps  # опциональная зависимость: pip install Pillow
+    except ImportError:
+        raise RuntimeError("Для обработки картинок нужен Pillow: pip install Pillow") from None
+
+    limit = current_app.config["IMAGE_MAX_BYTES"]
+    if len(data) > limit:
+        raise ImageError(f"Файл больше {limit // (1024 * 1024)} МБ")
+    key = hashlib.sha256(data).hexdigest()[:32]
+    if has_variants(key):
+        return key  # такая картинка уже есть (у другого товара или прошлым запуском)
+
+    Image.MAX_IMAGE_PIXELS = current_app.config["IMAGE_MAX_PIXELS"]
+    try:
+        with Image.open(io.BytesIO(data)) as probe:
+            probe.verify()  # битый файл / не картинка — до декодирования целиком
+        image = Image.open(io.BytesIO(data))
+        image = ImageOps.exif_transpose(image)  # фото с телефона — с учётом поворота
+        if image.mode in ("RGBA", "LA", "P"):
+            # прозрачность (PNG) — на белый фон, в JPEG её нет
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, "white")
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        else:
+            image = image.convert("RGB")
+    except Image.DecompressionBombError:
+        raise ImageError("Слишком большое разрешение") from None
+    except (OSError, SyntaxError):
+        raise ImageError("Не картинка или повреждённый файл") from None
+
+    for variant, (width, height, crop) in VARIANTS.items():
+        if crop:
+            resized = ImageOps.fit(image, (width, height), Image.LANCZOS)
+        else:
+            resized = image.copy()
+            resized.thumbnail((width, height), Image.LANCZOS)  # только уменьшает
+        for fmt in FORMATS:
+            _write(_variant_path(key, variant, fmt), resized, fmt)
+    return key
+
+
+def ingest_url(url: str) -> str:
+    return ingest_bytes(fetch(url))
+
+
+def set_image(product_id: int, key: str, url: str = None) -> bool:
+    """Привязать обработанную картинку к товару. С url — только если ссылка у товара
+    не поменялась, пока картинка качалась. Коммит — за вызывающим.
+    """
+    p = db.session.get(Product, product_id)
+    if p is None or (url is not None and p.image_url != url):
+        return False
+    p.image_key = key  # after_flush поднимет catalog_version — ETag страниц сменится
+    return True
+
+
+@task("image.ingest", max_attempts=4)
+def ingest_product_image(payload):
+    """Фоновая обработка ссылки из админки."""
+    # кэши товаров веб-процессов сбросятся сами: сменится catalog_version (cache.sync_source)
+    set_image(payload["product_id"], ingest_url(payload["url"]), payload["url"])
+
+
+def backfill_images(redo: bool = False, limit: int = None, workers: int = 4, on_progress=None) -> dict:
+    """Обработать ссылки image_url уже существующих товаров (`flask ingest-images`).
+    Каждая ссылка качается один раз (даже если она у нескольких товаров), в workers потоков;
+    товары обновляются в этом потоке пачками. redo=True — заново и уже обработанные.
+    Возвращает {"products", "urls", "failed", "errors": [(url, текст)]}.
+    """
+    table = Product.__table__
+    query = db.select(table.c.id, table.c.image_url).where(table.c.image_url.is_not(None), table.c.image_url != "")
+    if not redo:
+        query = query.where(table.c.image_key.is_(None))
+    if limit:
+        query = query.limit(limit)
+    by_url = {}
+    for pid, url in db.session.execute(query.order_by(table.c.id)):
+        by_url.setdefault(url, []).append(pid)
+
+    app = current_app._get_current_object()
+
+    def work(url):
+        with app.app_context():
+            return ingest_url(url)
+
+    result = {"products": 0, "urls": 0, "failed": 0, "errors": []}
+    pending = []
+
+    def save():
+        for url, key, pids in pending:
+            # ссылка могла смениться, пока картинка качалась — такие товары не трогаем
+            db.session.execute(
+                db.update(table).where(table.c.id.in_(pids), table.c.image_url == url).values(image_key=key)
+            )
+        add_counters(catalog_version=1)  # массовое обновление мимо ORM — ETag страниц вручную
+        db.session.commit()
+        pending.clear()
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        futures = {pool.submit(work, url): url for url in by_url}
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                key = future.result()
+            except ImageError as e:
+                result["failed"] += 1
+                result["errors"].append((url, str(e)))
+                continue
+            pending.append((url, key, by_url[url]))
+            result["urls"] += 1
+            result["products"] += len(by_url[url])
+            if len(pending) >= 50:
+                save()
+            if on_progress:
+                on_progress(result, len(by_url))
+    if pending:
+        save()
+    return result
+
+
+# -------------------------
+# Шаблоны и раздача
+# -------------------------
+
+def image_urls(p, variant: str) -> dict:
+    """{"webp": url, "jpg": url} локальных вариантов или {"jpg": запасной url}."""
+    key = getattr(p, "image_key", None)
+    if key:
+        return {fmt: url_for("media", key=key, name=f"{variant}.{fmt}") for fmt in FORMATS}
+    return {"jpg": p.image_url or _PLACEHOLDER}
+
+
+def product_picture(p, variant: str = "card", css_class: str = "", lazy: bool = True) -> Markup:
+    width, height, _crop = VARIANTS[variant]
+    urls = image_urls(p, variant)
+    source = f'<source type="image/webp" srcset="{escape(urls["webp"])}">' if "webp" in urls else ""
+    attrs = f' class="{escape(css_class)}"' if css_class else ""
+    if lazy:
+        attrs += ' loading="lazy" decoding="async"'
+    return Markup(
+        f'<picture>{source}<img{attrs} src="{escape(urls["jpg"])}" '
+        f'width="{width}" height="{height}" alt="{escape(p.title)}"></picture>'
+    )
+
+
+def media_view(key: str, name: str):
+    variant, _, fmt = name.partition(".")
+    if not _KEY_RE.match(key) or variant not in VARIANTS or fmt not in FORMATS:
+        abort(404)
+    # содержимое по адресу не меняется никогда — кэш на год, без перепроверок
+    response = send_from_directory(image_dir() / key[:2] / key, name, max_age=365 * 24 * 3600)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def init_images(app):
+    Path(app.config["IMAGE_DIR"]).mkdir(parents=True, exist_ok=True)
+    app.add_url_rule("/media/<key>/<name>", "media", media_view)
+    app.jinja_env.globals.update(product_picture=product_picture)
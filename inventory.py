@@ -0,0 +1,129 @@
+"""Складские остатки и резервы.
+
+Product.stock — сколько единиц можно продать (None — остаток не учитывается).
+Любое списание делается условным UPDATE ... WHERE stock >= :qty, без чтения
+остатка в Python, поэтому два покупателя не могут продать одну и ту же единицу.
+
+Резерв (StockReservation) — единицы, уже снятые со stock под корзину пользователя.
+При оформлении заказа резерв засчитывается, при удалении из корзины и по истечении
+срока возвращается на склад (release_expired_reservations).
+Резерв забирается одним DELETE ... RETURNING (_claim): строку получает только тот,
+кто её удалил, поэтому оформление и чистка просроченных не засчитают её дважды.
+"""
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from .db import db, dialect_insert
+from .models import Product, StockReservation
+
+
+class OutOfStock(Exception):
+    """Не хватает остатка по одному или нескольким товарам."""
+
+    def __init__(self, product_ids):
+        self.product_ids = list(product_ids)
+        super().__init__(f"Недостаточно товара: {self.product_ids}")
+
+
+def _take(product_id: int, qty: int) -> bool:
+    """Списать qty единиц со склада. True — списано (или остаток не учитывается)."""
+    if qty <= 0:
+        return True
+    table = Product.__table__
+    res = db.session.execute(
+        db.update(table)
+        .where(table.c.id == product_id, db.or_(table.c.stock.is_(None), table.c.stock >= qty))
+        .values(stock=db.case((table.c.stock.is_(None), None), else_=table.c.stock - qty))
+    )
+    return res.rowcount == 1
+
+
+def _give_back(product_id: int, qty: int):
+    """Вернуть qty единиц на склад (для товаров с учётом остатка)."""
+    if qty <= 0:
+        return
+    table = Product.__table__
+    db.session.execute(
+        db.update(table)
+        .where(table.c.id == product_id, table.c.stock.isnot(None))
+        .values(stock=table.c.stock + qty)
+    )
+
+
+def reserve(user_id: int, product_id: int, qty: int = 1) -> bool:
+    """Зарезервировать qty единиц под корзину пользователя (без commit).
+    Продлевает срок резерва. False — на складе не хватает.
+    """
+    if not _take(product_id, qty):
+        return False
+    expires_at = datetime.utcnow() + timedelta(seconds=current_app.config["STOCK_RESERVATION_TTL"])
+    table = StockReservation.__table__
+    stmt = dialect_insert(table).values(
+        user_id=user_id, product_id=product_id, qty=qty, expires_at=expires_at
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.product_id],
+        set_={"qty": table.c.qty + stmt.excluded.qty, "expires_at": stmt.excluded.expires_at},
+    )
+    db.session.execute(stmt)
+    return True
+
+
+def _claim(*criteria):
+    """Удалить резервы по условию и вернуть удалённые строки [(product_id, qty)]."""
+    table = StockReservation.__table__
+    return db.session.execute(
+        db.delete(table).where(*criteria).returning(table.c.product_id, table.c.qty)
+    ).all()
+
+
+def release(user_id: int, product_id=None):
+    """Снять резерв пользователя (по товару или весь) и вернуть единицы на склад (без commit)."""
+    table = StockReservation.__table__
+    criteria = [table.c.user_id == user_id]
+    if product_id is not None:
+        criteria.append(table.c.product_id == product_id)
+    for pid, qty in _claim(*criteria):
+        _give_back(pid, int(qty))
+
+
+def commit_stock(user_id: int, lines):
+    """Списать остатки под заказ (без commit; вызывать внутри транзакции оформления).
+
+    lines — [(product_id, qty)]. Резерв пользователя засчитывается: со склада
+    добирается только разница, лишний резерв возвращается. Если хоть одного товара
+    не хватает — OutOfStock (вызывающий код откатывает транзакцию).
+    """
+    reserved = dict(_claim(StockReservation.__table__.c.user_id == user_id))
+    short = []
+    for pid, qty in lines:
+        extra = int(qty) - int(reserved.pop(pid, 0))
+        if extra > 0:
+            if not _take(pid, extra):
+                short.append(pid)
+        else:
+            _give_back(pid, -extra)
+    if short:
+        raise OutOfStock(short)
+
+    # резерв по товарам, которых уже нет в заказе, — обратно на склад
+    for pid, qty in reserved.items():
+        _give_back(pid, int(qty))
+
+
+def release_expired_reservations(now=None) -> int:
+    """Вернуть на склад просроченные резервы. Возвращает число снятых резервов."""
+    now = now or datetime.utcnow()
+    try:
+        rows = _claim(StockReservation.__table__.c.expires_at < now)
+        per_product = {}
+        for pid, qty in rows:
+            per_product[pid] = per_product.get(pid, 0) + int(qty)
+        for pid, qty in per_product.items():
+            _give_back(pid, qty)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return len(rows)
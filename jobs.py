@@ -0,0 +1,264 @@
+"""Фоновые задачи: очередь в таблице job той же БД, без внешнего брокера.
+
+Запрос только ставит задачу — enqueue() в своей транзакции (заказ и задача на его
+обработку сохраняются вместе или не сохраняются вовсе). Выполняет их отдельный процесс
+`flask worker` (или `python run.py worker`):
+- забирает готовые задачи пачкой до JOBS_BATCH_SIZE одним UPDATE и «арендует» их
+  на JOBS_LEASE_SECONDS; если воркер упал, после аренды задачу заберёт другой —
+  доставка «хотя бы один раз», поэтому обработчики должны быть идемпотентными;
+- ошибка -> повтор через JOBS_BACKOFF_BASE * 2^(попытка-1) сек (с разбросом, не больше
+  JOBS_BACKOFF_MAX); после max_attempts попыток задача остаётся со статусом failed;
+- idempotency_key уникален: повторная постановка той же задачи ничего не делает;
+- задачи с @task(batch=True) получают все полученные в пачке payload одним вызовом
+  (одна транзакция вместо N); если пачка упала — задачи повторяются по одной.
+Выполненные задачи удаляются через JOBS_KEEP_DONE_DAYS дней.
+
+В тестах воркер не нужен: work_off() выполняет всё готовое в текущем процессе.
+"""
+import os
+import json
+import logging
+import time
+import uuid
+import random
+import signal
+import socket
+import threading
+import traceback
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import or_, and_
+
+from .db import db, dialect_insert
+from .models import Job
+
+TASKS = {}
+
+
+class _Task:
+    def __init__(self, fn, name: str, batch: bool, max_attempts, queue: str):
+        self.fn = fn
+        self.name = name
+        self.batch = batch
+        self.max_attempts = max_attempts
+        self.queue = queue
+
+
+def task(name: str, batch: bool = False, max_attempts: int = None, queue: str = "default"):
+    """Зарегистрировать обработчик: fn(payload) или, при batch=True, fn([payload, ...])."""
+    def register(fn):
+        TASKS[name] = _Task(fn, name, batch, max_attempts, queue)
+        return fn
+
+    return register
+
+
+def enqueue(name: str, payload: dict = None, key: str = None, delay: float = 0, max_attempts: int = None):
+    """Поставить задачу в текущей транзакции (commit — за вызывающим).
+    key — ключ идемпотентности: задача с таким ключом уже есть -> ничего не происходит.
+    """
+    spec = TASKS.get(name)
+    if spec is None:
+        raise KeyError(f"Неизвестная задача: {name}")
+    now = datetime.utcnow()
+    stmt = dialect_insert(Job.__table__).values(
+        queue=spec.queue,
+        name=name,
+        payload=json.dumps(payload or {}, ensure_ascii=False),
+        idempotency_key=key,
+        status="queued",
+        attempts=0,
+        max_attempts=max_attempts or spec.max_attempts or current_app.config["JOBS_MAX_ATTEMPTS"],
+        run_at=now + timedelta(seconds=delay),
+        created_at=now,
+    )
+    if key is not None:
+        stmt = stmt.on_conflict_do_nothing(index_elements=[Job.__table__.c.idempotency_key])
+    db.session.execute(stmt)
+
+
+def backoff(attempts: int) -> float:
+    """Пауза перед следующей попыткой: экспонента с разбросом ±25%."""
+    config = current_app.config
+    delay = min(config["JOBS_BACKOFF_BASE"] * 2 ** max(attempts - 1, 0), config["JOBS_BACKOFF_MAX"])
+    return delay * random.uniform(0.75, 1.25)
+
+
+# -------------------------
+# Выборка и завершение задач
+# -------------------------
+
+def _due(now):
+    t = Job.__table__
+    return or_(
+        and_(t.c.status == "queued", t.c.run_at <= now),
+        and_(t.c.status == "running", t.c.locked_until < now),  # воркер пропал, аренда истекла
+    )
+
+
+def claim(worker_id: str, limit: int, queues=None) -> list:
+    """Забрать до limit готовых задач: один UPDATE по подзапросу, затем выборка по метке аренды.
+    Условие готовности повторяется во внешнем UPDATE — два воркера одну задачу не получат.
+    """
+    t = Job.__table__
+    now = datetime.utcnow()
+    token = f"{worker_id}:{uuid.uuid4().hex[:8]}"
+    ready = db.select(t.c.id).where(_due(now))
+    if queues:
+        ready = ready.where(t.c.queue.in_(queues))
+    ready = ready.order_by(t.c.run_at, t.c.id).limit(limit)
+    try:
+        db.session.execute(
+            db.update(t)
+            .where(t.c.id.in_(ready.scalar_subquery()), _due(now))
+            .values(
+                status="running",
+                locked_by=token,
+                locked_until=now + timedelta(seconds=current_app.config["JOBS_LEASE_SECONDS"]),
+                attempts=t.c.attempts + 1,
+            )
+        )
+        jobs = db.session.execute(db.select(t).where(t.c.locked_by == token).order_by(t.c.id)).all()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return jobs
+
+
+def _mark_done(job_ids, token: str):
+    t = Job.__table__
+    db.session.execute(
+        db.update(t)
+        .where(t.c.id.in_(job_ids), t.c.locked_by == token)
+        .values(status="done", locked_by=None, locked_until=None, finished_at=datetime.utcnow())
+    )
+
+
+def _mark_failed(job, error: str, final: bool = False):
+    t = Job.__table__
+    final = final or job.attempts >= job.max_attempts
+    values = dict(locked_by=None, locked_until=None, last_error=error[-4000:])
+    if final:
+        values.update(status="failed", finished_at=datetime.utcnow())
+    else:
+        values.update(status="queued", run_at=datetime.utcnow() + timedelta(seconds=backoff(job.attempts)))
+    db.session.execute(db.update(t).where(t.c.id == job.id, t.c.locked_by == job.locked_by).values(**values))
+    db.session.commit()
+    log = current_app.logger.error if final else current_app.logger.warning
+    log("Задача %s #%s, попытка %d/%d: %s", job.name, job.id, job.attempts, job.max_attempts,
+        error.strip().splitlines()[-1] if error.strip() else "ошибка")
+
+
+def _run(spec, jobs) -> bool:
+    """Выполнить задачи и отметить их выполненными в одной транзакции."""
+    payloads = [json.loads(j.payload) for j in jobs]
+    try:
+        if spec.batch:
+            spec.fn(payloads)
+        else:
+            spec.fn(payloads[0])
+        _mark_done([j.id for j in jobs], jobs[0].locked_by)
+        db.session.commit()
+        return True
+    except Exception:
+        db.session.rollback()
+        if spec.batch and len(jobs) > 1:
+            return False  # вызывающий повторит задачи по одной
+        _mark_failed(jobs[0], traceback.format_exc())
+        return False
+
+
+def process(jobs) -> int:
+    """Выполнить полученную пачку; возвращает число успешно выполненных задач."""
+    done = 0
+    groups = {}
+    for job in jobs:
+        spec = TASKS.get(job.name)
+        if spec is None:
+            _mark_failed(job, f"Неизвестная задача: {job.name}", final=True)
+            continue
+        if job.attempts > job.max_attempts:  # аренда истекала слишком много раз
+            _mark_failed(job, "Превышено число попыток (воркер не завершал задачу)", final=True)
+            continue
+        groups.setdefault(spec.name, (spec, []))[1].append(job)
+
+    for spec, group in groups.values():
+        if spec.batch and len(group) > 1 and _run(spec, group):
+            done += len(group)
+            continue
+        for job in group:
+            done += _run(spec, [job])
+    return done
+
+
+def work_off(limit: int = None, queues=None) -> int:
+    """Выполнить все готовые задачи в текущем процессе (для тестов и `worker --once`)."""
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    batch = current_app.config["JOBS_BATCH_SIZE"]
+    total = 0
+    while limit is None or total < limit:
+        jobs = claim(worker_id, batch if limit is None else min(batch, limit - total), queues)
+        if not jobs:
+            break
+        total += len(jobs)
+        process(jobs)
+    return total
+
+
+def purge_jobs(days: int) -> int:
+    """Удалить выполненные задачи старше days дней (failed остаются для разбора)."""
+    t = Job.__table__
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    try:
+        deleted = db.session.execute(db.delete(t).where(t.c.status == "done", t.c.finished_at < cutoff)).rowcount
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return deleted
+
+
+def job_counts() -> dict:
+    """Сколько задач в каждом статусе."""
+    rows = db.session.query(Job.status, db.func.count(Job.id)).group_by(Job.status).all()
+    return {status: n for status, n in rows}
+
+
+# -------------------------
+# Процесс воркера
+# -------------------------
+
+def run_worker(queues=None, batch: int = None, poll: float = None, stop: threading.Event = None):
+    """Цикл воркера (блокирует) до SIGTERM/SIGINT или stop.set(); текущая пачка дорабатывается."""
+    config = current_app.config
+    batch = batch or config["JOBS_BATCH_SIZE"]
+    poll = poll if poll is not None else config["JOBS_POLL_INTERVAL"]
+    stop = stop or threading.Event()
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+    if current_app.logger.level == logging.NOTSET:
+        current_app.logger.setLevel(logging.INFO)  # видно, что воркер делает
+    if threading.current_thread() is threading.main_thread():
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, lambda *_: stop.set())
+
+    current_app.logger.info("Воркер %s запущен, очереди: %s", worker_id, ", ".join(queues) if queues else "все")
+    purged_at = 0.0
+    while not stop.is_set():
+        if time.monotonic() - purged_at > 600:
+            purged_at = time.monotonic()
+            purge_jobs(config["JOBS_KEEP_DONE_DAYS"])
+        try:
+            jobs = claim(worker_id, batch, queues)
+        except Exception:
+            current_app.logger.exception("Не удалось получить задачи")
+            jobs = []
+        if jobs:
+            process(jobs)
+            db.session.remove()
+        else:
+            db.session.remove()
+            stop.wait(poll)
+    current_app.logger.info("Воркер %s остановлен", worker_id)
@@ -1,6 +1,10 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
-from .db import db
-from .models import Product, Order, OrderItem
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app
+from .orders import orders_page
+from .catalog import catalog_page, catalog_categories, product_to_dict, get_product, get_products, showcase
+from .inventory import OutOfStock
+from .routing import replica_ok
+from .metrics import record_cart
+from .httpcache import conditional_page
 from .utils import (
     current_user,
     login_required,
@@ -8,14 +12,20 @@ from .utils import (
     add_to_cart,
     remove_from_cart,
     clear_cart,
+    place_order,
+    update_cart,
+    cart_summary,
+    CartError,
 )
 
 bp = Blueprint("main", __name__)
 
 
 @bp.get("/")
+@replica_ok
+@conditional_page
 def home():
-    products = Product.query.filter_by(is_active=True).limit(6).all()
+    products = showcase(6)
     return render_template("home.html", products=products)
 
 
@@ -30,24 +40,47 @@ def contacts():
 
 
 @bp.get("/catalog")
+@replica_ok
+@conditional_page
 def catalog():
     q = request.args.get("q", "").strip()
     category = request.args.get("category", "").strip()
+    cursor = request.args.get("cursor")
+
+    products, next_cursor = catalog_page(
+        q, category, cursor, limit=current_app.config["CATALOG_PAGE_SIZE"]
+    )
+    categories = catalog_categories()
+    return render_template(
+        "catalog.html",
+        products=products,
+        categories=categories,
+        q=q,
+        category=category,
+        next_cursor=next_cursor,
+    )
+
+
+@bp.get("/api/catalog")
+@replica_ok
+@conditional_page
+def api_catalog():
+    """JSON-страница каталога для бесконечной прокрутки: {items, next_cursor}."""
+    q = request.args.get("q", "").strip()
+    category = request.args.get("category", "").strip()
+    cursor = request.args.get("cursor")
 
-    query = Product.query.filter_by(is_active=True)
-    if q:
-        query = query.filter(Product.title.ilike(f"%{q}%"))
-    if category:
-        query = query.filter_by(category=category)
-
-    products = query.order_by(Product.id.desc()).all()
-    categories = [c[0] for c in db.session.query(Product.category).distinct().all()]
-    return render_template("catalog.html", products=products, categories=categories, q=q, category=category)
+    products, next_cursor = catalog_page(
+        q, category, cursor, limit=current_app.config["CATALOG_PAGE_SIZE"]
+    )
+    return jsonify(items=[product_to_dict(p) for p in products], next_cursor=next_cursor)
 
 
 @bp.get("/product/<int:pid>")
+@replica_ok
+@conditional_page
 def product(pid: int):
-    p = db.session.get(Product, pid)
+    p = get_product(pid)
     if not p or not p.is_active:
         flash("Товар не найден.", "warning")
         return redirect(url_for("main.catalog"))
@@ -56,12 +89,17 @@ def product(pid: int):
 
 @bp.post("/cart/add/<int:pid>")
 def cart_add(pid: int):
-    p = db.session.get(Product, pid)
+    p = get_product(pid)
     if not p or not p.is_active:
         flash("Товар недоступен.", "warning")
         return redirect(url_for("main.catalog"))
 
-    add_to_cart(pid, qty=1)
+    qty = max(request.form.get("qty", 1, type=int) or 1, 1)
+    if not add_to_cart(pid, qty=qty):
+        record_cart("out_of_stock")
+        flash("Недостаточно товара на складе.", "warning")
+        return redirect(request.referrer or url_for("main.product", pid=pid))
+    record_cart("add")
     flash("Добавлено в корзину.", "success")
     return redirect(request.referrer or url_for("main.cart"))
 
@@ -69,6 +107,7 @@ def cart_add(pid: int):
 @bp.post("/cart/remove/<int:pid>")
 def cart_remove(pid: int):
     remove_from_cart(pid)
+    record_cart("remove")
     flash("Удалено из корзины.", "info")
     return redirect(url_for("main.cart"))
 
@@ -76,10 +115,35 @@ def cart_remove(pid: int):
 @bp.post("/cart/clear")
 def cart_clear():
     clear_cart()
+    record_cart("clear")
     flash("Корзина очищена.", "info")
     return redirect(url_for("main.cart"))
 
 
+@bp.get("/api/cart")
+def api_cart():
+    """Корзина в JSON: {items, count, total}."""
+    return jsonify(cart_summary())
+
+
+@bp.post("/api/cart")
+def api_cart_update():
+    """Пакет изменений корзины одной транзакцией, без редиректа и перерисовки страницы.
+    Тело: {"ops": [{"product_id": 3, "qty": 2, "op": "set"}, {"product_id": 5, "qty": -1, "op": "add"}]}
+    ("set" — задать количество, 0 — удалить; "add" — прибавить/убавить). Ответ — как GET /api/cart.
+    """
+    data = request.get_json(silent=True)
+    try:
+        summary = update_cart(data.get("ops") if isinstance(data, dict) else None)
+    except CartError as e:
+        return jsonify(error=str(e), product_ids=e.product_ids), 400
+    except OutOfStock as e:
+        record_cart("out_of_stock")
+        return jsonify(error="Недостаточно товара на складе.", product_ids=e.product_ids), 409
+    record_cart("batch")
+    return jsonify(summary)
+
+
 @bp.get("/cart")
 def cart():
     items, total = cart_items()
@@ -99,34 +163,19 @@ def checkout():
 @bp.post("/checkout")
 @login_required
 def checkout_post():
-    items, total = cart_items()
-    if not items:
+    u = current_user()
+    # ✅ заказ + позиции + остатки + очистка корзины — одна транзакция
+    try:
+        order_id = place_order(u.id)
+    except OutOfStock as e:
+        titles = [p.title for p in get_products(e.product_ids).values()]
+        flash("Недостаточно товара на складе: " + ", ".join(titles), "danger")
+        return redirect(url_for("main.cart"))
+    if not order_id:
         flash("Корзина пустая.", "warning")
         return redirect(url_for("main.catalog"))
 
-    u = current_user()
-    order = Order(user_id=u.id, total=total, status="принят")
-    db.session.add(order)
-    db.session.flush()
-
-    for it in items:
-        p = it["product"]
-        db.session.add(
-            OrderItem(
-                order_id=order.id,
-                product_id=p.id,
-                title=p.title,
-                price=p.price,
-                qty=it["qty"],
-            )
-        )
-
-    db.session.commit()
-
-    # ✅ очистить корзину пользователя (в БД)
-    clear_cart()
-
-    flash(f"Заказ №{order.id} оформлен!", "success")
+    flash(f"Заказ №{order_id} оформлен!", "success")
     return redirect(url_for("main.account"))
 
 
@@ -134,5 +183,8 @@ def checkout_post():
 @login_required
 def account():
     u = current_user()
-    orders = Order.query.filter_by(user_id=u.id).order_by(Order.id.desc()).all()
-    return render_template("account/dashboard.html", u=u, orders=orders)
+    page, next_cursor = orders_page(
+        user_id=u.id, cursor=request.args.get("cursor"), limit=current_app.config["ACCOUNT_ORDERS_PAGE_SIZE"]
+    )
+    orders = [o for o, _ in page]
+    return render_template("account/dashboard.html", u=u, orders=orders, next_cursor=next_cursor)
@@ -0,0 +1,419 @@
+"""Метрики в формате Prometheus: GET /metrics.
+
+Реестр живёт в памяти процесса: счётчики и гистограммы с метками, у каждой метрики
+свой лок на инкремент, /metrics не ходит в БД. Что считаем:
+- HTTP-запросы и их длительность по endpoint;
+- длительность SQL-выражений (события движка, см. profiling.add_query_observer);
+- оформленные заказы и их сумму, изменения корзины, входы (успех/ошибка/пауза);
+- попадания/промахи кэша товаров.
+
+Несколько процессов (gunicorn и т.п.): METRICS_DIR — общая папка. Каждый процесс
+не чаще раза в METRICS_FLUSH_INTERVAL секунд (и при выходе) сохраняет туда свой
+снимок <pid>-<случайный id>.json, а /metrics складывает снимки всех процессов — какой бы
+воркер ни ответил скрейперу, цифры общие. id в имени уникален для запуска процесса:
+новый воркер с тем же (переиспользованным) pid не затрёт файл прежнего. Снимки
+завершившихся процессов (gunicorn child_exit или проверка pid при скрейпе) вливаются
+в один накопительный файл exited.json: папка не растёт, а суммы не уменьшаются.
+"""
+import os
+import json
+import time
+import uuid
+import atexit
+import bisect
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: waitress работает одним процессом, сливать нечего
+    fcntl = None
+
+from flask import Response, g, request, current_app, abort, has_app_context
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+MONEY_BUCKETS = (500, 1000, 2500, 5000, 10_000, 25_000, 50_000, 100_000)
+
+
+# -------------------------
+# Реестр
+# -------------------------
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}  # tuple(значения меток) -> значение
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            samples = [[list(k), v if not isinstance(v, list) else list(v)] for k, v in self._values.items()]
+        return {"type": self.kind, "help": self.help, "labels": list(self.labels), "samples": samples}
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value: float, **labels):
+        """Для счётчиков, которые ведёт другой объект (например, hits кэша)."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels=(), buckets=REQUEST_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)  # le: value <= bucket
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                # счётчики по корзинам (не накопительные) + [+Inf], сумма, количество
+                row = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            row[i] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    def snapshot(self) -> dict:
+        data = super().snapshot()
+        data["buckets"] = list(self.buckets)
+        return data
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help_text: str, labels=()) -> Counter:
+        return self._add(Counter(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels=(), buckets=REQUEST_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help_text, labels, buckets))
+
+    def on_collect(self, fn):
+        """fn() вызывается перед каждым снимком — обновить значения из чужих счётчиков."""
+        self._collectors.append(fn)
+
+    def snapshot(self) -> dict:
+        for fn in self._collectors:
+            fn()
+        return {name: m.snapshot() for name, m in list(self._metrics.items())}
+
+
+REGISTRY = Registry()
+
+http_requests = REGISTRY.counter("shop_http_requests_total", "HTTP-запросы", ("endpoint", "method", "status"))
+http_duration = REGISTRY.histogram("shop_http_request_duration_seconds", "Длительность HTTP-запроса", ("endpoint",))
+db_duration = REGISTRY.histogram("shop_db_query_duration_seconds", "Длительность SQL-выражения", buckets=DB_BUCKETS)
+checkouts = REGISTRY.counter("shop_checkouts_total", "Оформленные заказы")
+checkout_value = REGISTRY.histogram("shop_checkout_value_rubles", "Сумма заказа, руб.", buckets=MONEY_BUCKETS)
+cart_changes = REGISTRY.counter("shop_cart_changes_total", "Изменения корзины", ("action",))
+logins = REGISTRY.counter("shop_logins_total", "Попытки входа", ("result",))
+cache_requests = REGISTRY.counter("shop_cache_requests_total", "Обращения к кэшу", ("cache", "result"))
+
+
+def record_checkout(total: int):
+    checkouts.inc()
+    checkout_value.observe(total)
+
+
+def record_cart(action: str):
+    cart_changes.inc(action=action)
+
+
+def record_login(result: str):
+    logins.inc(result=result)
+
+
+# -------------------------
+# Снимки нескольких процессов и текстовый формат
+# -------------------------
+
+def merge_snapshots(snapshots) -> dict:
+    """Сложить снимки нескольких процессов: счётчики и корзины гистограмм суммируются."""
+    merged = {}
+    for snap in snapshots:
+        for name, data in snap.items():
+            target = merged.setdefault(name, {**data, "samples": {}})
+            for labels, value in data["samples"]:
+                key = tuple(labels)
+                prev = target["samples"].get(key)
+                if prev is None:
+                    target["samples"][key] = list(value) if isinstance(value, list) else value
+                elif isinstance(value, list):
+                    target["samples"][key] = [a + b for a, b in zip(prev, value)]
+                else:
+                    target["samples"][key] = prev + value
+    for data in merged.values():
+        data["samples"] = [[list(k), v] for k, v in data["samples"].items()]
+    return merged
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _num(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_text(snapshot: dict) -> str:
+    """Снимок -> text exposition format 0.0.4."""
+    lines = []
+    for name in sorted(snapshot):
+        data = snapshot[name]
+        lines.append(f"# HELP {name} {data['help']}")
+        lines.append(f"# TYPE {name} {data['type']}")
+        for labels, value in sorted(data["samples"]):
+            if data["type"] == "histogram":
+                cumulative = 0
+                for bound, n in zip(list(data["buckets"]) + ["+Inf"], value[:-2]):
+                    cumulative += n
+                    le = f'le="{bound if bound == "+Inf" else _num(float(bound))}"'
+                    lines.append(f"{name}_bucket{_labels(data['labels'], labels, le)} {cumulative}")
+                lines.append(f"{name}_sum{_labels(data['labels'], labels)} {_num(value[-2])}")
+                lines.append(f"{name}_count{_labels(data['labels'], labels)} {value[-1]}")
+            else:
+                lines.append(f"{name}{_labels(data['labels'], labels)} {_num(value)}")
+    return "\n".join(lines) + "\n"
+
+
+EXITED = "exited.json"  # накопленные снимки завершившихся процессов
+_LOCK_FILE = ".fold.lock"
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # процесс есть, просто чужой
+    return True
+
+
+def _snapshot_pid(path: Path):
+    """pid из имени <pid>-<id>.json; None — не снимок процесса."""
+    pid, sep, _ = path.stem.partition("-")
+    return int(pid) if sep and pid.isdigit() else None
+
+
+def _write_json(path: Path, data):
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(data), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+@contextmanager
+def _dir_lock(directory: Path):
+    """Блокировка папки снимков между процессами (слияние и чтение не пересекаются)."""
+    if fcntl is None:
+        yield
+        return
+    with open(directory / _LOCK_FILE, "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _fold(directory: Path, pids=None) -> int:
+    candidates = [
+        p for p in directory.glob("*.json")
+        if (pid := _snapshot_pid(p)) is not None
+        and (pid in pids if pids is not None else not _pid_alive(pid))
+    ]
+    if not candidates:
+        return 0
+    exited_path = directory / EXITED
+    try:
+        exited = json.loads(exited_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        exited = {"folded": [], "metrics": {}}
+    folded = set(exited["folded"])
+    snapshots = [exited["metrics"]]
+    for path in candidates:
+        if path.name in folded:
+            continue  # уже в сумме: прошлый раз упали до удаления файла
+        try:
+            snapshots.append(json.loads(path.read_text(encoding="utf-8")))
+        except (OSError, ValueError):
+            continue
+        folded.add(path.name)
+    metrics = merge_snapshots(snapshots)
+    _write_json(exited_path, {"folded": sorted(folded), "metrics": metrics})
+    names = {p.name for p in candidates}
+    for path in candidates:
+        path.unlink(missing_ok=True)
+    # удалённые файлы помнить больше незачем
+    _write_json(exited_path, {"folded": sorted(folded - names), "metrics": metrics})
+    return len(names)
+
+
+def fold_exited(directory, pids=None) -> int:
+    """Влить снимки завершившихся процессов в exited.json и удалить их файлы.
+    pids — только эти (gunicorn child_exit), иначе — все, чей pid уже не жив.
+    Имена слитых файлов хранятся в exited.json, пока файл не удалён — повтор после
+    сбоя не задвоит суммы. Возвращает число слитых снимков.
+    """
+    if fcntl is None:
+        return 0  # без блокировки не сливаем: два процесса могли бы сложить снимок дважды
+    directory = Path(directory)
+    with _dir_lock(directory):
+        return _fold(directory, pids)
+
+
+class SnapshotFiles:
+    """Снимки процессов в METRICS_DIR: <pid>-<id>.json, пишутся атомарно через os.replace."""
+
+    def __init__(self, directory: str, interval: float = 5.0):
+        self.dir = Path(directory)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.interval = float(interval)
+        self._last = 0.0
+        self._lock = threading.Lock()
+        self._name = None  # (pid, имя файла); после fork — новое имя
+
+    def _path(self) -> Path:
+        pid = os.getpid()
+        if self._name is None or self._name[0] != pid:
+            self._name = (pid, f"{pid}-{uuid.uuid4().hex[:12]}.json")
+        return self.dir / self._name[1]
+
+    def flush(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._last < self.interval:
+            return
+        if not self._lock.acquire(blocking=force):
+            return  # другой поток уже пишет
+        try:
+            self._last = now
+            _write_json(self._path(), REGISTRY.snapshot())
+        finally:
+            self._lock.release()
+
+    def collect(self) -> dict:
+        """Снимки всех процессов; свой — живой, а не из файла. Снимки умерших
+        процессов сначала сливаются в exited.json.
+        """
+        own = self._path().name
+        snapshots = [REGISTRY.snapshot()]
+        with _dir_lock(self.dir):
+            if fcntl is not None:
+                _fold(self.dir)
+            for path in self.dir.glob("*.json"):
+                if path.name == own:
+                    continue
+                try:
+                    data = json.loads(path.read_text(encoding="utf-8"))
+                except (OSError, ValueError):
+                    continue  # файл как раз подменяется — возьмём при следующем скрейпе
+                snapshots.append(data["metrics"] if path.name == EXITED else data)
+        return merge_snapshots(snapshots)
+
+
+# -------------------------
+# Flask
+# -------------------------
+
+def _observe_query(_statement, seconds):
+    db_duration.observe(seconds)
+
+
+def _cache_stats():
+    if not has_app_context():
+        return  # снимок при выходе процесса — оставляем последние значения
+    stats = current_app.extensions["product_cache"].stats()
+    cache_requests.set_total(stats["hits"], cache="product", result="hit")
+    cache_requests.set_total(stats["misses"], cache="product", result="miss")
+    fragments = current_app.extensions.get("fragment_cache")
+    if fragments is not None:
+        stats = fragments.stats()
+        cache_requests.set_total(stats["hits"], cache="fragment", result="hit")
+        cache_requests.set_total(stats["misses"], cache="fragment", result="miss")
+
+
+REGISTRY.on_collect(_cache_stats)
+
+
+def init_metrics(app):
+    if not app.config["METRICS_ENABLED"]:
+        return
+    from .db import db
+    from .profiling import add_query_observer
+
+    with app.app_context():
+        add_query_observer(list(db.engines.values()), _observe_query)
+
+    files = None
+    if app.config.get("METRICS_DIR"):
+        files = SnapshotFiles(app.config["METRICS_DIR"], app.config["METRICS_FLUSH_INTERVAL"])
+        atexit.register(files.flush, True)
+    app.extensions["metrics_files"] = files
+
+    @app.before_request
+    def _metrics_start():
+        g._metrics_started = time.perf_counter()
+
+    def _record(status: int):
+        started = g.pop("_metrics_started", None)
+        if started is None:
+            return
+        endpoint = request.endpoint or "none"
+        http_requests.inc(endpoint=endpoint, method=request.method, status=status)
+        http_duration.observe(time.perf_counter() - started, endpoint=endpoint)
+        if files:
+            files.flush()
+
+    @app.after_request
+    def _metrics_finish(response):
+        _record(response.status_code)
+        return response
+
+    @app.teardown_request
+    def _metrics_error(exc):
+        if exc is not None:  # необработанное исключение: after_request не вызывался
+            _record(500)
+
+    def metrics_view():
+        token = current_app.config.get("METRICS_TOKEN")
+        if token and request.headers.get("Authorization") != f"Bearer {token}":
+            abort(403)
+        snapshot = files.collect() if files else REGISTRY.snapshot()
+        return Response(render_text(snapshot), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+    app.add_url_rule("/metrics", "metrics", metrics_view)
@@ -17,7 +17,18 @@ class Product(db.Model):
     price = db.Column(db.Integer, nullable=False)  # в рублях
     category = db.Column(db.String(60), nullable=False, default="Другое")
     image_url = db.Column(db.String(300), nullable=True)
+    image_key = db.Column(db.String(32), nullable=True)  # обработанная картинка (см. images.py)
     is_active = db.Column(db.Boolean, default=True)
+    stock = db.Column(db.Integer, nullable=True)  # остаток; None — количество не учитывается
+    sku = db.Column(db.String(64), nullable=True)  # артикул поставщика (ключ импорта)
+    updated_at = db.Column(db.DateTime, nullable=True, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        # Каталог: WHERE is_active [AND category] ORDER BY id DESC (keyset-пагинация)
+        db.Index("ix_product_active_category_id", "is_active", "category", "id"),
+        db.Index("ix_product_active_id", "is_active", "id"),
+        db.Index("uq_product_sku", "sku", unique=True),  # NULL не мешают: у ручных товаров sku нет
+    )
 
 
 class CartItem(db.Model):
@@ -33,6 +44,19 @@ class CartItem(db.Model):
     )
 
 
+class StockReservation(db.Model):
+    """Резерв товара под корзину пользователя: на qty единиц уже уменьшен Product.stock."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey("product.id"), nullable=False)
+    qty = db.Column(db.Integer, nullable=False, default=0)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    __table_args__ = (
+        db.UniqueConstraint("user_id", "product_id", name="uq_reservation_user_product"),
+    )
+
+
 class Order(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
@@ -42,9 +66,60 @@ class Order(db.Model):
 
     items = db.relationship("OrderItem", backref="order", lazy=True, cascade="all, delete-orphan")
 
+    __table_args__ = (
+        db.Index("ix_order_user_id_id", "user_id", "id"),   # заказы пользователя, новые сверху
+        db.Index("ix_order_status_id", "status", "id"),     # фильтр по статусу в админке
+        db.Index("ix_order_created_at", "created_at"),      # фильтр по датам
+    )
+
+class WebSession(db.Model):
+    """Серверная сессия (см. sessions.py): в cookie только подписанный id."""
+    __tablename__ = "web_session"
+
+    id = db.Column(db.String(64), primary_key=True)
+    data = db.Column(db.Text, nullable=False, default="{}")
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
+class Job(db.Model):
+    """Фоновая задача (см. jobs.py): очередь в той же БД, выполняет `flask worker`."""
+    id = db.Column(db.Integer, primary_key=True)
+    queue = db.Column(db.String(40), nullable=False, default="default")
+    name = db.Column(db.String(80), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default="{}")
+    idempotency_key = db.Column(db.String(120), nullable=True)
+    status = db.Column(db.String(10), nullable=False, default="queued")  # queued/running/done/failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = db.Column(db.String(80), nullable=True)
+    locked_until = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index("ix_job_status_run_at", "status", "run_at"),          # выборка готовых к запуску
+        db.Index("uq_job_idempotency_key", "idempotency_key", unique=True),
+    )
+
+
+class StatCounter(db.Model):
+    """Материализованный счётчик для админ-панели (см. stats.py)."""
+    name = db.Column(db.String(40), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+class DailyStat(db.Model):
+    """Заказы и выручка за день (см. stats.py)."""
+    day = db.Column(db.Date, primary_key=True)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.BigInteger, nullable=False, default=0)
+
+
 class OrderItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    order_id = db.Column(db.Integer, db.ForeignKey("order.id"), nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey("order.id"), nullable=False, index=True)
     product_id = db.Column(db.Integer, db.ForeignKey("product.id"), nullable=False)
     title = db.Column(db.String(140), nullable=False)
     price = db.Column(db.Integer, nullable=False)
@@ -0,0 +1,62 @@
+"""Списки заказов: постранично (keyset по id), с фильтрами и без N+1."""
+from datetime import datetime, timedelta
+
+from sqlalchemy.orm import joinedload
+
+from .db import db
+from .models import Order, OrderItem
+from .catalog import parse_cursor
+
+ORDER_STATUSES = ("создан", "принят")
+
+
+def parse_date(value):
+    """'YYYY-MM-DD' из формы -> datetime (или None)."""
+    try:
+        return datetime.strptime((value or "").strip(), "%Y-%m-%d")
+    except ValueError:
+        return None
+
+
+def _filtered(query, user_id=None, status=None, date_from=None, date_to=None):
+    if user_id is not None:
+        query = query.filter(Order.user_id == user_id)
+    if status:
+        query = query.filter(Order.status == status)
+    if date_from:
+        query = query.filter(Order.created_at >= date_from)
+    if date_to:
+        query = query.filter(Order.created_at < date_to + timedelta(days=1))  # включительно
+    return query
+
+
+def orders_page(user_id=None, status=None, date_from=None, date_to=None, cursor=None, limit: int = 50):
+    """Страница заказов (новые сверху) с пользователем и числом позиций.
+    Возвращает ([(order, items_count)], next_cursor).
+    """
+    items_count = (
+        db.select(db.func.count(OrderItem.id))
+        .where(OrderItem.order_id == Order.id)
+        .correlate(Order)
+        .scalar_subquery()
+        .label("items_count")
+    )
+    query = db.session.query(Order, items_count).options(joinedload(Order.user))
+    query = _filtered(query, user_id, status, date_from, date_to)
+    cursor = parse_cursor(cursor)
+    if cursor:
+        query = query.filter(Order.id < cursor)
+
+    rows = query.order_by(Order.id.desc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1][0].id
+    return [(o, int(n)) for o, n in rows], next_cursor
+
+
+def orders_summary(user_id=None, status=None, date_from=None, date_to=None) -> dict:
+    """Количество и сумма заказов по фильтру (одним запросом)."""
+    query = db.session.query(db.func.count(Order.id), db.func.coalesce(db.func.sum(Order.total), 0))
+    count, revenue = _filtered(query, user_id, status, date_from, date_to).one()
+    return {"count": int(count), "revenue": int(revenue)}
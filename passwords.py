@@ -0,0 +1,143 @@
+"""Хэширование паролей вне потока запроса.
+
+scrypt/pbkdf2 — это десятки миллисекунд CPU под GIL. PasswordHasher выполняет
+generate/check_password_hash в пуле процессов с ограниченной очередью: если
+очередь полна дольше PASSWORD_HASH_TIMEOUT — HashingBusy (вью отвечает «попробуйте позже»),
+а не копит бесконечный хвост. PASSWORD_HASH_WORKERS = 0 — считать в текущем потоке.
+
+LoginThrottle ограничивает неудачные попытки входа по логину, чтобы перебор
+паролей не съедал весь пул хэширования.
+"""
+import time
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class HashingBusy(Exception):
+    """Очередь хэширования переполнена."""
+
+
+def hash_method(pwhash: str) -> str:
+    """'scrypt:32768:8:1$salt$hash' -> 'scrypt:32768:8:1'."""
+    return (pwhash or "").split("$", 1)[0]
+
+
+class PasswordHasher:
+    def __init__(self, method: str, workers: int = 2, queue_size: int = 32, timeout: float = 5.0):
+        self.method = method
+        self.workers = int(workers)
+        self.timeout = float(timeout)
+        self._slots = threading.BoundedSemaphore(max(int(queue_size), 1))
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _executor(self):
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def _run(self, fn, *args):
+        if self.workers <= 0:
+            return fn(*args)
+        if not self._slots.acquire(timeout=self.timeout):
+            raise HashingBusy()
+        try:
+            return self._executor().submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password: str) -> str:
+        return self._run(generate_password_hash, password, self.method)
+
+    def check(self, pwhash: str, password: str) -> bool:
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash: str) -> bool:
+        """Хэш сделан другими параметрами, чем сейчас в конфиге."""
+        return hash_method(pwhash) != self.method
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+class LoginThrottle:
+    """Не более max_failures неудачных входов на логин за window секунд."""
+
+    def __init__(self, max_failures: int = 5, window: float = 300.0, max_keys: int = 10_000):
+        self.max_failures = int(max_failures)
+        self.window = float(window)
+        self.max_keys = int(max_keys)
+        self._failures = {}  # username -> deque[timestamp]
+        self._lock = threading.Lock()
+
+    def _recent(self, key, now):
+        q = self._failures.get(key)
+        if not q:
+            return None
+        while q and q[0] <= now - self.window:
+            q.popleft()
+        if not q:
+            del self._failures[key]
+            return None
+        return q
+
+    def retry_after(self, username: str) -> int:
+        """0 — можно пробовать; иначе через сколько секунд."""
+        now = time.monotonic()
+        with self._lock:
+            q = self._recent(username.lower(), now)
+            if not q or len(q) < self.max_failures:
+                return 0
+            return int(q[0] + self.window - now) + 1
+
+    def failure(self, username: str):
+        now = time.monotonic()
+        key = username.lower()
+        with self._lock:
+            if key not in self._failures and len(self._failures) >= self.max_keys:
+                # чистим устаревшие, чтобы словарь не рос от перебора случайных логинов
+                for k in list(self._failures):
+                    self._recent(k, now)
+                if len(self._failures) >= self.max_keys:
+                    self._failures.pop(next(iter(self._failures)))
+            self._failures.setdefault(key, deque()).append(now)
+
+    def success(self, username: str):
+        with self._lock:
+            self._failures.pop(username.lower(), None)
+
+
+def init_passwords(app):
+    app.extensions["password_hasher"] = PasswordHasher(
+        method=app.config["PASSWORD_HASH_METHOD"],
+        workers=app.config["PASSWORD_HASH_WORKERS"],
+        queue_size=app.config["PASSWORD_HASH_QUEUE"],
+        timeout=app.config["PASSWORD_HASH_TIMEOUT"],
+    )
+    app.extensions["login_throttle"] = LoginThrottle(
+        max_failures=app.config["LOGIN_MAX_FAILURES"], window=app.config["LOGIN_FAILURE_WINDOW"]
+    )
+
+
+def hasher() -> PasswordHasher:
+    return current_app.extensions["password_hasher"]
+
+
+def login_throttle() -> LoginThrottle:
+    return current_app.extensions["login_throttle"]
+
+
+def hash_password(password: str) -> str:
+    return hasher().hash(password)
+
+
+def verify_password(pwhash: str, password: str) -> bool:
+    return hasher().check(pwhash, password)
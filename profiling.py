@@ -0,0 +1,213 @@
+"""Профилирование запросов: SQL и шаблоны на каждый HTTP-запрос.
+
+Включается PROFILE_REQUESTS = True. На запрос считаются SQL-выражения и их суммарное
+время (события движка) и время рендера шаблонов. Если запрос дольше PROFILE_SLOW_MS
+или сделал больше PROFILE_MAX_QUERIES выражений — в лог пишется endpoint и самые частые
+«отпечатки» SQL (литералы заменены на ?): по ним сразу видно N+1.
+PROFILE_SERVER_TIMING = True — заголовок Server-Timing (виден в DevTools браузера).
+
+Для тестов — count_queries() / assert_max_queries() и QUERY_BUDGETS = {"main.cart": 5}:
+при app.testing превышение бюджета эндпоинта — AssertionError.
+"""
+import re
+import time
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import request, has_request_context, current_app, before_render_template, template_rendered
+from sqlalchemy import event
+
+from .db import db
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def fingerprint(statement: str) -> str:
+    """SQL без литералов и с свёрнутыми IN (?, ?, ...): одинаковые запросы с разными id совпадают."""
+    s = _STRING_RE.sub("?", statement)
+    s = _NUMBER_RE.sub("?", s)
+    s = re.sub(r"__\[POSTCOMPILE_\w+\]", "?", s)
+    s = _IN_LIST_RE.sub("(...)", s)
+    return _SPACE_RE.sub(" ", s).strip()[:300]
+
+
+class QueryLog:
+    """Счётчик SQL: сколько выражений, сколько времени, какие отпечатки."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.fingerprints = Counter()
+
+    def add(self, statement: str, seconds: float):
+        self.count += 1
+        self.seconds += seconds
+        self.fingerprints[fingerprint(statement)] += 1
+
+    def top(self, n: int = 5):
+        return self.fingerprints.most_common(n)
+
+    def describe(self, n: int = 5) -> str:
+        return "; ".join(f"{k}× {fp}" for fp, k in self.top(n))
+
+
+# -------------------------
+# События движка
+# -------------------------
+
+_local = threading.local()  # активные count_queries() этого потока
+
+
+_query_observers = []  # fn(statement, seconds) на каждое SQL-выражение (метрики и т.п.)
+
+
+def _collectors():
+    return getattr(_local, "collectors", ())
+
+
+def _before_cursor(conn, _cursor, _statement, _params, _context, _executemany):
+    conn.info.setdefault("_profile_started", []).append(time.perf_counter())
+
+
+def _after_cursor(conn, _cursor, statement, _params, _context, _executemany):
+    stack = conn.info.get("_profile_started")
+    seconds = time.perf_counter() - stack.pop() if stack else 0.0
+    for fn in _query_observers:
+        fn(statement, seconds)
+    for log in _collectors():
+        log.add(statement, seconds)
+    # загрузка серверной сессии идёт раньше before_request — её SQL тоже в счёт запроса
+    if has_request_context() and "profiling" in current_app.extensions:
+        _request_log().add(statement, seconds)
+
+
+def _listen(engine):
+    if not event.contains(engine, "before_cursor_execute", _before_cursor):
+        event.listen(engine, "before_cursor_execute", _before_cursor)
+        event.listen(engine, "after_cursor_execute", _after_cursor)
+
+
+def add_query_observer(engines, fn):
+    """Вызывать fn(statement, seconds) после каждого SQL-выражения на этих движках."""
+    for engine in engines:
+        _listen(engine)
+    if fn not in _query_observers:
+        _query_observers.append(fn)
+
+
+@contextmanager
+def count_queries(engines=None):
+    """Посчитать SQL, выполненные в этом потоке внутри блока:
+
+        with count_queries() as log:
+            client.get("/cart")
+        assert log.count <= 3, log.describe()
+    """
+    for engine in engines if engines is not None else db.engines.values():
+        _listen(engine)
+    log = QueryLog()
+    _local.collectors = _collectors() + (log,)
+    try:
+        yield log
+    finally:
+        _local.collectors = tuple(c for c in _collectors() if c is not log)
+
+
+@contextmanager
+def assert_max_queries(limit: int, engines=None):
+    """AssertionError, если внутри блока выполнено больше limit SQL-выражений."""
+    with count_queries(engines) as log:
+        yield log
+    if log.count > limit:
+        raise AssertionError(f"SQL-выражений {log.count} > {limit}: {log.describe()}")
+
+
+# -------------------------
+# Профиль HTTP-запроса
+# -------------------------
+
+class _RequestProfile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = QueryLog()
+        self.template_seconds = 0.0
+        self.template_stack = []
+
+
+def _profile() -> _RequestProfile:
+    # в environ, а не в g: g живёт в контексте приложения, а тесты часто гоняют
+    # несколько запросов внутри одного app_context()
+    prof = request.environ.get("shop.profile")
+    if prof is None:  # запрос пришёл мимо app.wsgi_app (см. init_profiling) — отсчёт отсюда
+        prof = request.environ["shop.profile"] = _RequestProfile()
+    return prof
+
+
+def _request_log() -> QueryLog:
+    return _profile().queries
+
+
+def _on_before_render(_app, template, context, **_extra):
+    if has_request_context():
+        _profile().template_stack.append(time.perf_counter())
+
+
+def _on_rendered(_app, template, context, **_extra):
+    if not has_request_context():
+        return
+    prof = _profile()
+    if prof.template_stack:
+        started = prof.template_stack.pop()
+        if not prof.template_stack:  # вложенные render_template не считаем дважды
+            prof.template_seconds += time.perf_counter() - started
+
+
+def init_profiling(app):
+    budgets = app.config.get("QUERY_BUDGETS") or {}
+    if not app.config.get("PROFILE_REQUESTS") and not (budgets and app.testing):
+        return
+    app.extensions["profiling"] = True
+    with app.app_context():
+        for engine in db.engines.values():
+            _listen(engine)
+    before_render_template.connect(_on_before_render, app)
+    template_rendered.connect(_on_rendered, app)
+
+    # профиль заводится до контекста запроса: загрузка сессии, before_request и код вью
+    # до первого SQL тоже попадают в app;dur и в порог PROFILE_SLOW_MS
+    # (сигнал request_started во Flask приходит уже после открытия сессии)
+    wsgi_app = app.wsgi_app
+
+    def profiled_wsgi_app(environ, start_response):
+        environ["shop.profile"] = _RequestProfile()
+        return wsgi_app(environ, start_response)
+
+    app.wsgi_app = profiled_wsgi_app
+
+    @app.after_request
+    def _profile_finish(response):
+        prof = _profile()
+        total_ms = (time.perf_counter() - prof.started) * 1000
+        log = prof.queries
+        db_ms = log.seconds * 1000
+        tpl_ms = prof.template_seconds * 1000
+        config = current_app.config
+
+        budget = budgets.get(request.endpoint)
+        if budget is not None and log.count > budget and current_app.testing:
+            raise AssertionError(f"{request.endpoint}: SQL-выражений {log.count} > {budget}: {log.describe()}")
+
+        if config["PROFILE_SERVER_TIMING"]:
+            response.headers["Server-Timing"] = (
+                f'db;dur={db_ms:.1f};desc="{log.count} SQL", tpl;dur={tpl_ms:.1f}, app;dur={total_ms:.1f}'
+            )
+        if total_ms >= config["PROFILE_SLOW_MS"] or log.count > config["PROFILE_MAX_QUERIES"]:
+            current_app.logger.warning(
+                "Медленный запрос %s %s (%s): %.1f мс, SQL %d за %.1f мс, шаблоны %.1f мс; чаще всего: %s",
+                request.method, request.path, request.endpoint, total_ms, log.count, db_ms, tpl_ms, log.describe(),
+            )
+        return response
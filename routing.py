@@ -0,0 +1,85 @@
+"""Маршрутизация чтений на реплики БД.
+
+Основная БД — SQLALCHEMY_DATABASE_URI (SQLite или, например, PostgreSQL),
+реплики только для чтения — READ_REPLICA_URIS (становятся binds replica_0, replica_1, ...).
+
+Вью, помеченные @replica_ok, выполняют SELECT на случайной реплике; всё остальное
+(корзина, оформление, авторизация) и любые записи идут в основную БД.
+Read-your-writes: после записи клиент READ_YOUR_WRITES_SECONDS читает только из
+основной БД (метка в session), а внутри запроса — до его конца.
+
+Флаги запроса («можно на реплику», «была запись») лежат в request.environ, а не в g:
+g делят все запросы внутри одного app.app_context(), как и кэши в utils.py.
+"""
+import time
+import random
+from functools import wraps
+
+from flask import has_request_context, request, session, current_app
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.sql import Select
+
+REPLICA_PREFIX = "replica_"
+_STICKY_KEY = "_db_primary_until"
+_ROUTE_KEY = "shop.db_route"
+_WROTE_KEY = "shop.db_wrote"
+
+
+def replica_binds(uris) -> dict:
+    """READ_REPLICA_URIS -> SQLALCHEMY_BINDS."""
+    return {f"{REPLICA_PREFIX}{i}": uri for i, uri in enumerate(uris or [])}
+
+
+def replica_ok(view):
+    """Вью только читает данные — её SELECT можно отправить на реплику."""
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        request.environ[_ROUTE_KEY] = "replica"
+        return view(*args, **kwargs)
+
+    return wrapped
+
+
+def _reads_from_replica() -> bool:
+    if not has_request_context() or request.environ.get(_ROUTE_KEY) != "replica":
+        return False
+    if request.environ.get(_WROTE_KEY):
+        return False
+    return session.get(_STICKY_KEY, 0) < time.time()
+
+
+class RoutingSession(Session):
+    """Session Flask-SQLAlchemy, отправляющая SELECT на реплики в @replica_ok-вью."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and isinstance(clause, Select) and _reads_from_replica():
+            replicas = [e for key, e in self._db.engines.items() if key and key.startswith(REPLICA_PREFIX)]
+            if replicas:
+                return random.choice(replicas)
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _mark_write(_session, _flush_context):
+    if has_request_context():
+        request.environ[_WROTE_KEY] = True
+
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def _mark_statement_write(state):
+    # INSERT/UPDATE/DELETE через session.execute() и query.delete() идут мимо flush
+    if (state.is_insert or state.is_update or state.is_delete) and has_request_context():
+        request.environ[_WROTE_KEY] = True
+
+
+def init_routing(app):
+    """После запроса с записью — закрепить клиента за основной БД на время репликации."""
+    if not app.config.get("READ_REPLICA_URIS"):
+        return
+
+    @app.after_request
+    def _stick_to_primary(response):
+        if request.environ.get(_WROTE_KEY):
+            session[_STICKY_KEY] = time.time() + current_app.config["READ_YOUR_WRITES_SECONDS"]
+        return response
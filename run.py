@@ -2,13 +2,20 @@ import sys
 import socket
 from werkzeug.security import generate_password_hash
 from shop import create_app
-from shop.db import db
-from shop.models import User, Product
+from shop.db import db, ensure_columns, ensure_indexes
+from shop.search import ensure_fts
+from shop.stats import rebuild_stats
+from shop.models import User, Product, StatCounter
 
 
 def init_db(app):
     with app.app_context():
         db.create_all()
+        ensure_columns()
+        ensure_indexes()
+        ensure_fts()
+        if not StatCounter.query.first():
+            rebuild_stats()  # статистика для уже существующих данных
     print("DB initialized.")
 
 
@@ -57,7 +64,15 @@ def main():
     app = create_app()
     cmd = (sys.argv[1] if len(sys.argv) > 1 else "run").lower()
 
-    if cmd in ("run", "serve"):
+    if cmd in ("serve", "prod"):
+        # продакшн: gunicorn/waitress, без отладчика и без определения IP в локальной сети
+        from shop.serve import serve
+        from shop.assets import build_assets
+        build_assets(app.static_folder, app.config["ASSETS_DIR"])  # до форка воркеров
+        serve(create_app, app.config)
+        return
+
+    if cmd in ("run", "dev"):
         # Слушаем на всех интерфейсах, чтобы открывалось с телефона по IP
         host = "0.0.0.0"
         port = 5000
@@ -67,9 +82,17 @@ def main():
         print(f"ПК:      http://127.0.0.1:{port}")
         print(f"Телефон: http://{ip}:{port}  (телефон и ПК должны быть в одной Wi-Fi сети)\n")
 
+        app.config["ASSETS_FINGERPRINT"] = False  # правки CSS/JS видны сразу, без build-assets
         app.run(host=host, port=port, debug=True)
         return
 
+    if cmd == "worker":
+        # фоновые задачи (приём заказов и т.п.), запускать рядом с сервером
+        from shop.jobs import run_worker
+        with app.app_context():
+            run_worker()
+        return
+
     if cmd in ("init-db", "initdb", "db"):
         init_db(app)
         return
@@ -80,7 +103,9 @@ def main():
 
     print("Unknown command:", cmd)
     print("Usage:")
-    print("  python run.py run")
+    print("  python run.py run     (dev-сервер с отладчиком)")
+    print("  python run.py serve   (продакшн: gunicorn / waitress)")
+    print("  python run.py worker  (фоновые задачи)")
     print("  python run.py init-db")
     print("  python run.py seed")
 
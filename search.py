@@ -0,0 +1,179 @@
+"""Полнотекстовый поиск по товарам (SQLite FTS5).
+
+Виртуальная таблица product_fts индексирует title/description/category таблицы
+product (external content) и синхронизируется триггерами. Если БД не SQLite
+или FTS5 недоступен — каталог откатывается на обычный ilike.
+"""
+import re
+import time
+import random
+import sqlite3
+
+from sqlalchemy import text, Integer, Float
+
+from .db import db
+
+FTS_TABLE = "product_fts"
+
+# Вес колонок для bm25: title важнее category, category важнее description
+BM25_WEIGHTS = (10.0, 1.0, 3.0)
+
+FTS_DDL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        title, description, category,
+        content='product', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON product BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, description, category)
+        VALUES (new.id, new.title, new.description, new.category);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON product BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, description, category)
+        VALUES ('delete', old.id, old.title, old.description, old.category);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF title, description, category ON product BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, description, category)
+        VALUES ('delete', old.id, old.title, old.description, old.category);
+        INSERT INTO {FTS_TABLE}(rowid, title, description, category)
+        VALUES (new.id, new.title, new.description, new.category);
+    END""",
+]
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# url движков, где product_fts уже точно есть (чтобы не спрашивать sqlite_master на каждый поиск)
+_fts_ready = set()
+
+
+def ensure_fts():
+    """Создать FTS-таблицу и триггеры (идемпотентно). При первом создании — заполнить индекс."""
+    engine = db.engine
+    if engine.dialect.name != "sqlite":
+        return False
+    with engine.begin() as conn:
+        existed = conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type='table' AND name=:n"), {"n": FTS_TABLE}
+        ).first()
+        for stmt in FTS_DDL:
+            conn.exec_driver_sql(stmt)
+        if not existed:
+            conn.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    _fts_ready.add(str(engine.url))
+    return True
+
+
+def fts_available() -> bool:
+    engine = db.engine
+    key = str(engine.url)
+    if key in _fts_ready:
+        return True
+    if engine.dialect.name != "sqlite":
+        return False
+    row = db.session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type='table' AND name=:n"), {"n": FTS_TABLE}
+    ).first()
+    if row:
+        _fts_ready.add(key)
+    return bool(row)
+
+
+def match_expression(q: str):
+    """Пользовательский ввод -> выражение MATCH: каждое слово как префикс, все слова обязательны.
+    Слова берутся в кавычки, поэтому операторы FTS5 (OR, NEAR, *, -) из ввода не интерпретируются.
+    """
+    tokens = _TOKEN_RE.findall(q or "")
+    if not tokens:
+        return None
+    return " ".join('"' + t.replace('"', '""') + '"*' for t in tokens)
+
+
+def fts_subquery(match: str):
+    """Подзапрос (id, rank) найденных товаров; rank — bm25, чем меньше, тем релевантнее."""
+    weights = ", ".join(str(w) for w in BM25_WEIGHTS)
+    return (
+        text(
+            f"SELECT rowid AS id, bm25({FTS_TABLE}, {weights}) AS rank "
+            f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match"
+        )
+        .bindparams(match=match)
+        .columns(id=Integer, rank=Float)
+        .subquery("fts")
+    )
+
+
+# -------------------------
+# Бенчмарк: ilike vs FTS5
+# -------------------------
+
+_NOUNS = (
+    "наушники рюкзак кружка браслет чехол зарядка кабель лампа чайник термос "
+    "колонка клавиатура мышь монитор куртка кроссовки часы сумка зонт очки"
+).split()
+_SYLLABLES = "ба ве го ду жи зо ки ла ми но пу ро сы та фу хо цы чу ша эк юр ям".split()
+_CATEGORIES = ["Электроника", "Аксессуары", "Дом", "Одежда", "Спорт", "Другое"]
+
+
+def _vocabulary(rnd, size=5000):
+    # синтетические «бренды/модели»: редкие слова, как в реальном каталоге
+    words = set()
+    while len(words) < size:
+        words.add("".join(rnd.choices(_SYLLABLES, k=rnd.randint(2, 4))))
+    return sorted(words)
+
+
+def benchmark_search(n: int = 100_000, queries=None, repeat: int = 5):
+    """Сравнить ilike-поиск и FTS5 на синтетическом каталоге из n товаров (in-memory SQLite).
+    Возвращает {query: {"like_ms": ..., "fts_ms": ..., "like_rows": ..., "fts_rows": ...}}.
+    """
+    rnd = random.Random(42)
+    vocab = _vocabulary(rnd)
+    if queries is None:
+        # частое слово, редкое слово, префикс редкого слова, два слова
+        queries = ("наушники", vocab[100], vocab[200][:4], f"{vocab[300]} {_NOUNS[3]}")
+    conn = sqlite3.connect(":memory:")
+    conn.execute(
+        "CREATE TABLE product (id INTEGER PRIMARY KEY, title TEXT NOT NULL, description TEXT NOT NULL, "
+        "price INTEGER NOT NULL, category TEXT NOT NULL, image_url TEXT, is_active BOOLEAN)"
+    )
+    for stmt in FTS_DDL:
+        conn.execute(stmt)
+
+    def rows():
+        for i in range(1, n + 1):
+            title = f"{rnd.choice(_NOUNS).capitalize()} {rnd.choice(vocab)} {rnd.choice(vocab)}"
+            desc = " ".join(rnd.choices(vocab, k=10))
+            yield (i, title, desc, rnd.randint(100, 50_000), rnd.choice(_CATEGORIES), None, 1)
+
+    conn.executemany("INSERT INTO product VALUES (?, ?, ?, ?, ?, ?, ?)", rows())
+    conn.commit()
+
+    weights = ", ".join(str(w) for w in BM25_WEIGHTS)
+    like_sql = (
+        "SELECT id FROM product WHERE is_active = 1 AND lower(title) LIKE lower(?) "
+        "ORDER BY id DESC LIMIT 24"
+    )
+    fts_sql = (
+        f"SELECT p.id FROM product p JOIN (SELECT rowid AS id, bm25({FTS_TABLE}, {weights}) AS rank "
+        f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH ?) f ON f.id = p.id "
+        "WHERE p.is_active = 1 ORDER BY f.rank, p.id DESC LIMIT 24"
+    )
+
+    def timed(sql, arg):
+        best = None
+        found = 0
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            found = len(conn.execute(sql, (arg,)).fetchall())
+            dt = (time.perf_counter() - t0) * 1000
+            best = dt if best is None else min(best, dt)
+        return round(best, 3), found
+
+    result = {}
+    for q in queries:
+        like_ms, like_rows = timed(like_sql, f"%{q}%")
+        fts_ms, fts_rows = timed(fts_sql, match_expression(q))
+        result[q] = {"like_ms": like_ms, "fts_ms": fts_ms, "like_rows": like_rows, "fts_rows": fts_rows}
+    conn.close()
+    return result
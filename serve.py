@@ -0,0 +1,238 @@
+"""Продакшн-запуск вместо app.run(debug=True).
+
+Linux/macOS — gunicorn (prefork): SERVER_WORKERS процессов по SERVER_THREADS потоков.
+- SERVER_TIMEOUT — воркер, молчащий дольше (завис на запросе), перезапускается;
+- SERVER_KEEPALIVE — сколько секунд держать простаивающее keep-alive соединение;
+- SERVER_MAX_REQUESTS (+ случайный разброс) — плановый перезапуск воркеров против утечек;
+- плавная перезагрузка: `kill -HUP <pid мастера>` — новые воркеры поднимаются с новым
+  кодом, старые дорабатывают текущие запросы (до SERVER_GRACEFUL_TIMEOUT).
+Windows — waitress: fork нет, один процесс на SERVER_WORKERS * SERVER_THREADS потоков.
+
+bench_servers() сравнивает requests/sec dev-сервера и продакшн-режима на временной БД.
+"""
+import os
+import sys
+import time
+import socket
+import tempfile
+import threading
+import subprocess
+import http.client
+from pathlib import Path
+
+from .metrics import fold_exited
+
+
+def server_options(config) -> dict:
+    return {
+        "bind": config["SERVER_BIND"],
+        "workers": int(config["SERVER_WORKERS"]),
+        "threads": int(config["SERVER_THREADS"]),
+        "timeout": int(config["SERVER_TIMEOUT"]),
+        "graceful_timeout": int(config["SERVER_GRACEFUL_TIMEOUT"]),
+        "keepalive": int(config["SERVER_KEEPALIVE"]),
+        "max_requests": int(config["SERVER_MAX_REQUESTS"]),
+    }
+
+
+def _prepare_multiprocess(config, workers: int):
+    """Несколько процессов: метрикам нужна общая папка, сессиям — общее хранилище."""
+    if workers > 1 and not config.get("METRICS_DIR") and config.get("METRICS_ENABLED"):
+        # воркеры создают приложение сами и читают METRICS_DIR из окружения
+        os.environ["METRICS_DIR"] = tempfile.mkdtemp(prefix="shop-metrics-")
+    backend = config["SESSION_BACKEND"]
+    if workers > 1 and (backend == "memory" or (backend == "redis" and not config.get("SESSION_REDIS_URL"))):
+        print("Внимание: сессии в памяти процесса не видны другим воркерам — "
+              "используйте SESSION_BACKEND=db или redis с SESSION_REDIS_URL.", file=sys.stderr)
+
+
+def serve(app_factory, config, **overrides):
+    """Запустить продакшн-сервер (блокирует). app_factory() вызывается в каждом воркере."""
+    options = {**server_options(config), **{k: v for k, v in overrides.items() if v is not None}}
+    _prepare_multiprocess(config, options["workers"])
+
+    if sys.platform == "win32":
+        try:
+            import waitress  # опциональная зависимость: pip install waitress
+        except ImportError:
+            raise RuntimeError("Для продакшн-режима на Windows нужен waitress: pip install waitress") from None
+        waitress.serve(
+            app_factory(),
+            listen=options["bind"],
+            threads=options["workers"] * options["threads"],
+            channel_timeout=options["timeout"],
+            ident="shop",
+        )
+        return
+
+    try:
+        from gunicorn.app.base import BaseApplication  # опциональная зависимость: pip install gunicorn
+    except ImportError:
+        raise RuntimeError("Для продакшн-режима нужен gunicorn: pip install gunicorn") from None
+
+    class ShopApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", [options["bind"]])
+            self.cfg.set("workers", options["workers"])
+            self.cfg.set("threads", options["threads"])
+            self.cfg.set("worker_class", "gthread" if options["threads"] > 1 else "sync")
+            self.cfg.set("timeout", options["timeout"])
+            self.cfg.set("graceful_timeout", options["graceful_timeout"])
+            self.cfg.set("keepalive", options["keepalive"])
+            self.cfg.set("max_requests", options["max_requests"])
+            self.cfg.set("max_requests_jitter", max(options["max_requests"] // 10, 0))
+            # без preload: каждый воркер импортирует код сам, поэтому HUP подхватывает новый код,
+            # а пулы соединений БД не переживают fork
+            self.cfg.set("preload_app", False)
+            self.cfg.set("accesslog", os.environ.get("ACCESS_LOG"))
+            metrics_dir = os.environ.get("METRICS_DIR") or config.get("METRICS_DIR")
+            if metrics_dir:
+                # снимок метрик завершившегося воркера — в общий накопительный файл
+                self.cfg.set("child_exit", lambda server, worker: fold_exited(metrics_dir, {worker.pid}))
+
+        def load(self):
+            return app_factory()
+
+    ShopApplication().run()
+
+
+# -------------------------
+# Бенчмарк: dev-сервер против продакшн-режима
+# -------------------------
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_port(port: int, proc, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Сервер завершился с кодом {proc.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("Сервер не поднялся за отведённое время")
+
+
+def _load(port: int, paths, concurrency: int, seconds: float) -> dict:
+    """concurrency потоков с keep-alive соединениями гоняют GET по paths."""
+    counters = {"ok": 0, "errors": 0}
+    latencies = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def worker(n):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        local_ok, local_err, local_lat = 0, 0, []
+        i = n
+        while time.perf_counter() < deadline:
+            path = paths[i % len(paths)]
+            i += 1
+            started = time.perf_counter()
+            try:
+                conn.request("GET", path)
+                r = conn.getresponse()
+                r.read()
+                if r.status < 400:
+                    local_ok += 1
+                    local_lat.append(time.perf_counter() - started)
+                else:
+                    local_err += 1
+            except (OSError, http.client.HTTPException):
+                local_err += 1
+                conn.close()
+        conn.close()
+        with lock:
+            counters["ok"] += local_ok
+            counters["errors"] += local_err
+            latencies.extend(local_lat)
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+
+    def pct(p):
+        return round(latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] * 1000, 2) if latencies else 0.0
+
+    return {**counters, "rps": round(counters["ok"] / elapsed, 1), "p50_ms": pct(50), "p99_ms": pct(99)}
+
+
+def bench_servers(modes=("dev", "prod"), concurrency: int = 16, seconds: float = 10.0,
+                  workers=None, threads=None, products: int = 2000) -> list:
+    """Поднять каждый режим отдельным процессом на временной SQLite с товарами и нагрузить
+    каталогом и карточками товаров. Возвращает [{"mode", "ok", "errors", "rps", "p50_ms", "p99_ms"}].
+    """
+    from . import create_app
+    from .db import db
+    from .search import ensure_fts
+    from .bench import generate_data
+
+    package = __package__
+    project_dir = Path(__file__).resolve().parent.parent
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{Path(tmp, 'serve.sqlite3').as_posix()}"
+        app = create_app({"SQLALCHEMY_DATABASE_URI": url})
+        with app.app_context():
+            db.create_all()
+            ensure_fts()
+            data = generate_data(users=10, products=products, orders=0, cart_items=0,
+                                 password_method="pbkdf2:sha256:1000")
+            db.engine.dispose()
+        app.extensions["password_hasher"].shutdown()
+        pids = data["product_ids"]
+        paths = ["/catalog", "/"] + [f"/product/{pid}" for pid in pids[:: max(len(pids) // 50, 1)]]
+
+        for mode in modes:
+            port = _free_port()
+            cmd = [sys.executable, "-m", f"{package}.serve", mode, f"127.0.0.1:{port}"]
+            if workers:
+                cmd += ["--workers", str(workers)]
+            if threads:
+                cmd += ["--threads", str(threads)]
+            env = {**os.environ, "DATABASE_URL": url, "DATABASE_REPLICA_URLS": "", "METRICS_DIR": ""}
+            env.pop("FLASK_RUN_FROM_CLI", None)  # иначе app.run() внутри `flask ...` ничего не делает
+            proc = subprocess.Popen(cmd, cwd=project_dir, env=env,
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                _wait_port(port, proc)
+                _load(port, paths, concurrency, min(seconds, 2.0))  # прогрев
+                results.append({"mode": mode, **_load(port, paths, concurrency, seconds)})
+            finally:
+                proc.terminate()
+                try:
+                    proc.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+    return results
+
+
+def _main(argv):
+    """python -m <пакет>.serve dev|prod HOST:PORT [--workers N] [--threads N] — для bench_servers."""
+    from . import create_app
+
+    mode, bind = argv[0], argv[1]
+    opts = dict(zip(argv[2::2], argv[3::2]))
+    if mode == "dev":
+        host, port = bind.rsplit(":", 1)
+        # как `python run.py run`, но без перезапускающего процесса
+        create_app().run(host=host, port=int(port), debug=True, use_reloader=False)
+        return
+    app = create_app()
+    serve(create_app, app.config, bind=bind,
+          workers=int(opts["--workers"]) if "--workers" in opts else None,
+          threads=int(opts["--threads"]) if "--threads" in opts else None)
+
+
+if __name__ == "__main__":
+    _main(sys.argv[1:])
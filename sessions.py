@@ -0,0 +1,314 @@
+"""Серверные сессии: в cookie только подписанный непрозрачный id, данные — в хранилище.
+
+SESSION_BACKEND:
+- "db"     — таблица web_session в основной БД (по умолчанию, общая для всех процессов);
+- "memory" — словарь в процессе (один процесс / разработка);
+- "redis"  — любой клиент с get/setex/delete (redis.Redis по SESSION_REDIS_URL или
+             LocalRedis — локальная замена без сервера);
+- "cookie" — стандартная cookie-сессия Flask (как было раньше).
+
+Запись ленивая: в хранилище пишем только если session.modified; срок жизни
+продлеваем, когда прошло больше половины SESSION_LIFETIME.
+"""
+import time
+import random
+import secrets
+import threading
+from datetime import datetime, timedelta
+
+from flask import session, current_app
+from flask.sessions import SessionInterface, SecureCookieSession, session_json_serializer
+from itsdangerous import Signer, BadSignature
+
+from .db import db, dialect_insert
+from .models import WebSession
+
+
+class ServerSideSession(SecureCookieSession):
+    def __init__(self, initial=None, sid=None, new=False, expires_at=None):
+        super().__init__(initial)
+        self.sid = sid
+        self.new = new
+        self.expires_at = expires_at  # time.time(), до которого запись живёт в хранилище
+        self.regenerated = False      # id сменили (вход/выход), у клиента — cookie со старым id
+
+
+# -------------------------
+# Хранилища
+# -------------------------
+
+class MemorySessionStore:
+    def __init__(self):
+        self._data = {}  # sid -> (expires_at, payload)
+        self._lock = threading.Lock()
+
+    def load(self, sid):
+        with self._lock:
+            item = self._data.get(sid)
+        if not item or item[0] < time.time():
+            return None
+        return item[1], item[0]
+
+    def save(self, sid, payload: str, expires_at: float):
+        with self._lock:
+            self._data[sid] = (expires_at, payload)
+
+    def touch(self, sid, expires_at: float):
+        with self._lock:
+            if sid in self._data:
+                self._data[sid] = (expires_at, self._data[sid][1])
+
+    def delete(self, sid):
+        with self._lock:
+            self._data.pop(sid, None)
+
+    def gc(self) -> int:
+        now = time.time()
+        with self._lock:
+            expired = [sid for sid, (exp, _) in self._data.items() if exp < now]
+            for sid in expired:
+                del self._data[sid]
+        return len(expired)
+
+
+class DBSessionStore:
+    """Таблица web_session. Работает через отдельное соединение движка, а не через
+    db.session, чтобы запись сессии не коммитила чужие изменения вью.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def load(self, sid):
+        table = WebSession.__table__
+        with db.engine.connect() as conn:
+            row = conn.execute(
+                db.select(table.c.data, table.c.expires_at).where(table.c.id == sid)
+            ).first()
+        if not row or row.expires_at < datetime.utcnow():
+            return None
+        return row.data, _to_ts(row.expires_at)
+
+    def _write(self, stmt):
+        # незакоммиченное вью всё равно откатится в teardown; откатываем заранее,
+        # чтобы его транзакция не держала блокировку SQLite, пока мы пишем сессию
+        db.session.rollback()
+        with db.engine.begin() as conn:
+            conn.execute(stmt)
+
+    def save(self, sid, payload: str, expires_at: float):
+        table = WebSession.__table__
+        stmt = dialect_insert(table).values(id=sid, data=payload, expires_at=_from_ts(expires_at))
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.id],
+            set_={"data": stmt.excluded.data, "expires_at": stmt.excluded.expires_at},
+        )
+        self._write(stmt)
+
+    def touch(self, sid, expires_at: float):
+        table = WebSession.__table__
+        self._write(db.update(table).where(table.c.id == sid).values(expires_at=_from_ts(expires_at)))
+
+    def delete(self, sid):
+        table = WebSession.__table__
+        self._write(db.delete(table).where(table.c.id == sid))
+
+    def gc(self) -> int:
+        table = WebSession.__table__
+        with db.engine.begin() as conn:
+            return conn.execute(db.delete(table).where(table.c.expires_at < datetime.utcnow())).rowcount
+
+
+class LocalRedis:
+    """Локальная замена Redis для разработки: только get/setex/delete, TTL в памяти."""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if not item:
+                return None
+            if item[0] < time.time():
+                del self._data[key]
+                return None
+            return item[1]
+
+    def setex(self, key, ttl, value):
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        with self._lock:
+            self._data[key] = (time.time() + int(ttl), value)
+        return True
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(1 for k in keys if self._data.pop(k, None) is not None)
+
+
+class RedisSessionStore:
+    """Сессии в Redis: ключ session:<sid>, срок жизни — TTL ключа (gc не нужен)."""
+
+    def __init__(self, client, prefix: str = "session:"):
+        self.client = client
+        self.prefix = prefix
+
+    def load(self, sid):
+        raw = self.client.get(self.prefix + sid)
+        if raw is None:
+            return None
+        expires_at, _, payload = raw.decode("utf-8").partition("|")
+        return payload, float(expires_at)
+
+    def save(self, sid, payload: str, expires_at: float):
+        ttl = max(int(expires_at - time.time()), 1)
+        self.client.setex(self.prefix + sid, ttl, f"{expires_at}|{payload}")
+
+    def touch(self, sid, expires_at: float):
+        loaded = self.load(sid)
+        if loaded:
+            self.save(sid, loaded[0], expires_at)
+
+    def delete(self, sid):
+        self.client.delete(self.prefix + sid)
+
+    def gc(self) -> int:
+        return 0
+
+
+def _to_ts(dt: datetime) -> float:
+    return (dt - datetime(1970, 1, 1)).total_seconds()
+
+
+def _from_ts(ts: float) -> datetime:
+    return datetime(1970, 1, 1) + timedelta(seconds=ts)
+
+
+# -------------------------
+# SessionInterface
+# -------------------------
+
+class ServerSideSessionInterface(SessionInterface):
+    serializer = session_json_serializer
+
+    def __init__(self, store, gc_probability: float = 0.01):
+        self.store = store
+        self.gc_probability = gc_probability
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt="shop-session-id")
+
+    def _lifetime(self, app) -> float:
+        return app.permanent_session_lifetime.total_seconds()
+
+    def open_session(self, app, request):
+        raw = request.cookies.get(self.get_cookie_name(app))
+        if raw:
+            try:
+                sid = self._signer(app).unsign(raw).decode("ascii")
+            except BadSignature:
+                sid = None
+            if sid:
+                loaded = self.store.load(sid)
+                if loaded is not None:
+                    payload, expires_at = loaded
+                    return ServerSideSession(self.serializer.loads(payload), sid=sid, expires_at=expires_at)
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def regenerate(self, session):
+        """Новый id для той же сессии (вход, регистрация, выход): старая запись удаляется,
+        cookie выдаётся заново. Иначе id, известный до входа (подброшенный или подсмотренный),
+        после входа открывал бы сессию пользователя — фиксация сессии.
+        """
+        if not session.new:
+            self.store.delete(session.sid)
+        session.sid = secrets.token_urlsafe(32)
+        session.new = True
+        session.regenerated = True
+        session.modified = True
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        if not session:
+            if (not session.new or session.regenerated) and session.modified:
+                self.store.delete(session.sid)
+                response.delete_cookie(
+                    name, domain=domain, path=path, secure=secure, samesite=samesite, httponly=httponly
+                )
+                response.vary.add("Cookie")
+            return
+
+        now = time.time()
+        lifetime = self._lifetime(app)
+        if session.modified or session.new:
+            expires_at = now + lifetime
+            self.store.save(session.sid, self.serializer.dumps(dict(session)), expires_at)
+            if self.gc_probability and random.random() < self.gc_probability:
+                self.store.gc()
+        elif session.expires_at and session.expires_at - now < lifetime / 2:
+            # ничего не меняли, но срок на исходе — продлеваем без перезаписи данных
+            expires_at = now + lifetime
+            self.store.touch(session.sid, expires_at)
+        else:
+            return
+
+        if not session.new and not session.permanent:
+            return  # cookie браузерной сессии с тем же id уже у клиента
+        response.set_cookie(
+            name,
+            self._signer(app).sign(session.sid).decode("ascii"),
+            expires=self.get_expiration_time(app, session),
+            httponly=httponly,
+            domain=domain,
+            path=path,
+            secure=secure,
+            samesite=samesite,
+        )
+        response.vary.add("Cookie")
+
+
+def regenerate_session(clear: bool = False):
+    """Сменить id текущей сессии (вызывать при входе, регистрации и выходе).
+    clear=True — заодно очистить данные (выход). Для SESSION_BACKEND="cookie" id нет —
+    только очистка.
+    """
+    if clear:
+        session.clear()
+    interface = current_app.session_interface
+    if isinstance(interface, ServerSideSessionInterface):
+        interface.regenerate(session)
+
+
+def make_session_store(app):
+    backend = app.config["SESSION_BACKEND"]
+    if backend == "db":
+        return DBSessionStore(app)
+    if backend == "memory":
+        return MemorySessionStore()
+    if backend == "redis":
+        url = app.config.get("SESSION_REDIS_URL")
+        if url:
+            import redis  # опциональная зависимость: pip install redis
+
+            return RedisSessionStore(redis.Redis.from_url(url))
+        return RedisSessionStore(LocalRedis())
+    raise ValueError(f"Неизвестный SESSION_BACKEND: {backend!r}")
+
+
+def init_sessions(app):
+    if app.config["SESSION_BACKEND"] == "cookie":
+        return
+    app.session_interface = ServerSideSessionInterface(
+        make_session_store(app), gc_probability=app.config["SESSION_GC_PROBABILITY"]
+    )
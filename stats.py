@@ -0,0 +1,154 @@
+"""Материализованная статистика для админ-панели.
+
+StatCounter — счётчики (users/products/orders/revenue), DailyStat — заказы и выручка
+по дням. Пересчитываются инкрементально в той же транзакции, что и изменения:
+- users/products/orders — по событию after_flush (любая вставка/удаление через ORM);
+- выручка — фоновой задачей order.accept (см. utils.py), когда заказ принят.
+Полный пересчёт с нуля — команда `flask rebuild-stats`.
+
+catalog_version — не статистика, а номер версии витрины (для ETag, см. httpcache.py):
+растёт при любом изменении товаров через ORM и при массовом импорте; rebuild его не трогает.
+"""
+from datetime import datetime
+
+from sqlalchemy import event
+
+from .db import db, dialect_insert
+from .models import User, Product, Order, StatCounter, DailyStat
+from .routing import RoutingSession
+
+COUNTED_MODELS = {User: "users", Product: "products", Order: "orders"}
+CATALOG_VERSION = "catalog_version"
+ACCEPTED = Order.status != "создан"  # в выручке — только принятые заказы (см. order.accept)
+
+
+def _bump_counters(conn, deltas: dict):
+    table = StatCounter.__table__
+    for name, delta in deltas.items():
+        if not delta:
+            continue
+        stmt = dialect_insert(table).values(name=name, value=delta)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.name], set_={"value": table.c.value + stmt.excluded.value}
+        )
+        conn.execute(stmt)
+
+
+def _bump_daily(conn, day, orders: int = 0, revenue: int = 0):
+    table = DailyStat.__table__
+    stmt = dialect_insert(table).values(day=day, orders=orders, revenue=revenue)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.day],
+        set_={
+            "orders": table.c.orders + stmt.excluded.orders,
+            "revenue": table.c.revenue + stmt.excluded.revenue,
+        },
+    )
+    conn.execute(stmt)
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _count_changes(session, _flush_context):
+    deltas = {}
+    new_orders_by_day = {}
+    for obj, sign in [(o, 1) for o in session.new] + [(o, -1) for o in session.deleted]:
+        name = COUNTED_MODELS.get(type(obj))
+        if not name:
+            continue
+        deltas[name] = deltas.get(name, 0) + sign
+        if isinstance(obj, Order) and sign > 0:
+            day = (obj.created_at or datetime.utcnow()).date()
+            new_orders_by_day[day] = new_orders_by_day.get(day, 0) + 1
+    if any(isinstance(o, Product) for o in session.new) or any(isinstance(o, Product) for o in session.deleted) \
+            or any(isinstance(o, Product) and session.is_modified(o) for o in session.dirty):
+        deltas[CATALOG_VERSION] = 1
+    if not deltas:
+        return
+    conn = session.connection()
+    _bump_counters(conn, deltas)
+    for day, n in new_orders_by_day.items():
+        _bump_daily(conn, day, orders=n)
+
+
+def add_orders_revenue(rows):
+    """Учесть заказы в выручке; rows — [(total, created_at)] (в транзакции приёма заказов)."""
+    by_day = {}
+    for total, created_at in rows:
+        day = (created_at or datetime.utcnow()).date()
+        by_day[day] = by_day.get(day, 0) + int(total or 0)
+    revenue = sum(by_day.values())
+    if not revenue:
+        return
+    conn = db.session.connection()
+    _bump_counters(conn, {"revenue": revenue})
+    for day, amount in by_day.items():
+        if amount:
+            _bump_daily(conn, day, revenue=amount)
+
+
+def add_counters(**deltas):
+    """Поправить счётчики при массовых изменениях мимо ORM (импорт товаров и т.п.)."""
+    _bump_counters(db.session.connection(), deltas)
+
+
+def catalog_version() -> int:
+    """Текущая версия витрины: одна выборка по первичному ключу."""
+    return int(
+        db.session.query(StatCounter.value).filter(StatCounter.name == CATALOG_VERSION).scalar() or 0
+    )
+
+
+def dashboard_stats() -> dict:
+    """Счётчики для дашборда: один запрос по первичному ключу."""
+    rows = dict(db.session.query(StatCounter.name, StatCounter.value).all())
+    return {name: int(rows.get(name, 0)) for name in ("users", "products", "orders", "revenue")}
+
+
+def daily_stats(days: int = 14):
+    """Последние days дней с заказами: [DailyStat], новые сверху."""
+    return DailyStat.query.order_by(DailyStat.day.desc()).limit(days).all()
+
+
+def rebuild_stats():
+    """Пересчитать все счётчики и дневные итоги с нуля (одной транзакцией)."""
+    try:
+        db.session.execute(db.delete(StatCounter.__table__).where(StatCounter.__table__.c.name != CATALOG_VERSION))
+        db.session.execute(db.delete(DailyStat.__table__))
+        counters = {
+            "users": db.session.query(db.func.count(User.id)).scalar(),
+            "products": db.session.query(db.func.count(Product.id)).scalar(),
+            "orders": db.session.query(db.func.count(Order.id)).scalar(),
+            "revenue": db.session.query(db.func.coalesce(db.func.sum(Order.total), 0)).filter(ACCEPTED).scalar(),
+        }
+        db.session.execute(
+            db.insert(StatCounter.__table__),
+            [{"name": k, "value": int(v or 0)} for k, v in counters.items()],
+        )
+        day = db.func.date(Order.created_at)
+        revenue = db.func.sum(db.case((ACCEPTED, Order.total), else_=0))
+        rows = (
+            db.session.query(day, db.func.count(Order.id), db.func.coalesce(revenue, 0))
+            .group_by(day)
+            .all()
+        )
+        if rows:
+            db.session.execute(
+                db.insert(DailyStat.__table__),
+                [
+                    {"day": _as_date(d), "orders": int(n), "revenue": int(r)}
+                    for d, n, r in rows
+                    if d is not None
+                ],
+            )
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return counters
+
+
+def _as_date(value):
+    # SQLite date() отдаёт строку 'YYYY-MM-DD', PostgreSQL — date
+    if isinstance(value, str):
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    return value
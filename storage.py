@@ -0,0 +1,168 @@
+"""Настройки хранилища SQLite: PRAGMA на каждое соединение и параметры пула.
+
+Профиль выбирается ключом SQLITE_PROFILE:
+- "production" — WAL, synchronous=NORMAL, busy_timeout, mmap, большой page cache,
+  временные таблицы в памяти; читатели не блокируют писателя.
+- "legacy" — как раньше: rollback-журнал, synchronous=FULL, без ожидания блокировки.
+Отдельные PRAGMA можно переопределить через SQLITE_PRAGMAS = {"cache_size": ...}.
+"""
+import time
+import random
+import tempfile
+import threading
+from pathlib import Path
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+PROFILES = {
+    "legacy": {
+        "pragmas": {},
+        "engine": {},
+    },
+    "production": {
+        "pragmas": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "busy_timeout": 5000,        # мс ждать чужую блокировку вместо "database is locked"
+            "mmap_size": 268_435_456,    # 256 МБ читаем через mmap
+            "cache_size": -65_536,       # 64 МБ page cache на соединение
+            "temp_store": "MEMORY",
+        },
+        "engine": {
+            "pool_size": 10,
+            "max_overflow": 20,
+            "pool_timeout": 30,
+            "pool_recycle": 3600,
+            "connect_args": {"timeout": 5, "check_same_thread": False},
+        },
+    },
+}
+
+
+def storage_profile(app) -> dict:
+    name = app.config.get("SQLITE_PROFILE", "production")
+    if name not in PROFILES:
+        raise ValueError(f"Неизвестный SQLITE_PROFILE: {name!r} (есть: {', '.join(PROFILES)})")
+    profile = PROFILES[name]
+    pragmas = dict(profile["pragmas"])
+    pragmas.update(app.config.get("SQLITE_PRAGMAS") or {})
+    return {"name": name, "pragmas": pragmas, "engine": dict(profile["engine"])}
+
+
+# только для QueuePool: SQLite в памяти работает через StaticPool и их не принимает
+QUEUE_POOL_OPTIONS = ("pool_size", "max_overflow", "pool_timeout")
+
+
+def sqlite_file_backed(uri: str) -> bool:
+    """SQLite-файл на диске (а не "sqlite://", ":memory:" или file:...?mode=memory)."""
+    url = make_url(uri)
+    database = url.database or ""
+    return bool(database) and ":memory:" not in database and url.query.get("mode") != "memory"
+
+
+def configure_engine_options(app):
+    """Параметры пула из профиля -> SQLALCHEMY_ENGINE_OPTIONS (вызывать до db.init_app).
+    Явно заданные в конфиге опции важнее профиля.
+    """
+    uri = app.config["SQLALCHEMY_DATABASE_URI"]
+    if not uri.startswith("sqlite"):
+        return
+    options = storage_profile(app)["engine"]
+    if not sqlite_file_backed(uri):
+        for name in QUEUE_POOL_OPTIONS:
+            options.pop(name, None)
+    options.update(app.config.get("SQLALCHEMY_ENGINE_OPTIONS") or {})
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = options
+
+
+def apply_pragmas(engine, pragmas: dict):
+    """Выполнять PRAGMA на каждом новом соединении движка."""
+    if engine.dialect.name != "sqlite" or not pragmas:
+        return
+
+    def on_connect(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        try:
+            for name, value in pragmas.items():
+                cur.execute(f"PRAGMA {name}={value}")
+        finally:
+            cur.close()
+
+    event.listen(engine, "connect", on_connect)
+
+
+def init_storage(app, db):
+    """Навесить PRAGMA профиля на все SQLite-движки приложения (после db.init_app)."""
+    pragmas = storage_profile(app)["pragmas"]
+    with app.app_context():
+        for engine in db.engines.values():
+            apply_pragmas(engine, pragmas)
+
+
+# -------------------------
+# Нагрузочный тест: чтение каталога + добавления в корзину
+# -------------------------
+
+def benchmark_storage(profile: str, threads: int = 16, seconds: float = 5.0, products: int = 2000, write_share: float = 0.3):
+    """Параллельно гонять GET /catalog и POST /cart/add/<id> на временной БД.
+    Возвращает {"profile", "reads", "writes", "errors", "rps"}.
+    """
+    from . import create_app
+    from .db import db
+    from .models import User, Product
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app({
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{Path(tmp, 'bench.sqlite3').as_posix()}",
+            "SQLITE_PROFILE": profile,
+            "PRODUCT_CACHE_SIZE": 0,  # мерим БД, а не кэш
+        })
+        app.logger.disabled = True
+        with app.app_context():
+            db.create_all()
+            db.session.add_all(
+                Product(title=f"Товар {i}", description="", price=100 + i, category=f"Кат {i % 10}")
+                for i in range(products)
+            )
+            db.session.add_all(
+                User(username=f"bench{i}", password_hash="-", role="user") for i in range(threads)
+            )
+            db.session.commit()
+            user_ids = [u.id for u in User.query.order_by(User.id).all()]
+
+        counters = {"reads": 0, "writes": 0, "errors": 0}
+        lock = threading.Lock()
+        deadline = time.perf_counter() + seconds
+
+        def worker(uid):
+            rnd = random.Random(uid)
+            client = app.test_client()
+            with client.session_transaction() as s:
+                s["user_id"] = uid
+            local = {"reads": 0, "writes": 0, "errors": 0}
+            while time.perf_counter() < deadline:
+                if rnd.random() < write_share:
+                    r = client.post(f"/cart/add/{rnd.randint(1, products)}")
+                    kind = "writes"
+                else:
+                    r = client.get(f"/catalog?category=Кат {rnd.randint(0, 9)}")
+                    kind = "reads"
+                local["errors" if r.status_code >= 500 else kind] += 1
+            with lock:
+                for k, v in local.items():
+                    counters[k] += v
+
+        started = time.perf_counter()
+        pool = [threading.Thread(target=worker, args=(uid,)) for uid in user_ids]
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+        elapsed = time.perf_counter() - started
+
+        with app.app_context():
+            db.engine.dispose()
+
+    done = counters["reads"] + counters["writes"]
+    return {"profile": profile, **counters, "rps": round(done / elapsed, 1)}
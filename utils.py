@@ -1,14 +1,54 @@
 from functools import wraps
-from flask import session, redirect, url_for, flash, request
-from .db import db
-from .models import User, Product, CartItem
+from flask import session, redirect, url_for, flash, request, current_app, has_request_context
+from .db import db, dialect_insert
+from .models import User, Product, CartItem, Order, OrderItem
+from .catalog import ProductSnapshot, SNAPSHOT_COLUMNS, get_products
+from . import inventory
+from .stats import add_orders_revenue
+from .metrics import record_checkout
+from .jobs import task, enqueue
+
+
+# -------------------------
+# Контекст запроса (пользователь + бейдж корзины)
+# -------------------------
+# base.html вызывает current_user()/cart_count() по несколько раз за рендер,
+# плюс декораторы login_required/admin_required. Чтобы не ходить в БД на
+# каждый вызов, результат кладём в request.environ на время одного запроса.
+# Не в flask.g: g живёт в app context, а его делят все запросы внутри одного
+# app.app_context() (тесты, скрипты) — как и профиль в profiling.py.
+
+def _request_cache() -> dict:
+    """Словарь кэша текущего запроса (вне запроса — пустой и одноразовый)."""
+    if not has_request_context():
+        return {}
+    return request.environ.setdefault("shop.request_cache", {})
 
 
 def current_user():
     uid = session.get("user_id")
     if not uid:
         return None
-    return db.session.get(User, uid)
+    cache = _request_cache()
+    cached = cache.get("current_user")
+    if cached is not None and cached[0] == uid:
+        return cached[1]
+    user = db.session.get(User, uid)
+    cache["current_user"] = (uid, user)
+    return user
+
+
+def _invalidate_cart():
+    """Сбросить закэшированные в запросе корзину и бейдж (после изменения корзины)."""
+    cache = _request_cache()
+    cache.pop("cart_count", None)
+    cache.pop("cart_items", None)
+    cache["cart_changed"] = True  # httpcache обновит cookie со счётчиком для шапки
+
+
+def cart_changed() -> bool:
+    """Менялась ли корзина в текущем запросе."""
+    return bool(_request_cache().get("cart_changed"))
 
 
 def login_required(view):
@@ -44,75 +84,118 @@ def get_session_cart():
 
 
 def cart_count():
-    """Количество единиц товаров в корзине (бейдж в хедере)."""
+    """Количество единиц товаров в корзине (бейдж в хедере).
+    Считается один раз за запрос, до следующего изменения корзины.
+    """
     u = current_user()
+    uid = u.id if u else None
+    cache = _request_cache()
+    cached = cache.get("cart_count")
+    if cached is not None and cached[0] == uid:
+        return cached[1]
+
     if u:
-        return int(
-            db.session.query(db.func.coalesce(db.func.sum(CartItem.qty), 0))
-            .filter(CartItem.user_id == u.id)
-            .scalar()
-            or 0
-        )
-    cart = session.get("cart", {})
-    return sum(int(qty) for qty in cart.values())
+        # те же строки, что покажет страница корзины (один JOIN-запрос на запрос)
+        items, _ = cart_items()
+        count = sum(it["qty"] for it in items)
+    else:
+        cart = session.get("cart", {})
+        count = sum(int(qty) for qty in cart.values())
+    cache["cart_count"] = (uid, count)
+    return count
 
 
 def cart_items():
     """Возвращает (items, total) для отображения корзины/оформления.
-    items: [{product, qty, line}]
+    items: [{product, qty, line}], product — ProductSnapshot.
+    Читается один раз за запрос, до следующего изменения корзины.
     """
     u = current_user()
+    uid = u.id if u else None
+    cache = _request_cache()
+    cached = cache.get("cart_items")
+    if cached is not None and cached[0] == uid:
+        return cached[1], cached[2]
+
+    if u:
+        flush_cart()  # изменения через get_cart() — до чтения
+    items, total = user_cart_lines(u.id) if u else _guest_cart_lines()
+    cache["cart_items"] = (uid, items, total)
+    return items, total
+
+
+def user_cart_lines(user_id: int):
+    """Корзина пользователя одним запросом: CartItem JOIN активные Product.
+    Возвращает (items, total) без загрузки ORM-объектов.
+    """
+    rows = (
+        db.session.query(CartItem.qty, *SNAPSHOT_COLUMNS)
+        .join(Product, Product.id == CartItem.product_id)
+        .filter(CartItem.user_id == user_id, Product.is_active.is_(True))
+        .order_by(CartItem.id)
+        .all()
+    )
     items = []
     total = 0
+    for row in rows:
+        p = ProductSnapshot.from_model(row)
+        qty = int(row.qty)
+        line = p.price * qty
+        total += line
+        items.append({"product": p, "qty": qty, "line": line})
+    return items, total
 
-    if u:
-        rows = CartItem.query.filter(CartItem.user_id == u.id).all()
-        for row in rows:
-            p = row.product
-            if not p or not p.is_active:
-                continue
-            qty = int(row.qty)
-            line = p.price * qty
-            total += line
-            items.append({"product": p, "qty": qty, "line": line})
-        return items, total
-
-    cart = session.get("cart", {})
-    for pid_str, qty in cart.items():
-        pid = int(pid_str)
-        p = db.session.get(Product, pid)
+
+def _guest_cart_lines():
+    items = []
+    total = 0
+    cart = _parse_session_cart(session.get("cart", {}))
+    products = get_products(cart.keys())  # один IN-запрос на промахи кэша
+    for pid, qty in cart.items():
+        p = products.get(pid)
         if not p or not p.is_active:
             continue
-        qty = int(qty)
         line = p.price * qty
         total += line
         items.append({"product": p, "qty": qty, "line": line})
     return items, total
 
 
-def add_to_cart(product_id: int, qty: int = 1):
-    """Добавить товар в корзину (в БД для авторизованных, иначе в сессию)."""
+def add_to_cart(product_id: int, qty: int = 1) -> bool:
+    """Добавить товар в корзину (в БД для авторизованных, иначе в сессию).
+    При STOCK_RESERVE_ON_ADD товар сразу резервируется; False — на складе не хватает.
+    """
+    _invalidate_cart()
     u = current_user()
     if u:
-        row = CartItem.query.filter_by(user_id=u.id, product_id=product_id).first()
-        if row:
-            row.qty = int(row.qty) + int(qty)
-        else:
-            db.session.add(CartItem(user_id=u.id, product_id=product_id, qty=int(qty)))
-        db.session.commit()
-        return
+        flush_cart()
+        try:
+            _apply_user_cart_ops(u.id, {product_id: ("add", int(qty))},
+                                 reserve=current_app.config["STOCK_RESERVE_ON_ADD"])
+            db.session.commit()
+        except inventory.OutOfStock:
+            db.session.rollback()
+            return False
+        except Exception:
+            db.session.rollback()
+            raise
+        return True
 
     cart = get_session_cart()
     key = str(product_id)
     cart[key] = int(cart.get(key, 0)) + int(qty)
     session.modified = True
+    return True
 
 
 def remove_from_cart(product_id: int):
     """Удалить позицию из корзины."""
+    _invalidate_cart()
     u = current_user()
     if u:
+        flush_cart()
         CartItem.query.filter_by(user_id=u.id, product_id=product_id).delete()
+        inventory.release(u.id, product_id)
         db.session.commit()
         return
 
@@ -123,21 +206,22 @@ def remove_from_cart(product_id: int):
 
 def clear_cart():
     """Очистить корзину."""
+    _invalidate_cart()
     u = current_user()
     if u:
+        flush_cart()
         CartItem.query.filter_by(user_id=u.id).delete()
+        inventory.release(u.id)
         db.session.commit()
         return
     session["cart"] = {}
     session.modified = True
 
 
-def merge_session_cart_into_db(user_id: int):
-    """Слить корзину гостя (session) в корзину пользователя (DB)."""
-    cart = session.get("cart") or {}
-    if not cart:
-        return
-    for pid_str, qty in cart.items():
+def _parse_session_cart(cart) -> dict:
+    """session['cart'] -> {product_id(int): qty(int)}; мусор и qty<=0 отбрасываются."""
+    parsed = {}
+    for pid_str, qty in (cart or {}).items():
         try:
             pid = int(pid_str)
             qty = int(qty)
@@ -145,16 +229,273 @@ def merge_session_cart_into_db(user_id: int):
             continue
         if qty <= 0:
             continue
-        row = CartItem.query.filter_by(user_id=user_id, product_id=pid).first()
-        if row:
-            row.qty = int(row.qty) + qty
-        else:
-            db.session.add(CartItem(user_id=user_id, product_id=pid, qty=qty))
-    db.session.commit()
+        parsed[pid] = parsed.get(pid, 0) + qty
+    return parsed
+
+
+def merge_session_cart_into_db(user_id: int):
+    """Слить корзину гостя (session) в корзину пользователя (DB).
+    Один IN-запрос за товарами и один INSERT ... ON CONFLICT DO UPDATE на все строки.
+    """
+    cart = _parse_session_cart(session.get("cart"))
+    if not cart:
+        if "cart" in session:
+            session["cart"] = {}
+            session.modified = True
+        return
+    _invalidate_cart()
+    flush_cart()
+
+    products = get_products(cart.keys())
+    rows = [
+        {"user_id": user_id, "product_id": pid, "qty": qty}
+        for pid, qty in cart.items()
+        if pid in products
+    ]
+    if rows:
+        table = CartItem.__table__
+        stmt = dialect_insert(table).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.product_id],
+            set_={"qty": table.c.qty + stmt.excluded.qty},
+        )
+        db.session.execute(stmt)
+        db.session.commit()
+
     session["cart"] = {}
     session.modified = True
 
 
+# -------------------------
+# Пакетные изменения (JSON API корзины)
+# -------------------------
+
+CART_OPS = ("set", "add")
+MAX_LINE_QTY = 999
+
+
+class CartError(ValueError):
+    """Некорректный пакет изменений корзины (API отвечает 400)."""
+
+    def __init__(self, message: str, product_ids=()):
+        self.product_ids = list(product_ids)
+        super().__init__(message)
+
+
+def _merge_cart_ops(ops) -> dict:
+    """Проверить пакет [{"product_id", "qty", "op": "set"|"add"}] и свернуть его по товарам:
+    {product_id: ("set", qty) | ("add", delta)} — операции над одним товаром применяются по порядку.
+    Операции над отсутствующими товарами без прибавления пропускаются (нечего удалять).
+    """
+    if not isinstance(ops, list) or not ops:
+        raise CartError("Ожидается непустой список операций ops")
+    if len(ops) > current_app.config["CART_API_MAX_OPS"]:
+        raise CartError(f"Не больше {current_app.config['CART_API_MAX_OPS']} операций за раз")
+
+    merged = {}
+    for i, op in enumerate(ops):
+        if not isinstance(op, dict):
+            raise CartError(f"ops[{i}]: ожидается объект")
+        pid, qty, kind = op.get("product_id"), op.get("qty"), op.get("op", "set")
+        if type(pid) is not int or pid <= 0 or type(qty) is not int or kind not in CART_OPS:
+            raise CartError(f"ops[{i}]: нужны целые product_id, qty и op из {', '.join(CART_OPS)}")
+        if abs(qty) > MAX_LINE_QTY or (kind == "set" and qty < 0):
+            raise CartError(f"ops[{i}]: недопустимое количество {qty}", [pid])
+        prev = merged.get(pid)
+        if kind == "add" and prev is not None:
+            kind, qty = prev[0], (max(prev[1] + qty, 0) if prev[0] == "set" else prev[1] + qty)
+        merged[pid] = (kind, qty)
+
+    products = get_products(merged.keys())
+    unavailable = [
+        pid for pid, (_, qty) in merged.items()
+        if qty > 0 and (pid not in products or not products[pid].is_active)
+    ]
+    if unavailable:
+        raise CartError("Товар недоступен", sorted(unavailable))
+    return {pid: op for pid, op in merged.items() if pid in products}
+
+
+def _apply_user_cart_ops(user_id: int, ops: dict, reserve: bool = False):
+    """Применить свёрнутые операции к корзине в БД (без commit).
+
+    Все строки пишутся одним INSERT ... ON CONFLICT DO UPDATE: для "set" qty заменяется,
+    для "add" прибавляется в SQL (параллельные запросы не теряют прибавки). Строки, у
+    которых qty стало <= 0, удаляются одним DELETE ... RETURNING, их резерв возвращается
+    на склад. reserve=True — прибавку сразу резервируем (OutOfStock, если не хватает);
+    уменьшение количества резерв не трогает: лишнее вернётся при оформлении или по сроку.
+    """
+    if not ops:
+        return
+    table = CartItem.__table__
+    if reserve:
+        set_pids = [pid for pid, (kind, _) in ops.items() if kind == "set"]
+        current = dict(
+            db.session.execute(
+                db.select(table.c.product_id, table.c.qty)
+                .where(table.c.user_id == user_id, table.c.product_id.in_(set_pids))
+            ).all()
+        ) if set_pids else {}
+        short = []
+        for pid, (kind, qty) in ops.items():
+            delta = qty - int(current.get(pid, 0)) if kind == "set" else qty
+            if delta > 0 and not inventory.reserve(user_id, pid, delta):
+                short.append(pid)
+        if short:
+            raise inventory.OutOfStock(short)
+
+    stmt = dialect_insert(table).values(
+        [{"user_id": user_id, "product_id": pid, "qty": qty} for pid, (_, qty) in ops.items()]
+    )
+    new_qty = table.c.qty + stmt.excluded.qty
+    set_pids = [pid for pid, (kind, _) in ops.items() if kind == "set"]
+    if set_pids:
+        new_qty = db.case((stmt.excluded.product_id.in_(set_pids), stmt.excluded.qty), else_=new_qty)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.product_id],
+        set_={"qty": new_qty},
+    ))
+
+    removed = db.session.execute(
+        db.delete(table)
+        .where(table.c.user_id == user_id, table.c.product_id.in_(list(ops)), table.c.qty <= 0)
+        .returning(table.c.product_id)
+    ).scalars().all()
+    for pid in removed:
+        inventory.release(user_id, pid)
+
+
+def update_cart(ops) -> dict:
+    """Пакет изменений корзины одной транзакцией (POST /api/cart), возвращает cart_summary().
+    CartError — пакет некорректен, inventory.OutOfStock — не хватило остатка; в обоих
+    случаях корзина не меняется.
+    """
+    merged = _merge_cart_ops(ops)
+    _invalidate_cart()
+    u = current_user()
+    if u:
+        flush_cart()  # буфер get_cart() — раньше пакета, как и был сделан
+        try:
+            _apply_user_cart_ops(u.id, merged, reserve=current_app.config["STOCK_RESERVE_ON_ADD"])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    else:
+        cart = _parse_session_cart(session.get("cart"))
+        for pid, (kind, qty) in merged.items():
+            cart[pid] = qty if kind == "set" else cart.get(pid, 0) + qty
+        session["cart"] = {str(pid): qty for pid, qty in cart.items() if qty > 0}
+        session.modified = True
+    return cart_summary()
+
+
+def cart_summary() -> dict:
+    """Корзина для JSON: {"items": [...], "count": единиц, "total": сумма}."""
+    items, total = cart_items()
+    return {
+        "items": [
+            {"product_id": it["product"].id, "title": it["product"].title,
+             "price": it["product"].price, "qty": it["qty"], "line": it["line"]}
+            for it in items
+        ],
+        "count": sum(it["qty"] for it in items),
+        "total": total,
+    }
+
+
+# -------------------------
+# Оформление заказа
+# -------------------------
+
+def place_order(user_id: int, status: str = "создан"):
+    """Оформить заказ из корзины пользователя одной транзакцией.
+
+    Остатки списываются условными UPDATE (с учётом резерва), позиции копируются
+    в OrderItem через INSERT ... SELECT (цены фиксируются на момент заказа), сумма
+    считается в SQL, корзина очищается в той же транзакции. Остальное (приём заказа,
+    выручка, подтверждение) — фоновая задача order.accept, она ставится в той же транзакции.
+    Возвращает id заказа или None, если в корзине нет активных товаров.
+    Если товара не хватает — inventory.OutOfStock, ничего не меняется.
+    """
+    _invalidate_cart()
+    flush_cart()
+    try:
+        order = Order(user_id=user_id, total=0, status=status)
+        db.session.add(order)
+        db.session.flush()  # первая запись: в SQLite берём блокировку до чтения корзины
+
+        active = (
+            db.session.query(CartItem.product_id, CartItem.qty)
+            .join(Product, Product.id == CartItem.product_id)
+            .filter(CartItem.user_id == user_id, Product.is_active.is_(True), CartItem.qty > 0)
+            .all()
+        )
+        if not active:
+            db.session.rollback()
+            return None
+        inventory.commit_stock(user_id, active)
+
+        lines = (
+            db.select(
+                db.literal(order.id),
+                Product.id,
+                Product.title,
+                Product.price,
+                CartItem.qty,
+            )
+            .select_from(CartItem)
+            .join(Product, Product.id == CartItem.product_id)
+            .where(CartItem.user_id == user_id, Product.is_active.is_(True), CartItem.qty > 0)
+            .order_by(CartItem.id)
+        )
+        db.session.execute(
+            db.insert(OrderItem.__table__).from_select(
+                ["order_id", "product_id", "title", "price", "qty"], lines
+            )
+        )
+
+        items = OrderItem.__table__
+        total = (
+            db.select(db.func.coalesce(db.func.sum(items.c.price * items.c.qty), 0))
+            .where(items.c.order_id == order.id)
+            .scalar_subquery()
+        )
+        order_total = db.session.execute(
+            db.update(Order.__table__)
+            .where(Order.__table__.c.id == order.id)
+            .values(total=total)
+            .returning(Order.__table__.c.total)
+        ).scalar()
+        db.session.execute(db.delete(CartItem.__table__).where(CartItem.__table__.c.user_id == user_id))
+        enqueue("order.accept", {"order_id": order.id}, key=f"order.accept:{order.id}")
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    record_checkout(order_total)
+    return order.id
+
+
+@task("order.accept", batch=True)
+def accept_orders(payloads):
+    """Фоновая часть оформления: «создан» -> «принят», выручка, подтверждение покупателю.
+    Идемпотентна: повторная доставка не найдёт заказ в статусе «создан» и ничего не сделает.
+    """
+    orders = Order.__table__
+    ids = [p["order_id"] for p in payloads]
+    rows = db.session.execute(
+        db.update(orders)
+        .where(orders.c.id.in_(ids), orders.c.status == "создан")
+        .values(status="принят")
+        .returning(orders.c.id, orders.c.user_id, orders.c.total, orders.c.created_at)
+    ).all()
+    add_orders_revenue([(r.total, r.created_at) for r in rows])
+    for r in rows:
+        # внешней почты в проекте нет — подтверждение пишется в лог
+        current_app.logger.info("Заказ №%s принят: покупатель %s, сумма %s", r.id, r.user_id, r.total)
+
+
 # -------------------------
 # Совместимость со старым кодом (get_cart)
 # -------------------------
@@ -164,24 +505,35 @@ from collections.abc import MutableMapping
 class _DBCartProxy(MutableMapping):
     """Dict-подобная корзина для авторизованного пользователя.
     Нужна для совместимости со старой логикой, где использовали get_cart()[pid]=qty.
-    В новой логике лучше использовать add_to_cart/remove_from_cart/clear_cart.
+    В новой логике лучше использовать add_to_cart/remove_from_cart/clear_cart или update_cart.
+
+    Работает как единица работы на запрос: строки читаются одним запросом при первом
+    обращении, изменения копятся в буфере и пишутся flush() — одним upsert и одним commit
+    (в конце запроса или перед любым другим чтением/изменением корзины, см. flush_cart).
     """
 
     def __init__(self, user_id: int):
         self.user_id = user_id
-
-    def _rows(self):
-        return CartItem.query.filter_by(user_id=self.user_id).all()
-
-    def _get_row(self, pid: int):
-        return CartItem.query.filter_by(user_id=self.user_id, product_id=pid).first()
+        self._data = None    # {product_id: qty} — из БД + изменения буфера
+        self._pending = {}   # product_id -> новое qty (0 — удалить)
+
+    def _rows(self) -> dict:
+        if self._data is None:
+            table = CartItem.__table__
+            self._data = {
+                pid: int(qty)
+                for pid, qty in db.session.execute(
+                    db.select(table.c.product_id, table.c.qty).where(table.c.user_id == self.user_id)
+                )
+                if int(qty) > 0
+            }
+        return self._data
 
     def __getitem__(self, key):
-        pid = int(key)
-        row = self._get_row(pid)
-        if not row:
+        qty = self._rows().get(int(key))
+        if qty is None:
             raise KeyError(key)
-        return int(row.qty)
+        return qty
 
     def __setitem__(self, key, value):
         pid = int(key)
@@ -189,31 +541,63 @@ class _DBCartProxy(MutableMapping):
         if qty <= 0:
             self.__delitem__(key)
             return
-        row = self._get_row(pid)
-        if row:
-            row.qty = qty
-        else:
-            db.session.add(CartItem(user_id=self.user_id, product_id=pid, qty=qty))
-        db.session.commit()
+        self._rows()[pid] = qty
+        self._pending[pid] = qty
+        _invalidate_cart()
 
     def __delitem__(self, key):
         pid = int(key)
-        CartItem.query.filter_by(user_id=self.user_id, product_id=pid).delete()
-        db.session.commit()
+        self._rows().pop(pid, None)
+        self._pending[pid] = 0
+        _invalidate_cart()
 
     def __iter__(self):
-        for row in self._rows():
-            yield str(row.product_id)
+        for pid in list(self._rows()):
+            yield str(pid)
 
     def __len__(self):
         return len(self._rows())
 
+    def flush(self):
+        """Записать буфер: один INSERT ... ON CONFLICT, удаление обнулённых строк, commit."""
+        if not self._pending:
+            return
+        ops = {pid: ("set", qty) for pid, qty in self._pending.items()}
+        self._pending = {}
+        try:
+            _apply_user_cart_ops(self.user_id, ops)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
 
 def get_cart():
     """Совместимость: возвращает dict корзины.
-    Для гостей — session['cart'], для авторизованных — proxy поверх таблицы CartItem.
+    Для гостей — session['cart'], для авторизованных — proxy поверх таблицы CartItem
+    (один на запрос: повторные вызовы делят буфер изменений).
     """
     u = current_user()
     if u:
-        return _DBCartProxy(u.id)
+        cache = _request_cache()
+        proxy = cache.get("cart_proxy")
+        if proxy is None or proxy.user_id != u.id:
+            flush_cart()
+            proxy = cache["cart_proxy"] = _DBCartProxy(u.id)
+        return proxy
     return get_session_cart()
+
+
+def flush_cart():
+    """Записать изменения, накопленные через get_cart() в этом запросе (если были)."""
+    proxy = _request_cache().pop("cart_proxy", None)
+    if proxy is not None:
+        proxy.flush()
+
+
+def init_cart(app):
+    @app.after_request
+    def _flush_cart(response):
+        # буфер get_cart() пишется до отправки ответа: ошибка записи — это 500, а не потерянная корзина
+        flush_cart()
+        return response